@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Compares two result files of benchmarks/suite.py
+
+Lists the change of every metric and flags the ones that got worse by more
+than the threshold (10% by default). Exits with 1 if there are regressions.
+
+usage: python benchmarks/compare.py [--threshold 0.1] baseline.json current.json
+'''
+
+import sys
+import json
+import optparse
+
+
+def compare(baseline, current, threshold):
+	'''
+	returns a list of (name, baseline value, current value, relative change, regression)
+	the relative change is positive if the metric got better
+	'''
+	rows = list()
+	for name in sorted(set(baseline['metrics']) & set(current['metrics'])):
+		old, new = baseline['metrics'][name], current['metrics'][name]
+		if not old['value']:
+			continue
+		change = (new['value'] - old['value']) / float(old['value'])
+		if old['better']=='lower':
+			change = -change
+		rows.append((name, old['value'], new['value'], change, change < -threshold))
+	return rows
+
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage="usage: %prog [options] baseline.json current.json")
+	parser.add_option('--threshold', type='float', default=0.1, help="relative change counted as regression [%default]")
+	(options, args) = parser.parse_args()
+	if len(args)!=2:
+		parser.error("expected two result files")
+
+	baseline, current = json.load(open(args[0])), json.load(open(args[1]))
+	print "baseline: %s (%s)" % (baseline['meta'].get('commit'), baseline['meta'].get('timestamp'))
+	print "current:  %s (%s)" % (current['meta'].get('commit'), current['meta'].get('timestamp'))
+	print
+
+	regressions = 0
+	for name, old, new, change, regression in compare(baseline, current, options.threshold):
+		flag = regression and 'REGRESSION' or ''
+		unit = current['metrics'][name]['unit']
+		print "%-56s %12.2f -> %12.2f %-9s %+7.1f%% %s" % (name, old, new, unit, change * 100, flag)
+		if regression:
+			regressions += 1
+
+	missing = sorted(set(baseline['metrics']) - set(current['metrics']))
+	if missing:
+		print
+		print "missing in current: %s" % ', '.join(missing)
+
+	print
+	print "%d regression(s) beyond %.0f%%" % (regressions, options.threshold * 100)
+	sys.exit(regressions and 1 or 0)
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Microbenchmark for importer.CSVRecordSource
+
+Generates a CSV file (1M rows by default) and reports the rows/s of the
+current CSVRecordSource next to the former per-cell implementation.
+
+usage: python benchmarks/csv_record_source.py [rows]
+'''
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pycivi import importer
+
+COLUMNS = ['external_identifier', 'first_name', 'last_name', 'email', 'location_type', 'street_address', 'postal_code', 'city', 'country', 'ignored']
+MAPPING = {'country': 'country_id', 'ignored': None}
+TRANSFORMATIONS = {'location_type': {'H': 'Home', 'W': 'Work'}}
+
+
+class LegacyCSVRecordSource(importer.CSVRecordSource):
+	'''
+	the former implementation: UTF-8 round trip and per-cell lookups
+	'''
+	def __init__(self, csv_file, mapping=dict(), transformations=dict(), delimiter=','):
+		self.reader = importer.UnicodeReader(open(csv_file, 'rb'), 'excel', 'utf8', delimiter=delimiter, quotechar='"')
+		self.mapping = mapping
+		self.transformations = transformations
+		self.row_iterator = None
+		self.header = None
+
+	def __iter__(self):
+		self.row_iterator = self.reader.__iter__()
+		self.header = self.row_iterator.next()
+		return self
+
+	def next(self):
+		row = self.row_iterator.next()
+		record = dict()
+		for i in range(len(row)):
+			field = self.header[i]
+			data = row[i]
+			if field in self.mapping:
+				field = self.mapping[field]
+			if field!=None:
+				if field in self.transformations:
+					data = self.transformations[field].get(data, data)
+				record[field] = data
+		return record
+
+
+def generate(path, rows):
+	output = open(path, 'wb')
+	output.write(','.join(COLUMNS) + '\n')
+	for i in xrange(rows):
+		output.write('EXT-%d,J\xc3\xbcrgen,M\xc3\xbcller %d,jm%d@example.org,%s,"Hauptstra\xc3\x9fe %d, Hinterhaus",%05d,K\xc3\xb6ln,DE,x\n'
+			% (i, i % 97, i, random.choice('HW'), i % 300, i % 99999))
+	output.close()
+
+
+def measure(source_class, path):
+	timestamp = time.time()
+	count = 0
+	for record in source_class(path, MAPPING, TRANSFORMATIONS):
+		count += 1
+	return count, time.time()-timestamp
+
+
+if __name__ == '__main__':
+	rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+	path = tempfile.mktemp(suffix='.csv')
+	try:
+		print "Generating %d rows..." % rows
+		generate(path, rows)
+		for name, source_class in [('legacy', LegacyCSVRecordSource), ('CSVRecordSource', importer.CSVRecordSource)]:
+			count, runtime = measure(source_class, path)
+			print "%-16s %9d rows in %6.2fs: %10.0f rows/s" % (name, count, runtime, count/runtime)
+	finally:
+		if os.path.exists(path):
+			os.remove(path)
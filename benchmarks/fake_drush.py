@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Stand-in for drush, forwarding the API calls to a StandInServer
+
+Supports the two ways CiviCRM_DRUSH uses drush:
+  fake_drush.py -r ROOT -l SITE civicrm-api --out=json --in=json Entity.action
+  fake_drush.py -r ROOT -l SITE php-script drush_worker.php [batch IN OUT TRANSACTION_SIZE]
+
+Environment:
+  PYCIVI_STANDIN_URL              the stand-in's rest.php URL
+  PYCIVI_STANDIN_SITE_KEY/API_KEY keys for the stand-in (if any)
+  PYCIVI_FAKE_DRUSH_BOOTSTRAP     seconds to sleep on start-up, emulating the drush bootstrap
+'''
+
+import os
+import sys
+import json
+import time
+import urllib
+import urllib2
+
+WORKER_PREFIX = 'PYCIVI:'
+
+
+def execute(entity, action, params):
+	query = {
+		'entity':  entity,
+		'action':  action,
+		'key':     os.environ.get('PYCIVI_STANDIN_SITE_KEY', ''),
+		'api_key': os.environ.get('PYCIVI_STANDIN_API_KEY', ''),
+		'json':    json.dumps(params),
+	}
+	try:
+		reply = urllib2.urlopen(os.environ['PYCIVI_STANDIN_URL'], urllib.urlencode(query))
+		return json.loads(reply.read())
+	except Exception as error:
+		return {'is_error': 1, 'error_message': str(error)}
+
+
+def execute_request(request):
+	if request.get('ping'):
+		return {'is_error': 0, 'pong': 1}
+	return execute(request['entity'], request['action'], request.get('params', dict()))
+
+
+def reply(data, output=None):
+	if output:
+		output.write(json.dumps(data) + '\n')
+	else:
+		sys.stdout.write(WORKER_PREFIX + json.dumps(data) + '\n')
+		sys.stdout.flush()
+
+
+def main(args):
+	time.sleep(float(os.environ.get('PYCIVI_FAKE_DRUSH_BOOTSTRAP', 0)))
+
+	# drop the global options
+	while args and args[0] in ('-r', '-l'):
+		args = args[2:]
+	command, args = args[0], args[1:]
+
+	if command=='civicrm-api':
+		entity, action = [arg for arg in args if not arg.startswith('--')][0].split('.', 1)
+		print json.dumps(execute(entity, action, json.loads(sys.stdin.read() or '{}')))
+
+	elif command=='php-script':
+		args = args[1:]
+		if args and args[0]=='batch':
+			calls = open(args[1])
+			output = None
+			if len(args) > 2 and args[2]!='-':
+				output = open(args[2], 'w')
+			for line in calls:
+				if line.strip():
+					reply(execute_request(json.loads(line)), output)
+			if output:
+				output.close()
+		else:
+			for line in iter(sys.stdin.readline, ''):
+				reply(execute_request(json.loads(line)))
+	else:
+		sys.stderr.write("fake_drush: unknown command '%s'\n" % command)
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Throughput and tail latency of importer.parallelize under simulated server faults
+
+Runs import_contact_email against a StandInServer with each fault profile
+(see pycivi/faults.py), for every combination of worker count and
+ApiCallRepeater retakes, and reports records/s, record latency percentiles
+and the number of failed records.
+
+usage: python benchmarks/fault_profiles.py [options]   (see --help)
+'''
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pycivi import importer, CiviCRM_REST
+from pycivi.faults import FaultProfile
+from pycivi.standin_server import StandInAPI, StandInServer
+from suite import percentile
+
+PROFILES = {
+	'baseline':    dict(latency=0.005),
+	'lognormal':   dict(latency={'distribution': 'lognormal', 'median': 0.005, 'sigma': 1.0, 'max': 2.0}),
+	'heavy_tail':  dict(latency={'distribution': 'mixture', 'components': [
+						{'weight': 0.98, 'distribution': 'uniform', 'low': 0.002, 'high': 0.008},
+						{'weight': 0.02, 'distribution': 'pareto', 'scale': 0.1, 'alpha': 1.2, 'max': 5.0}]}),
+	'5xx_bursts':  dict(latency=0.005, burst_rate=0.01, burst_length=10, error_status=503),
+	'5xx_random':  dict(latency=0.005, error_rate=0.02, error_status=502),
+	'slow_create': dict(latency=0.005, write_latency={'distribution': 'lognormal', 'median': 0.05, 'sigma': 0.5}),
+	'resets':      dict(latency=0.005, reset_rate=0.01),
+	'414':         dict(latency=0.005, max_url_length=172),	# the lookups from EXT-100 on are too long
+}
+
+
+class TimedImport:
+	'''
+	wraps an import function, timing every record (parallelize passes one record per call)
+	'''
+	def __init__(self, import_function):
+		self.import_function = import_function
+		self.__name__ = import_function.__name__
+		self.latencies = list()
+		self.failed = 0
+		self.lock = threading.Lock()
+
+	def __call__(self, civicrm, records, parameters):
+		timestamp = time.time()
+		try:
+			self.import_function(civicrm, records, parameters)
+		except:
+			self.lock.acquire()
+			self.failed += len(records)
+			self.lock.release()
+			raise
+		finally:
+			runtime = time.time() - timestamp
+			self.lock.acquire()
+			self.latencies.append(runtime)
+			self.lock.release()
+
+
+def run(profile_name, workers, retakes, options):
+	faults = FaultProfile(seed=options.seed, **PROFILES[profile_name])
+	api = StandInAPI(fixtures={'LocationType': [{'name': 'Home'}]})
+	api.load({'Contact': [{'contact_type': 'Individual', 'external_identifier': 'EXT-%d' % i} for i in xrange(options.records)]})
+	server = StandInServer(('127.0.0.1', 0), api, faults).start()
+	try:
+		civicrm = CiviCRM_REST.CiviCRM_REST(server.url, 'site_key', 'api_key')
+		logging.getLogger('pycivi').setLevel(logging.CRITICAL)
+		CiviCRM_REST.api_call_repeater.RETAKES = retakes
+		CiviCRM_REST.api_call_repeater.SLEEP = options.retry_sleep
+
+		records = [{'external_identifier': 'EXT-%d' % i, 'email': 'e%d@example.org' % i, 'location_type': 'Home'}
+			for i in xrange(options.records)]
+		timed_import = TimedImport(importer.import_contact_email)
+		timestamp = time.time()
+		importer.parallelize(civicrm, timed_import, workers, records)
+		runtime = time.time() - timestamp
+	finally:
+		server.stop()
+
+	result = {
+		'profile':            profile_name,
+		'workers':            workers,
+		'retakes':            retakes,
+		'records_per_second': len(timed_import.latencies) / runtime,
+		'latency_p50':        percentile(timed_import.latencies, 0.5),
+		'latency_p95':        percentile(timed_import.latencies, 0.95),
+		'latency_p99':        percentile(timed_import.latencies, 0.99),
+		'failed_records':     timed_import.failed,
+	}
+	result.update(faults.statistics())
+	return result
+
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage="usage: %prog [options]")
+	parser.add_option('--profiles', default=','.join(sorted(PROFILES)), help="fault profiles to run [%default]")
+	parser.add_option('--workers', default='1,4', help="parallelize worker counts [%default]")
+	parser.add_option('--retakes', default='0,3', help="ApiCallRepeater.RETAKES values [%default]")
+	parser.add_option('--retry-sleep', type='float', default=0.05, help="ApiCallRepeater.SLEEP [%default]")
+	parser.add_option('--records', type='int', default=200, help="records per run [%default]")
+	parser.add_option('--seed', type='int', default=1, help="random seed for the fault profiles [%default]")
+	parser.add_option('--output', default=None, help="write the results as JSON")
+	(options, args) = parser.parse_args()
+
+	results = list()
+	print "%-12s %7s %7s %10s %9s %9s %9s %7s %7s %7s" % ('profile', 'workers', 'retakes', 'records/s', 'p50 ms', 'p95 ms', 'p99 ms', 'failed', 'errors', 'resets')
+	for profile_name in options.profiles.split(','):
+		for workers in [int(count) for count in options.workers.split(',')]:
+			for retakes in [int(count) for count in options.retakes.split(',')]:
+				result = run(profile_name, workers, retakes, options)
+				results.append(result)
+				print "%-12s %7d %7d %10.1f %9.1f %9.1f %9.1f %7d %7d %7d" % (profile_name, workers, retakes,
+					result['records_per_second'], result['latency_p50'] * 1000, result['latency_p95'] * 1000,
+					result['latency_p99'] * 1000, result['failed_records'], result['errors'], result['resets'])
+
+	if options.output:
+		json.dump(results, open(options.output, 'w'), indent=2, sort_keys=True)
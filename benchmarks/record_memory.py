@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Memory benchmark for buffered records
+
+Reads 100k records (by default) from a generated CSV file into a list, once as
+plain dicts and once as CompactRecords, and reports the memory used per
+100k buffered records. Each variant is measured in a forked process.
+
+usage: python benchmarks/record_memory.py [records]
+'''
+
+import os
+import sys
+import gc
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pycivi import importer
+from csv_record_source import generate, MAPPING, TRANSFORMATIONS
+
+
+def resident_memory():
+	'''
+	current resident set size in bytes (Linux)
+	'''
+	statm = open('/proc/self/statm').read().split()
+	return int(statm[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(path, compact):
+	read_pipe, write_pipe = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read_pipe)
+		source = importer.CSVRecordSource(path, MAPPING, TRANSFORMATIONS, compact=compact)
+		gc.collect()
+		before = resident_memory()
+		buffered = list(source)
+		gc.collect()
+		used = resident_memory() - before
+		os.write(write_pipe, '%d %d' % (len(buffered), used))
+		os._exit(0)
+	os.close(write_pipe)
+	result = os.read(read_pipe, 100)
+	os.waitpid(pid, 0)
+	count, used = result.split()
+	return int(count), int(used)
+
+
+if __name__ == '__main__':
+	records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	path = tempfile.mktemp(suffix='.csv')
+	try:
+		generate(path, records)
+		for name, compact in [('dict', False), ('CompactRecord', True)]:
+			count, used = measure(path, compact)
+			print "%-14s %8.1f MB per 100k records (%d bytes/record)" % (name, used * 100000.0 / count / 1048576, used / count)
+	finally:
+		if os.path.exists(path):
+			os.remove(path)
@@ -0,0 +1,371 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark suite for the transports and importers
+
+Runs against an in-process StandInServer (see pycivi/standin_server.py), so no
+CiviCRM installation is needed. Measures:
+  transport.*   per-call latency (p50/p95/p99) and throughput of CiviCRM_REST,
+                CiviCRM_DRUSH (with benchmarks/fake_drush.py) and CiviCRM_BRIDGED
+  importer.*    records/s of the importer.import_* functions on synthetic data
+  roundtrips.*  API calls per record of each importer, and how many of them
+                could be batched or cached (see pycivi/roundtrips.py)
+  scaling.*     records/s of importer.parallelize for different worker counts
+                (with the worker throttle switched off)
+
+The results are written as JSON, compare them with benchmarks/compare.py.
+Metrics that couldn't be measured because calls failed are listed under
+'failures', and the run exits with status 1.
+
+usage: python benchmarks/suite.py [options]   (see --help)
+'''
+
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import threading
+import subprocess
+import optparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pycivi import importer, CiviCRM_REST, CiviCRM_DRUSH, CiviCRM_BRIDGED
+from pycivi.standin_server import StandInAPI, StandInServer
+from pycivi.roundtrips import RoundTripAnalyser
+
+FAKE_DRUSH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_drush.py')
+
+
+def percentile(samples, fraction):
+	samples = sorted(samples)
+	if not samples:
+		return 0.0
+	index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+	return samples[index]
+
+
+class Results:
+	'''
+	collects the metrics: name => {'value': v, 'unit': u, 'better': 'lower'|'higher'}
+	'''
+	def __init__(self):
+		self.metrics = dict()
+		self.failures = dict()
+
+	def add(self, name, value, unit, better):
+		self.metrics[name] = {'value': value, 'unit': unit, 'better': better}
+		print "  %-56s %12.2f %s" % (name, value, unit)
+
+	def fail(self, name, message):
+		'''
+		the metric couldn't be measured, the run will exit with an error
+		'''
+		self.failures[name] = message
+		print "  %-56s FAILED: %s" % (name, message)
+
+	def addLatencies(self, prefix, samples):
+		if not samples:
+			self.fail('%s.latency' % prefix, "no samples")
+			return
+		for label, fraction in [('p50', 0.5), ('p95', 0.95), ('p99', 0.99)]:
+			self.add('%s.latency_%s' % (prefix, label), percentile(samples, fraction) * 1000, 'ms', 'lower')
+
+
+def fixtures():
+	'''
+	the option values and types the importers look up
+	'''
+	groups = ['payment_instrument', 'contribution_status', 'campaign_type', 'campaign_status',
+		'website_type', 'phone_type', 'individual_prefix', 'postal_greeting', 'email_greeting']
+	values = {
+		'payment_instrument':  ['Cash', 'EFT'],
+		'contribution_status': ['Completed', 'Pending'],
+		'campaign_type':       ['Direct Mail'],
+		'campaign_status':     ['Planned'],
+		'website_type':        ['Work', 'Main'],
+		'phone_type':          ['Phone', 'Mobile'],
+		'individual_prefix':   ['Dr.', 'Mr.', 'Ms.'],
+		'postal_greeting':     ['Dear {contact.first_name}'],
+		'email_greeting':      ['Dear {contact.first_name}'],
+	}
+	option_values = list()
+	for group_id, group in enumerate(groups):
+		for value, name in enumerate(values[group]):
+			option_values.append({'option_group_id': group_id + 1, 'name': name, 'label': name, 'value': value + 1})
+	return {
+		'OptionGroup':      [{'name': group} for group in groups],
+		'OptionValue':      option_values,
+		'LocationType':     [{'name': name} for name in ['Home', 'Work', 'Main']],
+		'MembershipType':   [{'name': 'General'}],
+		'MembershipStatus': [{'name': name} for name in ['New', 'Current', 'Expired']],
+	}
+
+
+def contact_records(count):
+	return [{'external_identifier': 'EXT-%d' % i, 'contact_type': 'Individual',
+		'first_name': u'J\xfcrgen', 'last_name': u'M\xfcller %d' % i} for i in xrange(count)]
+
+
+# name => (import function, record factory(i), parameters)
+IMPORTERS = [
+	('import_contact_base', importer.import_contact_base,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'contact_type': 'Individual', 'first_name': u'J\xfcrgen', 'last_name': u'M\xfcller %d' % i}, {}),
+	('import_contact_with_dupe_check', importer.import_contact_with_dupe_check,
+		lambda i: {'external_identifier': 'DUP-%d' % i, 'contact_type': 'Individual', 'first_name': 'Dupe', 'last_name': 'Check %d' % i}, {}),
+	('import_contact_email', importer.import_contact_email,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'email': 'jm%d@example.org' % i, 'location_type': 'Home'}, {}),
+	('import_contact_phone', importer.import_contact_phone,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'phone': '+49 221 %07d' % i, 'phone_type': 'Phone', 'location_type': 'Home'}, {}),
+	('import_contact_website', importer.import_contact_website,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'url': 'http://example.org/%d' % i, 'website_type': 'Work'}, {}),
+	('import_contact_email_chunked', importer.import_contact_email,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'email': 'jm%d@example.com' % i, 'location_type': 'Work'}, {'chunk_size': 50}),
+	('import_contact_phone_chunked', importer.import_contact_phone,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'phone': '+49 228 %07d' % i, 'phone_type': 'Phone', 'location_type': 'Work'}, {'chunk_size': 50}),
+	('import_contact_website_chunked', importer.import_contact_website,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'url': 'http://example.com/%d' % i, 'website_type': 'Main'}, {'chunk_size': 50}),
+	('import_contact_address', importer.import_contact_address,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'street_address': u'Hauptstra\xdfe %d' % i, 'postal_code': '%05d' % i, 'city': u'K\xf6ln', 'location_type': 'Home'}, {}),
+	('import_contact_address_chunked', importer.import_contact_address,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'street_address': u'Hauptstra\xdfe %d' % i, 'postal_code': '%05d' % i, 'city': u'Bonn', 'location_type': 'Work'},
+		{'chunk_size': 50, 'geocode': 'defer'}),
+	('import_contact_prefix', importer.import_contact_prefix,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'prefix': 'Dr.'}, {}),
+	('import_contact_greeting', importer.import_contact_greeting,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'postal_greeting': 'Dear {contact.first_name}'}, {}),
+	('import_contact_tags', importer.import_contact_tags,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'Donor': 'x', 'Volunteer': i % 2 and 'x' or ''}, {}),
+	('import_contact_groups', importer.import_contact_groups,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'Newsletter': 'x', 'Members': i % 2 and 'x' or ''}, {}),
+	('import_contact_tags_chunked', importer.import_contact_tags,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'Donor': '', 'Volunteer': i % 3 and 'x' or ''}, {'chunk_size': 50}),
+	('import_contact_groups_chunked', importer.import_contact_groups,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'Newsletter': '', 'Members': i % 3 and 'x' or ''}, {'chunk_size': 50}),
+	('import_membership', importer.import_membership,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'membership_type_id': '1', 'status': 'Current', 'join_date': '2013-01-01', 'start_date': '2013-01-01'}, {}),
+	('import_membership_chunked', importer.import_membership,
+		lambda i: {'external_identifier': 'EXT-%d' % i, 'membership_type_id': '1', 'status': 'Expired', 'join_date': '2013-01-01', 'end_date': '2014-12-31'}, {'chunk_size': 50}),
+	('import_contributions', importer.import_contributions,
+		lambda i: {'contact_external_identifier': 'EXT-%d' % i, 'total_amount': '10.00', 'financial_type_id': '1', 'payment_instrument': 'Cash', 'contribution_status': 'Completed', 'trxn_id': 'TRXN-%d' % i}, {}),
+	('import_rcontributions', importer.import_rcontributions,
+		lambda i: {'contact_external_identifier': 'EXT-%d' % i, 'amount': '10.00', 'frequency_unit': 'month', 'payment_instrument': 'EFT', 'contribution_status': 'Pending'}, {}),
+	('import_campaigns', importer.import_campaigns,
+		lambda i: {'name': 'campaign_%d' % i, 'title': 'Campaign %d' % i, 'campaign_type': 'Direct Mail', 'status': 'Planned'}, {'id': 'name'}),
+	('import_notes', importer.import_notes,
+		lambda i: {'lookup_type': 'Contact', 'lookup_identifier_key': 'external_identifier', 'lookup_identifier_value': 'EXT-%d' % i, 'subject': 'Note', 'note': 'Imported note %d' % i}, {}),
+	('import_delete_entity', importer.import_delete_entity,
+		lambda i: {'external_identifier': 'DUP-%d' % i}, {'identifiers': ['external_identifier']}),
+]
+
+
+def measure_calls(civicrm, calls, threads=1, call=None):
+	'''
+	runs the calls (split among the threads), returns (latencies, calls/s, errors).
+	Only the successful calls are in latencies, errors is (failed calls, first error)
+	'''
+	call = call or (lambda i: civicrm.performAPICall({'entity': 'Contact', 'action': 'get', 'id': (i % 100) + 1}))
+	latencies = list()
+	errors = [0, None]
+	lock = threading.Lock()
+	def run(offset):
+		samples = list()
+		failed, first_error = 0, None
+		for i in xrange(offset, calls, threads):
+			timestamp = time.time()
+			try:
+				if call(i)==None:
+					raise Exception("no result")
+			except Exception as error:
+				failed += 1
+				first_error = first_error or (unicode(error) or error.__class__.__name__)
+				continue
+			samples.append(time.time() - timestamp)
+		lock.acquire()
+		latencies.extend(samples)
+		errors[0] += failed
+		errors[1] = errors[1] or first_error
+		lock.release()
+
+	timestamp = time.time()
+	thread_list = [threading.Thread(target=run, args=(offset,)) for offset in range(threads)]
+	for thread in thread_list:
+		thread.start()
+	for thread in thread_list:
+		thread.join()
+	return latencies, calls / (time.time() - timestamp), tuple(errors)
+
+
+def drush_launcher(directory):
+	'''
+	an executable running fake_drush.py with this python (its shebang might find another one)
+	'''
+	path = os.path.join(directory, 'drush')
+	launcher = open(path, 'w')
+	launcher.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, FAKE_DRUSH))
+	launcher.close()
+	os.chmod(path, 0755)
+	return path
+
+
+def bench_transports(results, server, options):
+	print "Transports (%d calls, %d threads for throughput):" % (options.calls, options.threads)
+	os.environ['PYCIVI_STANDIN_URL'] = server.rest_url
+	os.environ['PYCIVI_FAKE_DRUSH_BOOTSTRAP'] = str(options.drush_bootstrap)
+
+	launcher_directory = tempfile.mkdtemp(prefix='pycivi-drush-')
+	drush = drush_launcher(launcher_directory)
+	rest = CiviCRM_REST.CiviCRM_REST(server.url, 'site_key', 'api_key')
+	transports = [
+		('rest', rest, options.calls),
+		('drush', CiviCRM_DRUSH.CiviCRM_DRUSH('.', drush), options.drush_calls),
+		('drush_workers', CiviCRM_DRUSH.CiviCRM_DRUSH('.', drush, options={'workers': options.threads}), options.calls),
+		('bridged', CiviCRM_BRIDGED.CiviCRM_BRIDGED(rest, options={'bridge_pool': 1}), options.calls),
+	]
+	quiet()
+	for name, civicrm, calls in transports:
+		latencies, throughput, (failed, error) = measure_calls(civicrm, calls)
+		if failed:
+			results.fail('transport.%s.latency' % name, "%d of %d calls failed: %s" % (failed, calls, error))
+		else:
+			results.addLatencies('transport.%s' % name, latencies)
+		latencies, throughput, (failed, error) = measure_calls(civicrm, calls, options.threads)
+		if failed:
+			results.fail('transport.%s.throughput' % name, "%d of %d calls failed: %s" % (failed, calls, error))
+		else:
+			results.add('transport.%s.throughput' % name, throughput, 'calls/s', 'higher')
+
+		if name=='bridged':
+			timestamp = time.time()
+			futures = [civicrm.submitAPICall({'entity': 'Contact', 'action': 'get', 'id': (i % 100) + 1}) for i in xrange(calls)]
+			failed = 0
+			for future in futures:
+				if future.exception() or future.result()==None:
+					failed += 1
+			if failed:
+				results.fail('transport.bridged_pipelined.throughput', "%d of %d calls failed" % (failed, calls))
+			else:
+				results.add('transport.bridged_pipelined.throughput', calls / (time.time() - timestamp), 'calls/s', 'higher')
+		if hasattr(civicrm, 'close'):
+			civicrm.close()
+	os.remove(drush)
+	os.rmdir(launcher_directory)
+
+
+def bench_importers(results, server, options):
+	print "Importers (%d records each):" % options.records
+	civicrm = CiviCRM_REST.CiviCRM_REST(server.url, 'site_key', 'api_key')
+	quiet()
+	for name, import_function, record_factory, parameters in IMPORTERS:
+		if options.importers and not name in options.importers.split(','):
+			continue
+		records = [record_factory(i) for i in xrange(options.records)]
+		timestamp = time.time()
+		import_function(civicrm, records, dict(parameters))
+		results.add('importer.%s.records_per_second' % name, options.records / (time.time() - timestamp), 'records/s', 'higher')
+
+
+def bench_roundtrips(results, server, options):
+	print "API round trips per record (%d records each):" % options.roundtrip_records
+	civicrm = CiviCRM_REST.CiviCRM_REST(server.url, 'site_key', 'api_key')
+	reports = list()
+	for name, import_function, record_factory, parameters in IMPORTERS:
+		if options.importers and not name in options.importers.split(','):
+			continue
+		# one analyser per entry, the chunked variants share their function's name
+		analyser = RoundTripAnalyser(civicrm)
+		quiet()
+		import_function(analyser, [record_factory(i) for i in xrange(options.roundtrip_records)], dict(parameters))
+		# (import_contact_tags is traced as import_entity_tags)
+		functions = analyser.analyse()
+		stats = functions and max(functions.values(), key=lambda stats: stats['records'])
+		if stats and stats['records']:
+			results.add('roundtrips.%s.calls_per_record' % name, stats['calls'] / float(stats['records']), 'calls', 'lower')
+			results.add('roundtrips.%s.avoidable_per_record' % name, stats['avoidable'] / float(stats['records']), 'calls', 'lower')
+			reports.append(name + ':' + analyser.report().split(':', 1)[1])
+	print '\n'.join(reports)
+
+
+def bench_scaling(results, server, options):
+	workers = [int(count) for count in options.workers.split(',')]
+	print "parallelize scaling (%d records, %sms latency, no worker throttle):" % (options.scaling_records, options.scaling_latency * 1000)
+	server.api.latency = options.scaling_latency
+	civicrm = CiviCRM_REST.CiviCRM_REST(server.url, 'site_key', 'api_key')
+	quiet()
+	for count in workers:
+		records = [{'external_identifier': 'EXT-%d' % i, 'email': 'w%d-%d@example.org' % (count, i), 'location_type': 'Work'}
+			for i in xrange(options.scaling_records)]
+		timestamp = time.time()
+		# without the default 0.1s pause per record, that would be most of what's measured
+		importer.parallelize(civicrm, importer.import_contact_email, count, records, {'throttle': 0})
+		results.add('scaling.workers_%d.records_per_second' % count, options.scaling_records / (time.time() - timestamp), 'records/s', 'higher')
+	server.api.latency = 0.0
+
+
+def quiet():
+	'''
+	only log warnings and errors (new CiviCRM instances reset the level)
+	'''
+	logging.getLogger('pycivi').setLevel(logging.WARN)
+
+
+def git_commit():
+	try:
+		return subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'),
+			cwd=os.path.dirname(os.path.abspath(__file__))).communicate()[0].strip()
+	except OSError:
+		return None
+
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage="usage: %prog [options]")
+	parser.add_option('--output', default='benchmark-results.json', help="JSON result file [%default]")
+	parser.add_option('--only', default='transports,importers,roundtrips,scaling', help="benchmark groups to run [%default]")
+	parser.add_option('--calls', type='int', default=500, help="calls per transport [%default]")
+	parser.add_option('--drush-calls', type='int', default=50, help="calls for drush with a process per call [%default]")
+	parser.add_option('--drush-bootstrap', type='float', default=0.0, help="emulated drush bootstrap time in seconds [%default]")
+	parser.add_option('--threads', type='int', default=4, help="threads for the throughput measurements [%default]")
+	parser.add_option('--records', type='int', default=200, help="records per importer [%default]")
+	parser.add_option('--importers', default=None, help="comma separated importers to run (default: all)")
+	parser.add_option('--roundtrip-records', type='int', default=50, help="records per importer for the round trip analysis [%default]")
+	parser.add_option('--workers', default='1,2,4,8', help="parallelize worker counts [%default]")
+	parser.add_option('--scaling-records', type='int', default=100, help="records per worker count [%default]")
+	parser.add_option('--scaling-latency', type='float', default=0.005, help="stand-in latency for the scaling runs [%default]")
+	(options, args) = parser.parse_args()
+
+	server = StandInServer(('127.0.0.1', 0), StandInAPI(fixtures=fixtures())).start()
+	server.api.load({'Contact': contact_records(100)})
+
+	results = Results()
+	groups = options.only.split(',')
+	try:
+		if 'transports' in groups:
+			bench_transports(results, server, options)
+		if 'importers' in groups:
+			bench_importers(results, server, options)
+		if 'roundtrips' in groups:
+			bench_roundtrips(results, server, options)
+		if 'scaling' in groups:
+			bench_scaling(results, server, options)
+	finally:
+		server.stop()
+
+	output = {
+		'meta': {
+			'commit':    git_commit(),
+			'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+			'python':    platform.python_version(),
+			'platform':  platform.platform(),
+			'options':   vars(options),
+		},
+		'metrics': results.metrics,
+		'failures': results.failures,
+	}
+	json.dump(output, open(options.output, 'w'), indent=2, sort_keys=True)
+	print "Results written to %s" % options.output
+	if results.failures:
+		print "%d metrics FAILED: %s" % (len(results.failures), ', '.join(sorted(results.failures)))
+		sys.exit(1)
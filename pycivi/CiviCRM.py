@@ -38,12 +38,39 @@ import time
 import threading
 import os
 import traceback
+import metrics
+import tracing
+import log_handlers
 
 from CiviEntity import *
 
 class CiviAPIException(Exception):
 	pass
 
+class CiviTransportException(CiviAPIException):
+	"""
+	the call didn't get through to CiviCRM (or its reply got lost),
+	another backend can be tried (see CiviCRM_ROUTED)
+	"""
+	pass
+
+def _matchKey(value):
+	"""
+	the value the way the database compares it: case and trailing spaces don't matter
+	"""
+	return unicode(value).rstrip().lower()
+
+
+def _errorResult(error):
+	"""
+	the API result standing in for a call that raised the given exception
+	"""
+	message = getattr(error, 'msg', None)
+	if message == None:
+		message = error.args[0] if len(error.args) == 1 else error
+	return {'is_error': 1, 'error_message': log_handlers._text(message)}
+
+
 class CiviCRM:
 
 	def __init__(self, url, site_key, user_key, logfile=None):
@@ -57,35 +84,43 @@ class CiviCRM:
 		# set up logging
 		self.logger_format = u"%(level)s;%(type)s;%(entity_type)s;%(first_id)s;%(second_id)s;%(duration)sms;%(thread_id)s;%(text)s"
 		self._logger = logging.getLogger('pycivi')
-		self._logger.setLevel(logging.DEBUG)
-
-		# add the console logger
-		logger1 = logging.StreamHandler()
-		logger1.setLevel(logging.INFO)
-		class MessageOnly(logging.Formatter):
-			def format(self, record):
-				return logging.Formatter.format(self, record).split(';')[-1]
-		logger1.setFormatter(MessageOnly())
-		self._logger.addHandler(logger1)
-
-		# add the file logger
+		self._log_writer = log_handlers.getQueueWriter(self._logger)
+
+		# add the console logger (once, it's shared by all instances)
+		if not self._log_writer.findTarget(lambda handler: isinstance(handler, log_handlers.BatchStreamHandler)):
+			logger1 = log_handlers.BatchStreamHandler()
+			logger1.setLevel(logging.INFO)
+			class MessageOnly(logging.Formatter):
+				def format(self, record):
+					return logging.Formatter.format(self, record).split(';')[-1]
+			logger1.setFormatter(MessageOnly())
+			self._log_writer.addTarget(logger1)
+
+		# add the file logger, logfile can also be a handler (e.g. a rotating log_handlers.BatchFileHandler)
 		if logfile:
-			if not os.path.exists(logfile):
-				log = open(logfile, 'w')
-				log.write("timestamp;level;module;entity_type;primary_id;secondary_id;execution_time;thread;message\n")
-				log.flush()
-				log.close()
+			if isinstance(logfile, logging.Handler):
+				logger2 = logfile
+			else:
+				logger2 = self._log_writer.findTarget(lambda handler: getattr(handler, 'baseFilename', None)==os.path.abspath(logfile))
+			if not logger2 in self._log_writer.targets:
+				if not logger2:
+					logger2 = log_handlers.BatchFileHandler(logfile)
+				logger2.setLevel(logging.DEBUG)
+				logger2.setFormatter(logging.Formatter(u'%(asctime)s;%(message)s'))
+				self._log_writer.addTarget(logger2)
 
-			logger2 = logging.FileHandler(logfile, mode='a')
-			logger2.setLevel(logging.DEBUG)
-			logger2.setFormatter(logging.Formatter(u'%(asctime)s;%(message)s'))
-			self._logger.addHandler(logger2)
+		# records no target would write are dropped before they're built
+		self._logger.setLevel(min([self._log_writer.targetLevel()] + [handler.level for handler in self._logger.handlers if handler!=self._log_writer]))
 
 		# some more internal attributes
 		self.debug = False
 		self.api_version = 3
 		self._api_calls = 0
 		self._api_calls_time = 0.0
+		self._api_calls_lock = threading.Lock()
+		self.metrics = metrics.registry
+		self.metrics_name = self.__class__.__name__
+		self.tracer = None
 
 
 	def _getLevelString(self, level):
@@ -105,10 +140,17 @@ class CiviCRM:
 		else:
 			return 'UNKNOWN'
 
-	def log(self, message, level=logging.INFO, type='Unknown', command='Unknown', entity_type='', first_id='', second_id='', duration='0'):
+	def log(self, message, level=logging.INFO, type='Unknown', command='Unknown', entity_type='', first_id='', second_id='', duration='0', args=None):
 		"""
 		formally log information.
+
+		If args are given, message is only formatted with them when the record
+		is written, e.g. log(u"Wrote contact '%s'", logging.INFO, ..., args=(entity,))
 		"""
+		if not self._logger.isEnabledFor(level):
+			return
+		if args:
+			message = log_handlers.LazyMessage(message, args)
 		try:
 			duration = str(int(duration * 1000))
 		except:
@@ -129,15 +171,53 @@ class CiviCRM:
 		"""
 		log current exception (in except: block)
 		"""
+		if not self._logger.isEnabledFor(level):
+			return
 		exception_text = ' >> ' + traceback.format_exc() + ' <<'
 		exception_text = exception_text.replace('\x0A', '  ||')
 		self.log(message + exception_text, level, type, command, entity_type, first_id, second_id, duration)
 
 
+	def _recordCall(self, entity, action, runtime, error=False, bytes_in=0, bytes_out=0):
+		"""
+		count a completed API call, see metrics.MetricsRegistry
+		"""
+		self._api_calls_lock.acquire()
+		self._api_calls += 1
+		self._api_calls_time += runtime
+		self._api_calls_lock.release()
+		self.metrics.observeCall(self.metrics_name, entity, action, runtime, error, bytes_in, bytes_out)
+		if self.tracer:
+			self.tracer.record('API %s.%s' % (entity, action), runtime, None, error and 'failed' or None)
+
+	def _cacheLookup(self, cache, hit):
+		"""
+		count a lookup_cache hit or miss
+		"""
+		self.metrics.observeCache(cache, hit)
+		return hit
+
+
 	def performAPICall(self, params=dict()):
 		raise NotImplementedError("You need to use a CiviCRM implementation like CiviCRM_DRUSH or CiviCRM_REST!")
 
 
+	def performAPICalls(self, calls):
+		"""
+		perform all the given calls, returns their results in the same order.
+		A call that fails doesn't stop the others, its result is
+		{'is_error': 1, 'error_message': ...} instead.
+		Backends that can pipeline calls (e.g. CiviCRM_BRIDGED) override this
+		"""
+		results = list()
+		for params in calls:
+			try:
+				results.append(self.performAPICall(params))
+			except Exception as error:
+				results.append(_errorResult(error))
+		return results
+
+
 	def probe(self):
 		# check by calling get contact
 		try:
@@ -147,6 +227,7 @@ class CiviCRM:
 			return False
 
 
+	@tracing.traced
 	def load(self, entity_type, entity_id):
 		result = self.performAPICall({'entity':entity_type, 'action':'get', 'id':entity_id})
 		if result['count']:
@@ -156,6 +237,7 @@ class CiviCRM:
 
 
 
+	@tracing.traced
 	def getEntity(self, entity_type, attributes, primary_attributes=['id','external_identifier']):
 		timestamp = time.time()
 
@@ -182,8 +264,8 @@ class CiviCRM:
 			raise CiviAPIException("Query result not unique, please provide a unique query for 'getEntity'.")
 		elif result['count']==1:
 			entity = self._createEntity(entity_type, result['values'][0])
-			self.log("Entity found: %s" % unicode(str(entity), 'utf8'),
-				logging.DEBUG, 'pycivi', 'get', entity_type, first_key, None, time.time()-timestamp)
+			self.log("Entity found: %s",
+				logging.DEBUG, 'pycivi', 'get', entity_type, first_key, None, time.time()-timestamp, args=(entity,))
 			return entity
 		else:
 			self.log("Entity not found.",
@@ -191,6 +273,7 @@ class CiviCRM:
 			return None
 
 
+	@tracing.traced
 	def getEntities(self, entity_type, attributes, primary_attributes=['id','external_identifier']):
 		timestamp = time.time()
 
@@ -226,6 +309,38 @@ class CiviCRM:
 		return entities
 
 
+	@tracing.traced
+	def getContactEntities(self, entity_type, contact_ids, attributes=dict()):
+		"""
+		all entities of the given type (e.g. 'Email') belonging to the given contacts, with one call.
+		attributes can narrow them down further, e.g. {'location_type_id': {'IN': [1, 2]}}
+		Returns a dict str(contact_id) => list of entities
+		"""
+		timestamp = time.time()
+		entities = dict([(str(contact_id), list()) for contact_id in contact_ids])
+		if not entities:
+			return entities
+
+		query = dict(attributes)
+		query['entity'] = entity_type
+		query['action'] = 'get'
+		query['contact_id'] = {'IN': entities.keys()}
+		query['options'] = {'limit': 0}		# option.limit wouldn't work inside the json block
+		result = self.performAPICall(query)
+		if result['is_error']:
+			raise CiviAPIException(result['error_message'])
+
+		values = result['values']
+		if type(values) == dict:
+			values = [values[entity_id] for entity_id in sorted(values, key=int)]
+		for entity_data in values:
+			entities.setdefault(str(entity_data.get('contact_id')), list()).append(self._createEntity(entity_type, entity_data))
+		self.log("Found %d %s entities for %d contacts." % (len(values), entity_type, len(contact_ids)),
+			logging.DEBUG, 'pycivi', 'get', entity_type, None, None, time.time()-timestamp)
+		return entities
+
+
+	@tracing.traced
 	def createEntity(self, entity_type, attributes):
 		"""
 		simply creates a new entity of the given type
@@ -240,6 +355,7 @@ class CiviCRM:
 		return self._createEntity(entity_type, result['values'][0])
 
 
+	@tracing.traced
 	def createOrUpdate(self, entity_type, attributes, update_type='update', primary_attributes=[u'id', u'external_identifier']):
 		query = dict()
 		for key in primary_attributes:
@@ -282,6 +398,7 @@ class CiviCRM:
 					return self._createEntity(entity_type, result['values'][0])
 
 
+	@tracing.traced
 	def createIfNotExists(self, entity_type, attributes, primary_attributes=[u'id', u'external_identifier']):
 		timestamp = time.time()
 		query = dict()
@@ -322,6 +439,7 @@ class CiviCRM:
 	###########################################################################
 
 
+	@tracing.traced
 	def getContactID(self, attributes, primary_attributes=['external_identifier'], search_deleted=True):
 		timestamp = time.time()
 		if attributes.has_key('id'):
@@ -370,6 +488,71 @@ class CiviCRM:
 			return 0
 
 
+	@tracing.traced
+	def getContactIDs(self, values, primary_attribute='external_identifier', search_deleted=True):
+		"""
+		resolves a whole list of (e.g.) external identifiers with one call (two, if some
+		have to be looked up in the deleted contacts).
+		Returns a dict unicode(value) => contact ID, or 0 if not found.
+		Values are matched like the database does (ignoring case and trailing spaces).
+		Values matching more than one contact, or that can't be matched to the
+		contacts returned, are left out, see getContactID
+		"""
+		timestamp = time.time()
+		contact_ids = dict()
+		counts = dict()
+		requested = dict()
+		for value in values:
+			value = unicode(value)
+			requested.setdefault(_matchKey(value), set()).add(value)
+		missing = requested.keys()
+		queries = [dict()]
+		if search_deleted:
+			queries.append({'is_deleted': '1'})
+		unmatched = False
+		for extra in queries:
+			if not missing or unmatched:
+				break
+			query = dict(extra)
+			query['entity'] = 'Contact'
+			query['action'] = 'get'
+			query['return'] = 'contact_id,%s' % primary_attribute
+			query[primary_attribute] = {'IN': [value for key in missing for value in requested[key]]}
+			query['options'] = {'limit': 0}
+			result = self.performAPICall(query)
+			if result['is_error']:
+				raise CiviAPIException(result['error_message'])
+			found = result['values']
+			if type(found) == dict:
+				found = found.values()
+			for contact in found:
+				key = contact.get(primary_attribute)
+				if key != None:
+					key = _matchKey(key)
+				if not key in requested:
+					# the database matched it differently, can't tell for which value
+					unmatched = True
+					continue
+				counts[key] = counts.get(key, 0) + 1
+				contact_ids[key] = contact.get('contact_id', contact.get('id'))
+			missing = [key for key in missing if not key in counts]
+
+		for key, count in counts.items():
+			if count > 1:
+				del contact_ids[key]
+		if not unmatched:
+			for key in missing:
+				contact_ids[key] = 0
+		resolved = dict()
+		for key, contact_id in contact_ids.items():
+			for value in requested[key]:
+				resolved[value] = contact_id
+		self.log("%d of %d contact IDs resolved." % (len([1 for contact_id in resolved.values() if contact_id]), len(requested)),
+			logging.DEBUG, 'pycivi', 'get', 'Contact', None, None, time.time()-timestamp)
+		return resolved
+
+
+	@tracing.traced
 	def getEntityID(self, attributes, entity_type, primary_attributes):
 		timestamp = time.time()
 		if attributes.has_key('id'):
@@ -405,6 +588,7 @@ class CiviCRM:
 			logging.DEBUG, 'pycivi', 'get', 'Entity', first_key, None, time.time()-timestamp)
 		return 0
 
+	@tracing.traced
 	def getCampaignID(self, attribute_value, attribute_key='title'):
 		"""
 		Get the ID for a given campaign
@@ -412,7 +596,7 @@ class CiviCRM:
 		Results will be cached
 		"""
 		timestamp = time.time()
-		if self.lookup_cache.has_key('campaign') and self.lookup_cache['campaign'].has_key(attribute_key) and self.lookup_cache['campaign'][attribute_key].has_key(attribute_value):
+		if self._cacheLookup('campaign', self.lookup_cache.has_key('campaign') and self.lookup_cache['campaign'].has_key(attribute_key) and self.lookup_cache['campaign'][attribute_key].has_key(attribute_value)):
 			return self.lookup_cache['campaign'][attribute_key][attribute_value]
 
 		query = dict()
@@ -446,12 +630,13 @@ class CiviCRM:
 		return campaign_id
 
 
+	@tracing.traced
 	def getCustomFieldID(self, field_name, entity_type='Contact', use_label=True):
 		"""
 		Get the ID for a given custom field
 		"""
 		timestamp = time.time()
-		if self.lookup_cache.has_key('custom_field') and self.lookup_cache['custom_field'].has_key(field_name):
+		if self._cacheLookup('custom_field', self.lookup_cache.has_key('custom_field') and self.lookup_cache['custom_field'].has_key(field_name)):
 			return self.lookup_cache['custom_field'][field_name]
 
 		query = dict()
@@ -486,12 +671,13 @@ class CiviCRM:
 		return field_id
 
 
+	@tracing.traced
 	def getCustomGroupID(self, group_name):
 		"""
 		Get the ID for a given custom field
 		"""
 		timestamp = time.time()
-		if self.lookup_cache.has_key('custom_group') and self.lookup_cache['custom_group'].has_key(group_name):
+		if self._cacheLookup('custom_group', self.lookup_cache.has_key('custom_group') and self.lookup_cache['custom_group'].has_key(group_name)):
 			return self.lookup_cache['custom_group'][group_name]
 
 		query = dict()
@@ -524,13 +710,14 @@ class CiviCRM:
 		return group_id
 
 
+	@tracing.traced
 	def getCustomFieldIDWithGroupName(self, field_name, group_name):
 		"""
 		Get the ID for a given custom field
 		"""
 		timestamp = time.time()
 		lookup_name = u'{0}__{1}'.format(field_name, group_name)
-		if self.lookup_cache.has_key('custom_field') and self.lookup_cache['custom_field'].has_key(lookup_name):
+		if self._cacheLookup('custom_field', self.lookup_cache.has_key('custom_field') and self.lookup_cache['custom_field'].has_key(lookup_name)):
 			return self.lookup_cache['custom_field'][lookup_name]
 
 		# get group_id
@@ -575,6 +762,7 @@ class CiviCRM:
 		return field_id
 
 
+	@tracing.traced
 	def setCustomFieldOptionValue(self, entity_id, field_name, value, entity_type='Contact', create_option_value_if_not_exists=True):
 		"""
 		Sets a custom field's option value
@@ -598,7 +786,7 @@ class CiviCRM:
 			return
 
 		# get the associated option group id
-		if self.lookup_cache.has_key('custom_field_optiongroup') and self.lookup_cache['custom_field_optiongroup'].has_key(field_name):
+		if self._cacheLookup('custom_field_optiongroup', self.lookup_cache.has_key('custom_field_optiongroup') and self.lookup_cache['custom_field_optiongroup'].has_key(field_name)):
 			option_group_id = self.lookup_cache['custom_field_optiongroup'][field_name]
 		else:
 			query = dict()
@@ -652,6 +840,7 @@ class CiviCRM:
 		self.setCustomFieldValue(entity_id, field_name, value, entity_type)
 
 
+	@tracing.traced
 	def setCustomFieldValue(self, entity_id, field_name, value, entity_type='Contact'):
 		"""
 		Sets a custom field's value
@@ -677,12 +866,13 @@ class CiviCRM:
 		return
 
 
+	@tracing.traced
 	def getOptionGroupID(self, group_name):
 		"""
 		Get the ID for a given option group
 		"""
 		timestamp = time.time()
-		if self.lookup_cache.has_key('option_group') and self.lookup_cache['option_group'].has_key(group_name):
+		if self._cacheLookup('option_group', self.lookup_cache.has_key('option_group') and self.lookup_cache['option_group'].has_key(group_name)):
 			return self.lookup_cache['option_group'][group_name]
 
 		query = dict()
@@ -716,12 +906,13 @@ class CiviCRM:
 		return group_id
 
 
+	@tracing.traced
 	def getOptionValueID(self, option_group_id, name):
 		"""
 		Get the ID for a given option value
 		"""
 		timestamp = time.time()
-		if self.lookup_cache.has_key('option_value_id') and self.lookup_cache['option_value_id'].has_key(option_group_id) and self.lookup_cache['option_value_id'][option_group_id].has_key(name):
+		if self._cacheLookup('option_value_id', self.lookup_cache.has_key('option_value_id') and self.lookup_cache['option_value_id'].has_key(option_group_id) and self.lookup_cache['option_value_id'][option_group_id].has_key(name)):
 			return self.lookup_cache['option_value_id'][option_group_id][name]
 
 		query = dict()
@@ -760,12 +951,13 @@ class CiviCRM:
 		return value_id
 
 
+	@tracing.traced
 	def getOptionValue(self, option_group_id, name):
 		"""
 		Get the 'value' for a given option value
 		"""
 		timestamp = time.time()
-		if self.lookup_cache.has_key('option_value') and self.lookup_cache['option_value'].has_key(option_group_id) and self.lookup_cache['option_value'][option_group_id].has_key(name):
+		if self._cacheLookup('option_value', self.lookup_cache.has_key('option_value') and self.lookup_cache['option_value'].has_key(option_group_id) and self.lookup_cache['option_value'][option_group_id].has_key(name)):
 			return self.lookup_cache['option_value'][option_group_id][name]
 
 		query = dict()
@@ -802,6 +994,7 @@ class CiviCRM:
 		return value
 
 
+	@tracing.traced
 	def setOptionValue(self, option_group_id, name, attributes=dict()):
 		"""
 		Set or update the value for the given option group
@@ -830,9 +1023,10 @@ class CiviCRM:
 		return value_id
 
 
+	@tracing.traced
 	def getLocationTypeID(self, location_name):
 		# first: look up in cache
-		if self.lookup_cache.has_key('location_type2id') and self.lookup_cache['location_type2id'].has_key(location_name):
+		if self._cacheLookup('location_type2id', self.lookup_cache.has_key('location_type2id') and self.lookup_cache['location_type2id'].has_key(location_name)):
 			return self.lookup_cache['location_type2id'][location_name]
 
 		timestamp = time.time()
@@ -861,9 +1055,10 @@ class CiviCRM:
 		return location_id
 
 
+	@tracing.traced
 	def getMembershipStatusID(self, membership_status_name):
 		# first: look up in cache
-		if self.lookup_cache.has_key('membership_status2id') and self.lookup_cache['membership_status2id'].has_key(membership_status_name):
+		if self._cacheLookup('membership_status2id', self.lookup_cache.has_key('membership_status2id') and self.lookup_cache['membership_status2id'].has_key(membership_status_name)):
 			return self.lookup_cache['membership_status2id'][membership_status_name]
 
 		timestamp = time.time()
@@ -893,9 +1088,10 @@ class CiviCRM:
 		return status_id
 
 
+	@tracing.traced
 	def getMembershipTypeID(self, membership_type_name):
 		# first: look up in cache
-		if self.lookup_cache.has_key('membership_type2id') and self.lookup_cache['membership_type2id'].has_key(membership_type_name):
+		if self._cacheLookup('membership_type2id', self.lookup_cache.has_key('membership_type2id') and self.lookup_cache['membership_type2id'].has_key(membership_type_name)):
 			return self.lookup_cache['membership_type2id'][membership_type_name]
 
 		timestamp = time.time()
@@ -925,9 +1121,10 @@ class CiviCRM:
 		return type_id
 
 
+	@tracing.traced
 	def getFinancialTypeID(self, financial_type_name):
 		# first: look up in cache
-		if self.lookup_cache.has_key('financial_type2id') and self.lookup_cache['financial_type2id'].has_key(financial_type_name):
+		if self._cacheLookup('financial_type2id', self.lookup_cache.has_key('financial_type2id') and self.lookup_cache['financial_type2id'].has_key(financial_type_name)):
 			return self.lookup_cache['financial_type2id'][financial_type_name]
 
 		timestamp = time.time()
@@ -957,6 +1154,7 @@ class CiviCRM:
 		return type_id
 
 
+	@tracing.traced
 	def getEmail(self, contact_id, location_type_id):
 		timestamp = time.time()
 		query = dict()
@@ -975,6 +1173,7 @@ class CiviCRM:
 		return self._createEntity('Email', result['values'][0])
 
 
+	@tracing.traced
 	def getEmails(self, contact_id, location_type_id=None):
 		timestamp = time.time()
 		query = dict()
@@ -998,6 +1197,7 @@ class CiviCRM:
 		return emails
 
 
+	@tracing.traced
 	def createEmail(self, contact_id, location_type_id, email):
 		timestamp = time.time()
 		query = dict()
@@ -1012,6 +1212,7 @@ class CiviCRM:
 		return self._createEntity('Email', result['values'][0])
 
 
+	@tracing.traced
 	def getPhoneNumber(self, data):
 		timestamp = time.time()
 		query = dict()
@@ -1032,6 +1233,7 @@ class CiviCRM:
 			return None
 		return self._createEntity('Phone', result['values'][0])
 
+	@tracing.traced
 	def getPhoneNumbers(self, contact_id, location_type_id=None):
 		timestamp = time.time()
 		query = dict()
@@ -1054,6 +1256,7 @@ class CiviCRM:
 
 		return phones
 
+	@tracing.traced
 	def createPhoneNumber(self, data):
 		timestamp = time.time()
 		query = dict(data)
@@ -1065,6 +1268,7 @@ class CiviCRM:
 		return self._createEntity('Phone', result['values'][0])
 
 
+	@tracing.traced
 	def getWebsites(self, contact_id, website_type_id=None):
 		timestamp = time.time()
 		query = dict()
@@ -1087,6 +1291,7 @@ class CiviCRM:
 
 		return sites
 
+	@tracing.traced
 	def createWebsite(self, data):
 		timestamp = time.time()
 		query = dict(data)
@@ -1097,6 +1302,35 @@ class CiviCRM:
 			raise CiviAPIException(result['error_message'])
 		return self._createEntity('Website', result['values'][0])
 
+	@tracing.traced
+	def geocodeAddresses(self, address_ids, interval=1.0):
+		"""
+		geocodes the addresses (e.g. the ones imported with skip_geocode) by storing
+		them again, one every interval seconds to stay within the geocoding service's
+		rate limit. Returns the number of addresses stored
+		"""
+		timestamp = time.time()
+		count = 0
+		for address_id in address_ids:
+			if count and interval:
+				time.sleep(interval)
+			address = self.load('Address', address_id)
+			if not address or str(address.get('manual_geo_code', '0'))=='1':
+				continue
+			query = {'entity': 'Address', 'action': 'create', 'id': address_id}
+			for key in ('street_address', 'supplemental_address_1', 'supplemental_address_2', 'city', 'postal_code', 'state_province_id', 'country_id'):
+				if address.get(key, None):
+					query[key] = address.get(key)
+			result = self.performAPICall(query)
+			if result['is_error']:
+				raise CiviAPIException(result['error_message'])
+			count += 1
+		self.log("Geocoded %d addresses." % count,
+			logging.INFO, 'pycivi', 'geocode', 'Address', None, None, time.time()-timestamp)
+		return count
+
+
+	@tracing.traced
 	def getOrCreatePrefix(self, prefix_text):
 		"""
 		Looks up or creates the given individual prefix
@@ -1126,6 +1360,7 @@ class CiviCRM:
 		return greeting_id
 
 
+	@tracing.traced
 	def getOrCreateGreeting(self, greeting_text, postal=False):
 		"""
 		Looks up or creates the given greeting for postal or email greetign
@@ -1154,6 +1389,7 @@ class CiviCRM:
 		return greeting_id
 
 
+	@tracing.traced
 	def getOrCreateTagID(self, tag_name, description = None):
 		query = { 'entity': 'Tag',
 				  'action': 'get',
@@ -1174,6 +1410,7 @@ class CiviCRM:
 			return result['values'][0]['id']
 
 
+	@tracing.traced
 	def getOrCreateGroupID(self, group_name, description = None):
 		query = { 'entity': 'Group',
 				  'action': 'get',
@@ -1193,6 +1430,7 @@ class CiviCRM:
 			return result['values'][0]['id']
 
 
+	@tracing.traced
 	def getContactTagIds(self, entity_id):
 		# TODO: can it be safely replace by
 		#    return self.getEntityTagIds(entity_id, 'civicrm_contact')
@@ -1213,6 +1451,7 @@ class CiviCRM:
 			return tags
 
 
+	@tracing.traced
 	def getEntityTagIds(self, entity_id, entity_table):
 		query = { 'entity': 		'EntityTag',
 				  'entity_id' : 	entity_id,
@@ -1232,6 +1471,7 @@ class CiviCRM:
 			return tags
 
 
+	@tracing.traced
 	def getContactGroupIds(self, entity_id):
 		query = { 'entity': 'GroupContact',
 				  'contact_id' : entity_id,
@@ -1247,6 +1487,64 @@ class CiviCRM:
 		return groups
 
 
+	@tracing.traced
+	def getEntitiesTagIds(self, entity_ids, entity_table):
+		"""
+		the tag IDs of all the given entities, with one call.
+		Returns a dict str(entity_id) => set of tag IDs
+		"""
+		timestamp = time.time()
+		tags = dict([(str(entity_id), set()) for entity_id in entity_ids])
+		if not tags:
+			return tags
+		query = { 'entity': 		'EntityTag',
+				  'entity_id' : 	{'IN': tags.keys()},
+				  'entity_table' : 	entity_table,
+				  'action' : 		'get',
+				  'options' :		{'limit': 0},
+				  }
+		result = self.performAPICall(query)
+		if result['is_error']:
+			raise CiviAPIException(result['error_message'])
+		values = result['values']
+		if type(values) == dict:
+			values = values.values()
+		for entry in values:
+			tags.setdefault(str(entry['entity_id']), set()).add(entry['tag_id'])
+		self.log("Found %d tags for %d entities." % (len(values), len(tags)),
+			logging.DEBUG, 'pycivi', 'get', 'EntityTag', None, None, time.time()-timestamp)
+		return tags
+
+
+	@tracing.traced
+	def getContactsGroupIds(self, contact_ids):
+		"""
+		the group IDs of all the given contacts, with one call.
+		Returns a dict str(contact_id) => set of group IDs
+		"""
+		timestamp = time.time()
+		groups = dict([(str(contact_id), set()) for contact_id in contact_ids])
+		if not groups:
+			return groups
+		query = { 'entity': 'GroupContact',
+				  'contact_id' : {'IN': groups.keys()},
+				  'action' : 'get',
+				  'options' : {'limit': 0},
+				  }
+		result = self.performAPICall(query)
+		if result['is_error']:
+			raise CiviAPIException(result['error_message'])
+		values = result['values']
+		if type(values) == dict:
+			values = values.values()
+		for entry in values:
+			groups.setdefault(str(entry['contact_id']), set()).add(entry['group_id'])
+		self.log("Found %d group memberships for %d contacts." % (len(values), len(groups)),
+			logging.DEBUG, 'pycivi', 'get', 'GroupContact', None, None, time.time()-timestamp)
+		return groups
+
+
+	@tracing.traced
 	def tagContact(self, entity_id, tag_id, value=True):
 		# TODO: can it safely be replaced by
 		#	self.tagEntity(entity_id, 'cvicirm_contact', tag_id, value)
@@ -1273,6 +1571,7 @@ class CiviCRM:
 				logging.DEBUG, 'pycivi', query['action'], 'EntityTag', entity_id, tag_id, time.time()-timestamp)
 
 
+	@tracing.traced
 	def tagEntity(self, entity_id, entity_table, tag_id, value=True):
 		timestamp = time.time()
 		query = { 'entity': 		'EntityTag',
@@ -1298,6 +1597,143 @@ class CiviCRM:
 				logging.DEBUG, 'pycivi', query['action'], 'EntityTag', entity_id, tag_id, time.time()-timestamp)
 
 
+	@tracing.traced
+	def tagEntities(self, entity_ids, entity_table, tag_id, value=True):
+		"""
+		(un)tags all the given entities with one call
+		"""
+		timestamp = time.time()
+		query = { 'entity': 		'EntityTag',
+				  'entity_table': 	entity_table,
+				  'tag_id': 		tag_id,
+				  }
+		# the API collects all entity_id* parameters
+		for index, entity_id in enumerate(entity_ids):
+			query['entity_id.%d' % (index + 1)] = entity_id
+		if value:
+			query['action'] = 'create'
+		else:
+			query['action'] = 'delete'
+		result = self.performAPICall(query)
+		if result['is_error']:
+			raise CiviAPIException(result['error_message'])
+		self.log("Tag(%s): %s of %d entities %s" % (tag_id, result.get(value and 'added' or 'removed', 0), len(entity_ids), value and 'added' or 'removed'),
+			logging.INFO, 'pycivi', query['action'], 'EntityTag', None, tag_id, time.time()-timestamp)
+		return result
+
+
+	@tracing.traced
+	def setGroupMemberships(self, contact_ids, group_id, value=True, status='Added'):
+		"""
+		adds all the given contacts to the group (or removes them) with one call
+		"""
+		timestamp = time.time()
+		query = { 'entity': 'GroupContact',
+				  'group_id':   group_id,
+				  'status':     status,
+				  }
+		# the API collects all contact_id* parameters
+		for index, contact_id in enumerate(contact_ids):
+			query['contact_id.%d' % (index + 1)] = contact_id
+		if value:
+			query['action'] = 'create'
+		else:
+			query['action'] = 'delete'
+		result = self.performAPICall(query)
+		if result['is_error']:
+			raise CiviAPIException(result['error_message'])
+		self.log("Group(%s): %s of %d contacts %s" % (group_id, result.get(value and 'added' or 'removed', 0), len(contact_ids), value and 'added' or 'removed'),
+			logging.INFO, 'pycivi', query['action'], 'GroupContact', None, group_id, time.time()-timestamp)
+		return result
+
+
+	def _getAllValues(self, query, column, page_size):
+		"""
+		the str() values of the column of all entities matching the query. Pages through them
+		ordered by id, continuing after the last id seen, so the cost doesn't grow with the offset
+		"""
+		values = set()
+		last_id = 0
+		while True:
+			page = dict(query)
+			page['action'] = 'get'
+			page['id'] = {'>': last_id}
+			page['return'] = 'id,%s' % column
+			page['options'] = {'limit': page_size, 'sort': 'id ASC'}
+			result = self.performAPICall(page)
+			if result['is_error']:
+				raise CiviAPIException(result['error_message'])
+			entries = result['values']
+			if type(entries) == dict:
+				entries = entries.values()
+			for entry in entries:
+				values.add(str(entry[column]))
+				last_id = max(last_id, int(entry['id']))
+			if len(entries) < page_size:
+				return values
+
+
+	@tracing.traced
+	def syncGroupMembers(self, group, contact_ids, page_size=1000, chunk_size=500):
+		"""
+		makes the group contain exactly the given contacts: the current members are read
+		once, then only the difference is written, chunk_size contacts per call.
+
+		group is the group's ID (int or digit string, as getOrCreateGroupID returns it)
+		or title (created if it doesn't exist)
+		Returns (added, removed)
+		"""
+		timestamp = time.time()
+		if unicode(group).isdigit():
+			group_id = group
+		else:
+			group_id = self.getOrCreateGroupID(group)
+
+		current = self._getAllValues({'entity': 'GroupContact', 'group_id': group_id, 'status': 'Added'}, 'contact_id', page_size)
+		wanted = set([str(contact_id) for contact_id in contact_ids])
+		to_add = sorted(wanted - current)
+		to_remove = sorted(current - wanted)
+		for index in range(0, len(to_add), chunk_size):
+			self.setGroupMemberships(to_add[index:index+chunk_size], group_id, True)
+		for index in range(0, len(to_remove), chunk_size):
+			self.setGroupMemberships(to_remove[index:index+chunk_size], group_id, False)
+
+		self.log("Group(%s) synchronised: %d contacts added, %d removed, %d unchanged" % (group_id, len(to_add), len(to_remove), len(current & wanted)),
+			logging.INFO, 'pycivi', 'sync', 'GroupContact', None, group_id, time.time()-timestamp)
+		return len(to_add), len(to_remove)
+
+
+	@tracing.traced
+	def syncTagMembers(self, tag, entity_ids, entity_table='civicrm_contact', page_size=1000, chunk_size=500):
+		"""
+		makes exactly the given entities carry the tag: the currently tagged ones are read
+		once, then only the difference is written, chunk_size entities per call.
+
+		tag is the tag's ID (int or digit string, as getOrCreateTagID returns it)
+		or name (created if it doesn't exist)
+		Returns (added, removed)
+		"""
+		timestamp = time.time()
+		if unicode(tag).isdigit():
+			tag_id = tag
+		else:
+			tag_id = self.getOrCreateTagID(tag)
+
+		current = self._getAllValues({'entity': 'EntityTag', 'tag_id': tag_id, 'entity_table': entity_table}, 'entity_id', page_size)
+		wanted = set([str(entity_id) for entity_id in entity_ids])
+		to_add = sorted(wanted - current)
+		to_remove = sorted(current - wanted)
+		for index in range(0, len(to_add), chunk_size):
+			self.tagEntities(to_add[index:index+chunk_size], entity_table, tag_id, True)
+		for index in range(0, len(to_remove), chunk_size):
+			self.tagEntities(to_remove[index:index+chunk_size], entity_table, tag_id, False)
+
+		self.log("Tag(%s) synchronised: %d entities added, %d removed, %d unchanged" % (tag_id, len(to_add), len(to_remove), len(current & wanted)),
+			logging.INFO, 'pycivi', 'sync', 'EntityTag', None, tag_id, time.time()-timestamp)
+		return len(to_add), len(to_remove)
+
+
+	@tracing.traced
 	def setGroupMembership(self, entity_id, group_id, value=True, status='Added'):
 		timestamp = time.time()
 		query = { 'entity': 'GroupContact',
@@ -37,14 +37,15 @@ import time
 import threading
 import os
 import random
-import dateutil
-import datetime
+import dateutil.parser
 import traceback
+import Queue
+import atexit
 from distutils.version import LooseVersion
 
 
 from CiviEntity import *
-from CiviCRM import CiviCRM
+from CiviCRM import CiviCRM, CiviAPIException, CiviTransportException, _errorResult
 
 try:
 	import requests
@@ -60,20 +61,355 @@ if LooseVersion(requests.__version__) < LooseVersion('1.1.0'):
 
 
 
-class CiviAPIException(Exception):
-	pass
+class CiviCallFuture:
+	"""
+	The pending result of a pipelined API call (see CiviCRM_BRIDGED.submitAPICall)
+	"""
+	def __init__(self, params, callback=None):
+		self.params = params
+		self.submitted = time.time()
+		self.civicrm = None			# for logging failed callbacks
+		self.recorder = None
+		self.bridge = None
+		self.call_id = None
+		self._event = threading.Event()
+		self._result = None
+		self._exception = None
+		self._callbacks = list()
+		if callback:
+			self._callbacks.append(callback)
+
+	def done(self):
+		return self._event.isSet()
+
+	def result(self, timeout=None):
+		"""
+		wait for the result, raises the call's exception if it failed
+		"""
+		if not self._event.wait(timeout) and not self._event.isSet():
+			raise CiviTransportException("Timeout waiting for call %s" % self.call_id)
+		if self._exception:
+			raise self._exception
+		return self._result
+
+	def exception(self, timeout=None):
+		self._event.wait(timeout)
+		return self._exception
+
+	def add_done_callback(self, callback):
+		"""
+		callback(future) will be called once the call is done
+		"""
+		if self.done():
+			callback(self)
+		else:
+			self._callbacks.append(callback)
+
+	def _resolve(self, result=None, exception=None):
+		self._result = result
+		self._exception = exception
+		if self.recorder:
+			self._run(self.recorder)
+		self._event.set()
+		for callback in self._callbacks:
+			self._run(callback)
+
+	def _run(self, callback):
+		# this is the pipeline's thread, a failing callback mustn't take it down
+		try:
+			callback(self)
+		except:
+			if self.civicrm:
+				self.civicrm.logException("Callback of call %s failed: " % self.call_id,
+					logging.ERROR, 'API', 'callback', self.params.get('entity', ''), None, None, time.time()-self.submitted)
+			else:
+				traceback.print_exc()
+
+
+class _CallPipeline(threading.Thread):
+	"""
+	Background thread keeping up to window calls queued on the bridge,
+	and fetching the completed results in bulk.
+	"""
+	def __init__(self, civicrm, window):
+		threading.Thread.__init__(self, name='BridgePipeline')
+		self.daemon = True
+		self.civicrm = civicrm
+		self.window = window
+		self.submitted = Queue.Queue()
+		self.outstanding = dict()
+		self.stopping = False
+		self.Empty = Queue.Empty
+		self.start()
+		atexit.register(self.stop)
+
+	def stop(self):
+		"""
+		stop after all submitted calls are done
+		"""
+		if self.isAlive():
+			self.submitted.put(None)
+			self.join()
+
+	def run(self):
+		while not self.stopping or self.outstanding:
+			# push new calls until the window is full
+			block = not self.outstanding
+			while len(self.outstanding) < self.window and not self.stopping:
+				try:
+					future = self.submitted.get(block)
+				except self.Empty:
+					break
+				block = False
+				if future==None:
+					self.stopping = True
+					break
+				try:
+					future.bridge = self.civicrm.getBridge()
+					future.call_id = self.civicrm.queueCall(future.params, future.bridge)
+					if future.call_id:
+						self.outstanding[future.call_id] = future
+					else:
+						future._resolve(exception=CiviTransportException("Bridge not available"))
+				except Exception as error:
+					future._resolve(exception=error)
+
+			if not self.outstanding:
+				continue
+
+			# fetch whatever is done, per bridge
+			by_bridge = dict()
+			for future in self.outstanding.values():
+				by_bridge.setdefault(future.bridge['bridge_key'], list()).append(future)
+			fetched = 0
+			for futures in by_bridge.values():
+				try:
+					results = self.civicrm.fetchCalls([future.call_id for future in futures], futures[0].bridge)
+				except:
+					self.civicrm.logException("Fetching pipelined calls failed: ",
+						logging.ERROR, 'API', 'fetch', 'ApiBridge', None, None, 0)
+					results = None
+				if results==None:
+					# bridge failed or expired, these calls are lost
+					for future in futures:
+						del self.outstanding[future.call_id]
+						future._resolve(exception=CiviTransportException("Bridge failed, call %s lost" % future.call_id))
+					continue
+
+				for call_id, result in results.items():
+					future = self.outstanding.pop(call_id, None)
+					if future:
+						future._resolve(result)
+				fetched += len(results)
+			if not fetched:
+				time.sleep(self.civicrm.fetch_interval)
+
+
+class BridgeLeaseManager(threading.Thread):
+	"""
+	Keeps a pool of ApiBridges ready, so that API calls don't have to wait
+	for bridge creation or expiry handling.
+
+	The expiry date of a bridge is parsed once when it's created. Bridges are
+	renewed in the background renew_time seconds (but at most half their lease)
+	before they expire, and retired max_exec_time seconds before that.
+	Retired bridges get no new calls, and are deleted in the background once
+	they expire, so that the calls already pushed can finish. Bridges retired
+	because they're gone (404) are deleted right away.
+
+	getBridge waits at most wait_timeout seconds for a bridge, and returns None
+	right away if creating one fails.
+	"""
+	def __init__(self, civicrm, pool_size=2, max_exec_time=60, renew_time=300, check_interval=10, wait_timeout=None):
+		threading.Thread.__init__(self, name='BridgeLeaseManager')
+		self.daemon = True
+		self.civicrm = civicrm
+		self.pool_size = pool_size
+		self.max_exec_time = max_exec_time
+		self.renew_time = renew_time
+		self.check_interval = check_interval
+		self.wait_timeout = wait_timeout or max_exec_time
+		self.bridges = list()
+		self.retired = list()
+		self.failures = 0
+		self.condition = threading.Condition()
+		self.stopping = False
+		self.start()
+		atexit.register(self.stop)
+
+	def getBridge(self):
+		"""
+		returns the usable bridge with the longest lease left
+		"""
+		self.condition.acquire()
+		try:
+			failures = self.failures
+			timeout = time.time() + self.wait_timeout
+			while True:
+				deadline = time.time() + self.max_exec_time
+				if self.bridges and self.bridges[-1]['_expires'] > deadline:
+					return self.bridges[-1]
+				if self.stopping or not self.isAlive():
+					return None
+				if self.failures > failures or time.time() > timeout:
+					self.civicrm.log("No bridge available",
+						logging.ERROR, 'API', 'create', 'ApiBridge', None, None, 0)
+					return None
+				# nothing ready (yet), wake up the manager
+				self.condition.notifyAll()
+				self.condition.wait(min(1.0, max(0.01, timeout - time.time())))
+		finally:
+			self.condition.release()
+
+	def retire(self, bridge):
+		if bridge:
+			self.condition.acquire()
+			if bridge in self.bridges:
+				self.bridges.remove(bridge)
+				self.retired.append(bridge)
+			bridge['_delete_after'] = time.time()
+			self.condition.notifyAll()
+			self.condition.release()
+
+	def stop(self):
+		if self.isAlive():
+			self.condition.acquire()
+			self.stopping = True
+			self.condition.notifyAll()
+			self.condition.release()
+			self.join()
+
+	def _createBridge(self):
+		result = self.civicrm.wrapped_instance.performAPICall({'action': 'create', 'entity': 'ApiBridge'})
+		bridge = result['values']
+		if not bridge.get('bridge_key', None):
+			return None
+		expires = dateutil.parser.parse(bridge['expires'])
+		bridge['_expires'] = time.mktime(expires.timetuple())
+		bridge['_lease'] = bridge['_expires'] - time.time()
+		self.civicrm.log("New bridge '%s', expires %s" % (bridge['bridge_key'], bridge['expires']),
+			logging.INFO, 'API', 'create', 'ApiBridge', None, None, 0)
+		return bridge
+
+	def _deleteBridge(self, bridge):
+		try:
+			self.civicrm.wrapped_instance.performAPICall({'action': 'delete', 'entity': 'ApiBridge', 'bridge_key': bridge['bridge_key']})
+		except:
+			self.civicrm.logException("Couldn't delete bridge '%s': " % bridge['bridge_key'],
+				logging.WARN, 'API', 'delete', 'ApiBridge', None, None, 0)
+
+	def run(self):
+		while True:
+			self.condition.acquire()
+			now = time.time()
+			for bridge in list(self.bridges):
+				if bridge['_expires'] - now < self.max_exec_time:
+					# no new calls, but give the ones in flight time to finish
+					self.bridges.remove(bridge)
+					bridge['_delete_after'] = min(bridge['_expires'], now + self.max_exec_time)
+					self.retired.append(bridge)
+			if self.stopping:
+				retired = self.retired + self.bridges
+				self.bridges = list()
+			else:
+				retired = [bridge for bridge in self.retired if bridge['_delete_after'] <= now]
+			self.retired = [bridge for bridge in self.retired if not bridge in retired]
+			fresh = len([bridge for bridge in self.bridges if bridge['_expires'] - now > self._renewTime(bridge)])
+			stopping = self.stopping
+			self.condition.release()
+
+			for bridge in retired:
+				self._deleteBridge(bridge)
+			if stopping:
+				return
+
+			# top up the pool
+			failed = False
+			for i in range(self.pool_size - fresh):
+				try:
+					bridge = self._createBridge()
+				except:
+					self.civicrm.logException("Couldn't create bridge: ",
+						logging.ERROR, 'API', 'create', 'ApiBridge', None, None, 0)
+					bridge = None
+				if not bridge:
+					failed = True
+					self.condition.acquire()
+					self.failures += 1
+					self.condition.notifyAll()
+					self.condition.release()
+					break
+				self.condition.acquire()
+				self.bridges.append(bridge)
+				self.bridges.sort(key=lambda bridge: bridge['_expires'])
+				self.condition.notifyAll()
+				self.condition.release()
+
+			self.condition.acquire()
+			if not self.stopping:
+				if failed:
+					self.condition.wait(self.check_interval)
+				else:
+					self.condition.wait(min(self.check_interval, self._nextEvent()))
+			self.condition.release()
+
+	def _renewTime(self, bridge):
+		"""
+		seconds before its expiry the bridge is renewed. Capped at half the lease,
+		so a new bridge always counts as fresh and isn't replaced right away
+		"""
+		return min(self.renew_time, bridge['_lease'] / 2)
+
+	def _nextEvent(self):
+		"""
+		seconds until the next bridge needs renewal (or, if already renewed, retirement)
+		or a retired one can be deleted
+		"""
+		now = time.time()
+		events = [self.check_interval]
+		for bridge in self.retired:
+			events.append(bridge['_delete_after'] - now)
+		for bridge in self.bridges:
+			left = bridge['_expires'] - now
+			if left > self._renewTime(bridge):
+				events.append(left - self._renewTime(bridge))
+			else:
+				events.append(left - self.max_exec_time)
+		return max(0.1, min(events))
+
 
 class CiviCRM_BRIDGED(CiviCRM):
+	"""
+	CiviCRM API access through an ApiBridge, created with the wrapped instance.
+
+	Besides the synchronous performAPICall, calls can be pipelined:
+	submitAPICall returns a CiviCallFuture, and up to options['window'] calls
+	are kept queued on the bridge, with the completed results fetched in bulk.
+	If options['pipeline'] is set, performAPICall uses the pipeline as well.
 
+	Bridges are managed by a BridgeLeaseManager, options['bridge_pool'],
+	options['max_exec_time'], options['bridge_renew_time'] and
+	options['bridge_wait_timeout'] control the leases.
+
+	A forked process (e.g. by importer.parallelize_partitions) starts its own
+	lease manager and pipeline, with bridges of its own.
+	"""
 
 	def __init__(self, instance, logfile=None, options=dict()):
 		CiviCRM.__init__(self, logfile)
 		self.wrapped_instance = instance
-		self.max_exec_time = 60
+		self.max_exec_time = options.get('max_exec_time', 60)
 		self.bridge = None
 		self.calls = dict()
 		self.call_base    = random.randint(1000000,9999999)
 		self.call_counter = 1
+		self.call_counter_lock = threading.Lock()
+
+		self.window = options.get('window', 10)
+		self.fetch_interval = options.get('fetch_interval', 0.05)
+		self.bulk_fetch = True
+		self.pipeline_lock = threading.Lock()
+		self.use_pipeline = options.get('pipeline', False)
 
 		self.auth = None
 		self.headers = {}
@@ -81,11 +417,111 @@ class CiviCRM_BRIDGED(CiviCRM):
 			from requests.auth import HTTPBasicAuth
 			self.auth = HTTPBasicAuth(options['auth_user'], options['auth_pass'])
 
+		self.lease_options = {
+			'pool_size':     options.get('bridge_pool', 2),
+			'max_exec_time': self.max_exec_time,
+			'renew_time':    options.get('bridge_renew_time', 5 * self.max_exec_time),
+			'wait_timeout':  options.get('bridge_wait_timeout', None),
+		}
+		self.fork_lock = threading.Lock()
+		self._startThreads()
+
+
+	def _startThreads(self):
+		self.pid = os.getpid()
+		self.lease_manager = BridgeLeaseManager(self, **self.lease_options)
+		self.pipeline = None
+
+
+	def _checkFork(self):
+		"""
+		the threads didn't come along if this process has been forked, start new ones
+		"""
+		if self.pid!=os.getpid():
+			self.fork_lock.acquire()
+			if self.pid!=os.getpid():
+				self.pipeline_lock = threading.Lock()
+				self._startThreads()
+			self.fork_lock.release()
 
 
 	def performAPICall(self, params=dict(), execParams=dict()):
-		callID = self.queueCall(params)
-		return self.fetchCall(callID)
+		self._checkFork()
+		if self.use_pipeline:
+			return self.submitAPICall(params).result()
+		timestamp = time.time()
+		try:
+			bridge = self.getBridge()
+			if not bridge:
+				raise CiviTransportException("Bridge not available")
+			callID = self.queueCall(params, bridge)
+			if not callID:
+				raise CiviTransportException("Bridge failed, call not queued")
+			result = self.fetchCall(callID, bridge)
+			if result==None:
+				raise CiviTransportException("Bridge failed, call %s lost" % callID)
+		except:
+			self._recordCall(params.get('entity', ''), params.get('action', ''), time.time()-timestamp, True)
+			raise
+		self._recordCall(params.get('entity', ''), params.get('action', ''), time.time()-timestamp, bool(result.get('is_error', False)))
+		return result
+
+
+	def submitAPICall(self, params, callback=None):
+		"""
+		queue the call in the pipeline, returns a CiviCallFuture.
+		callback(future) will be called once the call is done.
+		"""
+		self._checkFork()
+		if not self.pipeline:
+			self.pipeline_lock.acquire()
+			if not self.pipeline:
+				self.pipeline = _CallPipeline(self, self.window)
+			self.pipeline_lock.release()
+		future = CiviCallFuture(params, callback)
+		future.civicrm = self
+		future.recorder = self._recordFuture
+		self.pipeline.submitted.put(future)
+		return future
+
+
+	def _recordFuture(self, future):
+		error = future._exception!=None or not future._result or bool(future._result.get('is_error', False))
+		self._recordCall(future.params.get('entity', ''), future.params.get('action', ''), time.time()-future.submitted, error)
+
+
+	def close(self):
+		"""
+		stop the pipeline (if running) once all submitted calls are done,
+		then stop the lease manager and release the bridges
+		"""
+		if self.pipeline:
+			self.pipeline.stop()
+			self.pipeline = None
+		self.lease_manager.stop()
+
+
+	def performAPICalls(self, calls):
+		"""
+		pipeline all the given calls, returns their results in the same order.
+		A call that fails doesn't stop the others (see CiviCRM.performAPICalls)
+		"""
+		futures = list()
+		for params in calls:
+			try:
+				futures.append(self.submitAPICall(params))
+			except Exception as error:
+				futures.append(_errorResult(error))
+		results = list()
+		for future in futures:
+			if isinstance(future, dict):
+				results.append(future)
+				continue
+			try:
+				results.append(future.result())
+			except Exception as error:
+				results.append(_errorResult(error))
+		return results
 
 
 	
@@ -95,61 +531,88 @@ class CiviCRM_BRIDGED(CiviCRM):
 
 
 
-	def fetchCall(self, call_id):
-		bridge = self.getBridge()
+	def fetchCall(self, call_id, bridge=None):
+		bridge = bridge or self.getBridge()
 		if bridge:
 			url = bridge['fetch_url'] + '&call_id=' + call_id
 			reply = requests.get(url, verify=False, auth=self.auth, headers=self.headers)
 
 			if reply.status_code == 404:
-				self.bridgeExpired()
+				self.bridgeExpired(bridge)
 				return None
 			else:
 				result = json.loads(reply.text)
 				return result
 
 
+	def fetchCalls(self, call_ids, bridge=None):
+		"""
+		fetch the results of all given calls with one request.
+		Returns a dict call_id => result of the calls that are done,
+		or None if the bridge expired
+		"""
+		bridge = bridge or self.getBridge()
+		if not self.bulk_fetch:
+			results = dict()
+			for call_id in call_ids:
+				result = self.fetchCall(call_id, bridge)
+				if result==None:
+					return None
+				results[call_id] = result
+			return results
 
-	def queueCall(self, call_data):
-		bridge = self.getBridge()
 		if bridge:
+			url = bridge['fetch_url'] + '&call_ids=' + ','.join(call_ids)
+			reply = requests.get(url, verify=False, auth=self.auth, headers=self.headers)
+
+			if reply.status_code == 404:
+				self.bridgeExpired(bridge)
+				return None
+
+			reply = json.loads(reply.text)
+			if 'is_error' in reply:
+				# this bridge doesn't support bulk fetching
+				self.bulk_fetch = False
+				return self.fetchCalls(call_ids, bridge)
+
+			results = dict()
+			for call_id, result in reply.items():
+				if result and result.get('status', None)!='pending':
+					results[call_id] = result
+			return results
+
+
+
+	def queueCall(self, call_data, bridge=None):
+		bridge = bridge or self.getBridge()
+		if bridge:
+			self.call_counter_lock.acquire()
 			call_id = '%s-%06d' % tuple([self.call_base, self.call_counter])
 			self.call_counter += 1
+			self.call_counter_lock.release()
 			url = bridge['push_url'] + '&call_id=' + call_id
 			reply = requests.post(url, data=json.dumps(call_data), verify=False, auth=self.auth, headers=self.headers)
 			
 			if reply.status_code == 404:
-				self.bridgeExpired()
+				self.bridgeExpired(bridge)
 				return None
 			else:
 				return call_id
 		
 
 
-	def bridgeExpired(self):
-		result = self.wrapped_instance.performAPICall({'action': 'delete', 'entity': 'ApiBridge', 'bridge_key': self.bridge['bridge_key']})
-		self.bridge = None
+	def bridgeExpired(self, bridge=None):
+		"""
+		the bridge is gone, the lease manager will take care of the rest
+		"""
+		self.lease_manager.retire(bridge or self.bridge)
 
 
 
 	def getBridge(self):
-		if self.bridge:
-			# check if expires soon (within max_exec_time)
-			exiration_date = dateutil.parser.parse(self.bridge['expires'])
-			current_time   = datetime.datetime.now()
-			time_diff = exiration_date - current_time
-			if time_diff.total_seconds < self.max_exec_time:
-				# this bridge is running out => close it
-				self.bridgeExpired()
-			else:
-				# this bridge is still fine
-				return self.bridge
-
-		result = self.wrapped_instance.performAPICall({'action': 'create', 'entity': 'ApiBridge'})
-		bridge = result['values']
-		if bridge.get('bridge_key', None):
-			self.bridge = bridge
-			print "NEW BRIDGE"
-			return bridge
-		else:
-			return
+		"""
+		get a usable bridge from the lease manager, only blocks if there is none yet
+		"""
+		self._checkFork()
+		self.bridge = self.lease_manager.getBridge()
+		return self.bridge
@@ -38,64 +38,296 @@ import threading
 import os
 import traceback
 import subprocess
+import Queue
+import tempfile
 
 
 from CiviEntity import *
-from CiviCRM import CiviCRM
+from CiviCRM import CiviCRM, CiviAPIException, CiviTransportException
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'drush_worker.php')
+WORKER_PREFIX = 'PYCIVI:'
+
+
+class DrushWorker:
+	"""
+	A long-lived drush process running drush_worker.php: it bootstraps
+	CiviCRM once and then serves API calls as JSON lines over stdin/stdout.
+	"""
+	def __init__(self, call_params):
+		self.process = subprocess.Popen(call_params, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
+		self.calls = 0
+		self.last_used = time.time()
+
+	def request(self, data):
+		self.process.stdin.write(json.dumps(data) + '\n')
+		self.process.stdin.flush()
+		self.last_used = time.time()
+		while True:
+			line = self.process.stdout.readline()
+			if not line:
+				raise CiviTransportException("DRUSH worker terminated unexpectedly.")
+			if line.startswith(WORKER_PREFIX):
+				return json.loads(line[len(WORKER_PREFIX):])
+			# anything else is output of the bootstrap or PHP notices
+
+	def call(self, entity, action, params):
+		self.calls += 1
+		return self.request({'entity': entity, 'action': action, 'params': params})
+
+	def ping(self):
+		try:
+			return self.isAlive() and self.request({'ping': 1}).get('pong', False)
+		except:
+			return False
+
+	def isAlive(self):
+		return self.process.poll()==None
+
+	def close(self):
+		try:
+			self.process.stdin.close()
+		except:
+			pass
+		if self.isAlive():
+			# give it a moment to finish, then kill it
+			timeout = time.time() + 5
+			while self.isAlive() and time.time() < timeout:
+				time.sleep(0.05)
+			if self.isAlive():
+				self.process.kill()
+		self.process.wait()
+
+
+class DrushWorkerPool:
+	"""
+	A pool of DrushWorkers for parallel use. Workers are started on demand,
+	checked with a ping when they've been idle for more than health_check_interval
+	seconds, and recycled after max_calls calls to contain PHP memory leaks.
+
+	A forked process (e.g. by importer.parallelize_partitions) starts its own workers,
+	it mustn't talk to the ones of its parent.
+	"""
+	def __init__(self, call_params, size=1, max_calls=1000, health_check_interval=60):
+		self.call_params = call_params
+		self.size = size
+		self.max_calls = max_calls
+		self.health_check_interval = health_check_interval
+		self.lock = threading.Lock()
+		self._startPool()
+
+	def _startPool(self):
+		self.pid = os.getpid()
+		self.idle_workers = Queue.Queue()
+		for i in range(self.size):
+			# placeholders, the workers will be started when needed
+			self.idle_workers.put(None)
+
+	def _checkout(self):
+		if self.pid!=os.getpid():
+			# forked: the parent's workers (and their pipes) are not ours to use or close
+			self.lock.acquire()
+			if self.pid!=os.getpid():
+				self._startPool()
+			self.lock.release()
+		worker = self.idle_workers.get()
+		if worker and time.time()-worker.last_used > self.health_check_interval and not worker.ping():
+			worker.close()
+			worker = None
+		if worker==None or not worker.isAlive():
+			worker = DrushWorker(self.call_params)
+		return worker
+
+	def call(self, entity, action, params):
+		worker = None
+		try:
+			worker = self._checkout()
+			result = worker.call(entity, action, params)
+			if worker.calls >= self.max_calls:
+				worker.close()
+				worker = None
+			return result
+		except:
+			if worker:
+				worker.close()
+			worker = None
+			raise
+		finally:
+			self.idle_workers.put(worker)
+
+	def close(self):
+		while True:
+			try:
+				worker = self.idle_workers.get_nowait()
+			except Queue.Empty:
+				break
+			if worker:
+				worker.close()
+
+
+class DrushBatch:
+	"""
+	Iterator over the results of a batch run (see CiviCRM_DRUSH.runBatchFile),
+	yielding the results in the order of the calls while drush is still working.
+	"""
+	def __init__(self, civicrm, call_params, call_file, result_file=None):
+		self.civicrm = civicrm
+		self.call_file = call_file
+		self.result_file = result_file
+		self.process = subprocess.Popen(call_params, stdout=subprocess.PIPE, stdin=open(os.devnull), stderr=subprocess.STDOUT)
+		self.results = 0
+		self.errors = 0
+		self.timestamp = time.time()
+		if result_file:
+			self.result_output = open(result_file, 'w')
+		else:
+			self.result_output = None
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		for line in iter(self.process.stdout.readline, ''):
+			if line.startswith(WORKER_PREFIX):
+				result = json.loads(line[len(WORKER_PREFIX):])
+				self.results += 1
+				if result.get('is_error', 0):
+					self.errors += 1
+				if self.result_output:
+					self.result_output.write(line[len(WORKER_PREFIX):])
+				return result
+		self._finish()
+		raise StopIteration
+
+	def _finish(self):
+		if self.process.wait()!=0:
+			self.civicrm.log("DRUSH batch terminated with exit code %d" % self.process.returncode,
+				logging.ERROR, 'API', 'batch', None, None, None, time.time()-self.timestamp)
+		if self.result_output:
+			self.result_output.close()
+			self.result_output = None
+		if os.path.exists(self.call_file):
+			os.remove(self.call_file)
+		self.civicrm.log("DRUSH batch completed: %d results, %d errors" % (self.results, self.errors),
+			logging.INFO, 'API', 'batch', None, None, None, time.time()-self.timestamp)
+
+	def wait(self):
+		"""
+		process all results, returns the number of results
+		"""
+		for result in self:
+			pass
+		return self.results
 
-class CiviAPIException(Exception):
-	pass
 
 class CiviCRM_DRUSH(CiviCRM):
+	"""
+	CiviCRM API access through drush on the local machine.
 
-	def __init__(self, folder='.', drush_path='drush', site='default', logfile=None):
+	By default, every call starts a new 'drush civicrm-api' process.
+	With options['workers'] = N, a pool of N persistent workers is used instead
+	(see DrushWorkerPool), options['max_calls'] and options['health_check_interval']
+	control the worker recycling.
+	"""
+
+	def __init__(self, folder='.', drush_path='drush', site='default', logfile=None, options=dict()):
 		# init some attributes
 		CiviCRM.__init__(self, logfile)
 		self.folder = os.path.expanduser(folder)
 		self.drush_path = os.path.expanduser(drush_path)
-		self.site = 'default'
+		self.site = site
 		self.non_parameters = set(['action', 'entity', 'key', 'api_key', 'sequential', 'json'])
 
+		self.worker_pool = None
+		if options.get('workers', 0):
+			worker_params = [self.drush_path, '-r', self.folder, '-l', self.site, 'php-script', WORKER_SCRIPT]
+			self.worker_pool = DrushWorkerPool(worker_params, options['workers'], options.get('max_calls', 1000), options.get('health_check_interval', 60))
 
-	def performAPICall(self, params=dict()):
-		timestamp = time.time()
 
-		# build call with parameters
-		call_params = [self.drush_path, '-r', self.folder, '-l', self.site, 'civicrm-api', '--out=json', '--in=json']
-		call_params.append(params['entity'] + '.' + params['action'])
-		
-		# remove unsuitable parameters
-		for non_param in self.non_parameters:
-			params.pop(non_param, None)
-		query = json.dumps(params)
+	def close(self):
+		"""
+		shut down the persistent workers (if any)
+		"""
+		if self.worker_pool:
+			self.worker_pool.close()
+
+
+	def runBatchFile(self, calls_iterable, result_file=None, transaction_size=0):
+		"""
+		Executes all calls (dicts like the params of performAPICall) in a single
+		drush run, i.e. with a single bootstrap. The calls are spooled to a
+		JSONL file first, so any iterable can be used.
+
+		Returns a DrushBatch, a streaming iterator over the results.
+		If result_file is given, the results are also written there as JSONL.
+		With transaction_size > 0 every transaction_size calls are committed
+		in one database transaction.
+		"""
+		call_output = tempfile.NamedTemporaryFile(prefix='pycivi-batch-', suffix='.jsonl', delete=False)
+		calls = 0
+		for params in calls_iterable:
+			query = dict(params)
+			for non_param in self.non_parameters:
+				query.pop(non_param, None)
+			query['version'] = self.api_version
+			call_output.write(json.dumps({'entity': params['entity'], 'action': params['action'], 'params': query}) + '\n')
+			calls += 1
+		call_output.close()
+
+		self.log("Starting DRUSH batch with %d calls" % calls,
+			logging.INFO, 'API', 'batch', None, None, None, 0)
+		call_params = [self.drush_path, '-r', self.folder, '-l', self.site, 'php-script', WORKER_SCRIPT,
+			'batch', call_output.name, '-', str(int(transaction_size))]
+		return DrushBatch(self, call_params, call_output.name, result_file)
+
 
+	def _callProcess(self, entity, action, query):
+		call_params = [self.drush_path, '-r', self.folder, '-l', self.site, 'civicrm-api', '--out=json', '--in=json']
+		call_params.append(entity + '.' + action)
 		try:
 			drush = subprocess.Popen(call_params, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
-			reply = drush.communicate(input=query)[0]
-
-			self.log("API call completed - parameters: '%s'" % str(call_params), 
-				logging.DEBUG, 'API', params.get('action', "NO ACTION SET"), params.get('entity', "NO ENTITY SET!"), params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp)
+			reply = drush.communicate(input=json.dumps(query))[0]
+			return json.loads(reply)
+		except:
+			raise CiviTransportException("DRUSH failed! Please check paths.")
 
-			result = json.loads(reply)
 
-			# do some logging
-			runtime = time.time()-timestamp
-			self._api_calls += 1
-			self._api_calls_time += runtime
+	def performAPICall(self, params=dict()):
+		timestamp = time.time()
+		entity = params['entity']
+		action = params['action']
 
-			if result.has_key('undefined_fields'):
-				fields = result['undefined_fields']
-				if fields:
-					self.log("API call: Undefined fields reported: %s" % str(fields), 
-						logging.DEBUG, 'API', params['action'], params['entity'], params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp)
+		# remove unsuitable parameters
+		query = dict(params)
+		for non_param in self.non_parameters:
+			query.pop(non_param, None)
 
-			if result['is_error']:
-				self.log("API call error: '%s'" % result['error_message'], 
-					logging.ERROR, 'API', params['action'], params['entity'], params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp)
-				raise CiviAPIException(result['error_message'])
+		try:
+			if self.worker_pool:
+				query['version'] = self.api_version
+				result = self.worker_pool.call(entity, action, query)
 			else:
-				return result
-
+				result = self._callProcess(entity, action, query)
 		except:
-			raise CiviAPIException("DRUSH failed! Please check paths.")
+			self._recordCall(entity, action, time.time()-timestamp, True)
+			raise
+
+		self.log("API call completed - %s.%s",
+			logging.DEBUG, 'API', action, entity, params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp, args=(entity, action))
+
+		# do some logging
+		runtime = time.time()-timestamp
+		self._recordCall(entity, action, runtime, result.get('is_error', False))
+
+		if result.has_key('undefined_fields'):
+			fields = result['undefined_fields']
+			if fields:
+				self.log("API call: Undefined fields reported: %s" % str(fields),
+					logging.DEBUG, 'API', action, entity, params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp)
 
+		if result['is_error']:
+			self.log("API call error: '%s'" % result['error_message'],
+				logging.ERROR, 'API', action, entity, params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp)
+			raise CiviAPIException(result['error_message'])
+		else:
+			return result
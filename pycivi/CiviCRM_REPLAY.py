@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+
+import logging
+import json
+import gzip
+import time
+import threading
+import collections
+import urllib
+import socket
+import errno
+
+from CiviEntity import *
+from CiviCRM import CiviCRM, CiviAPIException as CoreAPIException
+
+
+class CiviAPIException(CoreAPIException):
+	def __init__(self, msg, code=None):
+		self.msg = msg
+		self.code = code
+	def __str__(self):
+		return self.msg
+
+
+def _call_key(params):
+	"""
+	canonical representation of a call, used to match replayed calls
+	"""
+	return json.dumps(params, sort_keys=True, default=unicode)
+
+
+class CiviCRM_RECORDER(CiviCRM):
+	"""
+	Wraps another CiviCRM instance and records every call to a gzipped JSONL file.
+
+	Each line holds one call:
+	  't': start (seconds since the recording started), 'd': duration (s), 'th': thread,
+	  'p': parameters, 'r': result or 'e': error message (and 'c': HTTP code),
+	  's': 1 if it was a performSimpleAPICall
+	"""
+
+	def __init__(self, instance, recording_file, logfile=None):
+		CiviCRM.__init__(self, logfile)
+		self.wrapped_instance = instance
+		self.recording_file = recording_file
+		self.output = gzip.open(recording_file, 'wb')
+		self.output_lock = threading.Lock()
+		self.start_time = time.time()
+		self.recorded = 0
+
+
+	def performAPICall(self, params=dict(), execParams=dict()):
+		return self._record(self.wrapped_instance.performAPICall, params, False)
+
+
+	def performSimpleAPICall(self, params=dict(), execParams=dict()):
+		return self._record(self.wrapped_instance.performSimpleAPICall, params, True)
+
+
+	def _record(self, method, params, simple):
+		entry = {'p': params, 'th': threading.currentThread().name}
+		if simple:
+			entry['s'] = 1
+		timestamp = time.time()
+		failed = False
+		try:
+			result = method(dict(params))
+			entry['r'] = result
+			return result
+		except Exception as error:
+			failed = True
+			entry['e'] = unicode(error)
+			if getattr(error, 'code', None):
+				entry['c'] = error.code
+			raise
+		finally:
+			entry['t'] = round(timestamp - self.start_time, 6)
+			entry['d'] = round(time.time() - timestamp, 6)
+			line = json.dumps(entry, separators=(',', ':'), default=unicode) + '\n'
+			self.output_lock.acquire()
+			if self.output:
+				self.output.write(line)
+				self.recorded += 1
+			self.output_lock.release()
+			self._recordCall(params.get('entity', ''), params.get('action', ''), time.time() - timestamp, failed)
+
+
+	def close(self):
+		"""
+		finish the recording file
+		"""
+		self.output_lock.acquire()
+		if self.output:
+			self.output.close()
+			self.output = None
+			self.log("Recorded %d calls to '%s'" % (self.recorded, self.recording_file),
+				logging.INFO, 'API', 'record', None, None, None, time.time()-self.start_time)
+		self.output_lock.release()
+		if hasattr(self.wrapped_instance, 'close'):
+			self.wrapped_instance.close()
+
+
+
+class CiviCRM_REPLAY(CiviCRM):
+	"""
+	Serves the calls of a CiviCRM_RECORDER recording.
+
+	Identical calls are answered in the order they were recorded, the last answer
+	is repeated when they run out. Calls that weren't recorded raise a CiviAPIException.
+
+	options['latency']: if True, every call takes as long as the recorded one,
+	                    options['speed'] scales these delays (e.g. 2.0 = twice as fast)
+	options['faults']:  a faults.FaultProfile adding latencies, HTTP errors
+	                    (raised like CiviCRM_REST does) and connection resets
+	"""
+
+	def __init__(self, recording_file, logfile=None, options=dict()):
+		CiviCRM.__init__(self, logfile)
+		self.recording_file = recording_file
+		self.latency = options.get('latency', False)
+		self.speed = float(options.get('speed', 1.0))
+		self.faults = options.get('faults', None)
+		self.responses = dict()
+		self.responses_lock = threading.Lock()
+		self.missed = 0
+
+		count = 0
+		for line in gzip.open(recording_file, 'rb'):
+			entry = json.loads(line)
+			key = _call_key(entry['p'])
+			if not key in self.responses:
+				self.responses[key] = collections.deque()
+			self.responses[key].append(entry)
+			count += 1
+		self.log("Loaded %d recorded calls from '%s'" % (count, recording_file),
+			logging.INFO, 'API', 'replay', None, None, None, 0)
+
+
+	def performAPICall(self, params=dict(), execParams=dict()):
+		return self._replay(params)
+
+
+	def performSimpleAPICall(self, params=dict(), execParams=dict()):
+		return self._replay(params)
+
+
+	def _replay(self, params):
+		timestamp = time.time()
+		if self.faults:
+			# before the lookup, so a failed call doesn't use up its answer
+			try:
+				self._simulateFaults(params)
+			except:
+				self._recordCall(params.get('entity', ''), params.get('action', ''), time.time() - timestamp, True)
+				raise
+
+		key = _call_key(params)
+		self.responses_lock.acquire()
+		responses = self.responses.get(key, None)
+		if responses:
+			if len(responses) > 1:
+				entry = responses.popleft()
+			else:
+				entry = responses[0]
+		else:
+			entry = None
+			self.missed += 1
+		self.responses_lock.release()
+
+		if entry==None:
+			self.log("No recorded response for call %s" % key,
+				logging.ERROR, 'API', params.get('action', ''), params.get('entity', ''), params.get('id', ''), None, 0)
+			self._recordCall(params.get('entity', ''), params.get('action', ''), time.time() - timestamp, True)
+			raise CiviAPIException("No recorded response for this call")
+
+		if self.latency:
+			delay = entry['d'] / self.speed - (time.time() - timestamp)
+			if delay > 0:
+				time.sleep(delay)
+
+		runtime = time.time() - timestamp
+		self._recordCall(params.get('entity', ''), params.get('action', ''), runtime, 'e' in entry)
+
+		if 'e' in entry:
+			raise CiviAPIException(entry['e'], entry.get('c', None))
+		return entry['r']
+
+
+	def _simulateFaults(self, params):
+		action = params.get('action', None)
+		url_length = None
+		if not action in ['create', 'delete']:
+			url_length = len(urllib.urlencode(dict([(key, unicode(value).encode('utf8')) for key, value in params.items()])))
+		decision = self.faults.decide(action, url_length)
+		if decision.delay:
+			time.sleep(decision.delay)
+		if decision.reset:
+			raise socket.error(errno.ECONNRESET, "Connection reset by peer (simulated)")
+		if decision.status==414:
+			raise CiviAPIException("Request is too long, please check server settings or use forcePost")
+		elif decision.status:
+			raise CiviAPIException("HTML response code %d received, please check URL" % decision.status, decision.status)
@@ -37,10 +37,11 @@ import time
 import threading
 import os
 import traceback
+import urllib
 from distutils.version import LooseVersion
 
 from CiviEntity import *
-from CiviCRM import CiviCRM
+from CiviCRM import CiviCRM, CiviAPIException as CoreAPIException
 
 try:
 	import requests
@@ -85,7 +86,7 @@ class ApiCallRepeater(object):
 api_call_repeater = ApiCallRepeater()
 
 
-class CiviAPIException(Exception):
+class CiviAPIException(CoreAPIException):
 	def __init__(self, msg, code=None):
 		self.msg = msg
 		self.code = code
@@ -93,7 +94,21 @@ class CiviAPIException(Exception):
 		return self.msg
 
 
+def _queryLength(params):
+	"""
+	length of the params, encoded as URL query
+	"""
+	return len(urllib.urlencode([(key, isinstance(value, unicode) and value.encode('utf8') or str(value)) for key, value in params.items()]))
+
+
 class CiviCRM_REST(CiviCRM):
+	"""
+	CiviCRM API access through extern/rest.php.
+
+	Reads are sent as GET, unless forcePost is set (attribute or execParams),
+	or the query is longer than options['max_get_length'] characters
+	(e.g. bulk lookups with long IN lists, servers reject long URLs with 414)
+	"""
 
 	def __init__(self, url, site_key, user_key, logfile=None, options=dict()):
 		# init some attributes
@@ -103,6 +118,7 @@ class CiviCRM_REST(CiviCRM):
 		self.user_key = user_key
 		self.auth = None
 		self.forcePost = False
+		self.max_get_length = options.get('max_get_length', 4096)
 		self.headers = {}
 		self.json_parameters = False
 
@@ -133,7 +149,9 @@ class CiviCRM_REST(CiviCRM):
 		if self.debug:
 			params['debug'] = 1
 
-		if self.json_parameters:
+		# complex parameters (e.g. {'IN': [...]}) can only be passed in the json block
+		complex_parameters = [param for param in params if type(params[param]) in [list, dict, tuple, set]]
+		if self.json_parameters or complex_parameters:
 			# pack complex parameters into a serialised json block
 			not_json = ['api_key', 'key', 'action', 'entity']
 			json_params = dict()
@@ -142,33 +160,31 @@ class CiviCRM_REST(CiviCRM):
 					json_params[param] = params.pop(param)
 			params['json'] = json.dumps(json_params)
 
-		# check for complex parameters
-		for param in params:
-			if type(params[param]) in [list, dict, tuple, set]:
-				self.log("Parameter '%s' is not of basic type. For complex parameters, consider turning on the 'json_parameters' option." % param,
-					logging.WARN, 'API', params.get('action', "NO ACTION SET"), params.get('entity', "NO ENTITY SET!"), params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp)
-				break
-
-		forcePost = execParams.get('forcePost', False) or self.forcePost
-		if (params['action'] in ['create', 'delete']) or forcePost:
-			reply = requests.post(self.rest_url, data=params, verify=True, auth=self.auth, headers=self.headers)
-		else:
-			reply = requests.get(self.rest_url, params=params, verify=True, auth=self.auth, headers=self.headers)
+		forcePost = execParams.get('forcePost', False) or self.forcePost or _queryLength(params) > self.max_get_length
+		try:
+			if (params['action'] in ['create', 'delete']) or forcePost:
+				reply = requests.post(self.rest_url, data=params, verify=True, auth=self.auth, headers=self.headers)
+			else:
+				reply = requests.get(self.rest_url, params=params, verify=True, auth=self.auth, headers=self.headers)
+		except:
+			self._recordCall(params.get('entity', ''), params.get('action', ''), time.time()-timestamp, True)
+			raise
 
-		self.log("API call completed - status: %d, url: '%s'" % (reply.status_code, reply.url),
-			logging.DEBUG, 'API', params.get('action', "NO ACTION SET"), params.get('entity', "NO ENTITY SET!"), params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp)
+		self.log("API call completed - status: %s, url: '%s'",
+			logging.DEBUG, 'API', params.get('action', "NO ACTION SET"), params.get('entity', "NO ENTITY SET!"), params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp,
+			args=(reply.status_code, reply.url))
 
-		if reply.status_code == 414:
-			raise CiviAPIException("Request is too long, please check server settings or use forcePost")
-		elif reply.status_code != 200:
+		if reply.status_code != 200:
+			self._recordReply(params, reply, time.time()-timestamp, True)
+			if reply.status_code == 414:
+				raise CiviAPIException("Request is too long, please check server settings or use forcePost")
 			raise CiviAPIException("HTML response code %d received, please check URL" % reply.status_code, reply.status_code)
 
 		result = json.loads(reply.text)
 
 		# do some logging
 		runtime = time.time()-timestamp
-		self._api_calls += 1
-		self._api_calls_time += runtime
+		self._recordReply(params, reply, runtime, result.get('is_error', False))
 
 		if result.has_key('undefined_fields'):
 			fields = result['undefined_fields']
@@ -195,15 +211,22 @@ class CiviCRM_REST(CiviCRM):
 		if self.debug:
 			params['debug'] = 1
 
-		if (params['action'] in ['create', 'delete']) or (execParams.get('forcePost', False)):
-			reply = requests.post(self.rest_url, data=params, verify=True, auth=self.auth)
-		else:
-			reply = requests.get(self.rest_url, params=params, verify=True, auth=self.auth)
+		forcePost = execParams.get('forcePost', False) or self.forcePost or _queryLength(params) > self.max_get_length
+		try:
+			if (params['action'] in ['create', 'delete']) or forcePost:
+				reply = requests.post(self.rest_url, data=params, verify=True, auth=self.auth)
+			else:
+				reply = requests.get(self.rest_url, params=params, verify=True, auth=self.auth)
+		except:
+			self._recordCall(params.get('entity', ''), params.get('action', ''), time.time()-timestamp, True)
+			raise
 
-		self.log("API call completed - status: %d, url: '%s'" % (reply.status_code, reply.url),
-			logging.DEBUG, 'API', params.get('action', "NO ACTION SET"), params.get('entity', "NO ENTITY SET!"), params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp)
+		self.log("API call completed - status: %s, url: '%s'",
+			logging.DEBUG, 'API', params.get('action', "NO ACTION SET"), params.get('entity', "NO ENTITY SET!"), params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp,
+			args=(reply.status_code, reply.url))
 
 		if reply.status_code != 200:
+			self._recordReply(params, reply, time.time()-timestamp, True)
 			raise CiviAPIException("HTML response code %d received, please check URL" % reply.status_code, reply.status_code)
 
 		try:
@@ -215,8 +238,7 @@ class CiviCRM_REST(CiviCRM):
 
 		# do some logging
 		runtime = time.time()-timestamp
-		self._api_calls += 1
-		self._api_calls_time += runtime
+		self._recordReply(params, reply, runtime, result.get('is_error', False))
 
 		if result.has_key('undefined_fields'):
 			fields = result['undefined_fields']
@@ -225,3 +247,8 @@ class CiviCRM_REST(CiviCRM):
 					logging.DEBUG, 'API', params['action'], params['entity'], params.get('id', ''), params.get('external_identifier', ''), time.time()-timestamp)
 
 		return result
+
+
+	def _recordReply(self, params, reply, runtime, error):
+		bytes_out = len(reply.request.url) + len(reply.request.body or '')
+		self._recordCall(params.get('entity', ''), params.get('action', ''), runtime, error, len(reply.content), bytes_out)
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+
+import logging
+import time
+import threading
+import random
+import collections
+
+from CiviEntity import *
+from CiviCRM import CiviCRM, CiviAPIException, CiviTransportException
+
+
+READ_ACTIONS = ['get', 'getsingle', 'getcount', 'getvalue', 'getfields', 'getoptions']
+
+
+class RouteStatistics:
+	"""
+	Latency (EWMA) and error statistics for one (backend, entity, action) route
+	"""
+	def __init__(self):
+		self.latency = None
+		self.calls = 0
+		self.errors = 0
+
+	def record(self, runtime, alpha):
+		self.calls += 1
+		if self.latency==None:
+			self.latency = runtime
+		else:
+			self.latency = alpha * runtime + (1.0 - alpha) * self.latency
+
+
+class BackendState:
+	"""
+	Load and health of one backend
+	"""
+	def __init__(self, name, instance):
+		self.name = name
+		self.instance = instance
+		self.in_flight = 0
+		self.cooldown_until = 0
+		self.completed = collections.deque()		# timestamps of the calls completed within the throughput window
+
+	def complete(self, now, window):
+		self.completed.append(now)
+		self._expire(now, window)
+
+	def throughput(self, now, window):
+		self._expire(now, window)
+		return len(self.completed) / float(window)
+
+	def _expire(self, now, window):
+		while self.completed and self.completed[0] < now - window:
+			self.completed.popleft()
+
+
+class CiviCRM_ROUTED(CiviCRM):
+	"""
+	Routes each API call to one of several backends (e.g. CiviCRM_DRUSH, CiviCRM_REST, CiviCRM_BRIDGED).
+
+	The latency of every backend is measured online per entity and action, and the
+	call is sent to the backend with the lowest expected runtime, i.e. the latency
+	scaled by the number of calls currently running on that backend. Routes that
+	haven't been measured yet are tried first, and options['explore'] of the calls
+	go to a random backend to keep the measurements current.
+
+	If a backend fails (connection error, HTTP error code, CiviTransportException,
+	no result at all, ...) it is taken out of the rotation for options['cooldown']
+	seconds, and the call is repeated on another backend. Write calls are only
+	repeated if options['failover_writes'] is set, since they might have been
+	executed before the failure. Errors reported by the API (other
+	CiviAPIExceptions without a HTTP code) are raised as usual.
+	"""
+
+	def __init__(self, backends, logfile=None, options=dict()):
+		CiviCRM.__init__(self, logfile)
+		if type(backends)==dict:
+			backends = sorted(backends.items())
+		else:
+			backends = [(backend.__class__.__name__ + '-' + str(index), backend) for index, backend in enumerate(backends)]
+		if not backends:
+			raise CiviAPIException("CiviCRM_ROUTED needs at least one backend.")
+		self.backends = [BackendState(name, instance) for name, instance in backends]
+		for name, instance in backends:
+			# tell the backends apart in the metrics
+			if getattr(instance, 'metrics_name', None)==instance.__class__.__name__:
+				instance.metrics_name = name
+
+		self.alpha = options.get('alpha', 0.2)
+		self.explore = options.get('explore', 0.05)
+		self.cooldown = options.get('cooldown', 30)
+		self.failover_writes = options.get('failover_writes', False)
+		self.throughput_window = options.get('throughput_window', 60)
+
+		self.routes = dict()
+		self.routes_lock = threading.Lock()
+
+
+	def close(self):
+		for backend in self.backends:
+			if hasattr(backend.instance, 'close'):
+				backend.instance.close()
+
+
+	def _route(self, backend, entity, action):
+		key = (backend.name, entity, action)
+		route = self.routes.get(key, None)
+		if route==None:
+			route = self.routes[key] = RouteStatistics()
+		return route
+
+
+	def _selectBackend(self, entity, action, exclude):
+		"""
+		pick the backend with the lowest expected runtime, has to be called with routes_lock held
+		"""
+		now = time.time()
+		candidates = [backend for backend in self.backends if backend not in exclude]
+		if not candidates:
+			return None
+		healthy = [backend for backend in candidates if backend.cooldown_until <= now]
+		if healthy:
+			candidates = healthy
+
+		if len(candidates) > 1 and random.random() < self.explore:
+			return random.choice(candidates)
+
+		best, best_score = None, None
+		for backend in candidates:
+			route = self._route(backend, entity, action)
+			if route.latency==None:
+				# not measured yet
+				return backend
+			score = route.latency * (1 + backend.in_flight)
+			if best_score==None or score < best_score:
+				best, best_score = backend, score
+		return best
+
+
+	def _isAPIError(self, error):
+		"""
+		API errors are reported by CiviCRM itself, other backends would report them as well
+		"""
+		if isinstance(error, CiviTransportException):
+			return False
+		return isinstance(error, CiviAPIException) and getattr(error, 'code', None)==None
+
+
+	def performAPICall(self, params=dict(), execParams=dict()):
+		entity = params.get('entity', '').lower()
+		action = params.get('action', '').lower()
+		may_fail_over = action in READ_ACTIONS or self.failover_writes
+		tried = list()
+		started = time.time()
+
+		while True:
+			self.routes_lock.acquire()
+			backend = self._selectBackend(entity, action, tried)
+			if backend:
+				backend.in_flight += 1
+			self.routes_lock.release()
+			if not backend:
+				self._recordCall(params.get('entity', ''), params.get('action', ''), time.time()-started, True)
+				raise last_error
+			tried.append(backend)
+
+			timestamp = time.time()
+			try:
+				result = backend.instance.performAPICall(params)
+				if result==None:
+					# e.g. CiviCRM_BRIDGED without a bridge
+					raise CiviTransportException("Backend '%s' returned no result" % backend.name)
+			except Exception as error:
+				runtime = time.time() - timestamp
+				api_error = self._isAPIError(error)
+				self.routes_lock.acquire()
+				backend.in_flight -= 1
+				if api_error:
+					self._route(backend, entity, action).record(runtime, self.alpha)
+				else:
+					self._route(backend, entity, action).errors += 1
+					backend.cooldown_until = time.time() + self.cooldown
+				self.routes_lock.release()
+
+				if api_error or not may_fail_over:
+					self._recordCall(params.get('entity', ''), params.get('action', ''), time.time()-started, True)
+				if api_error:
+					raise
+				self.logException("Backend '%s' failed, suspended for %ss: " % (backend.name, self.cooldown),
+					logging.WARN, 'API', action, entity, params.get('id', ''), params.get('external_identifier', ''), runtime)
+				if not may_fail_over:
+					raise
+				last_error = error
+				continue
+
+			runtime = time.time() - timestamp
+			self.routes_lock.acquire()
+			backend.in_flight -= 1
+			backend.complete(time.time(), self.throughput_window)
+			self._route(backend, entity, action).record(runtime, self.alpha)
+			self.routes_lock.release()
+
+			self._recordCall(params.get('entity', ''), params.get('action', ''), time.time()-started)
+			return result
+
+
+	def getStatistics(self):
+		"""
+		returns the current routing statistics:
+		  {backend name: {'throughput': calls/s, 'in_flight': n, 'suspended': bool,
+		                  'routes': {(entity, action): {'latency': s, 'calls': n, 'errors': n}}}}
+		"""
+		now = time.time()
+		statistics = dict()
+		self.routes_lock.acquire()
+		for backend in self.backends:
+			statistics[backend.name] = {
+				'throughput': backend.throughput(now, self.throughput_window),
+				'in_flight': backend.in_flight,
+				'suspended': backend.cooldown_until > now,
+				'routes': dict(),
+			}
+		for (name, entity, action), route in self.routes.items():
+			statistics[name]['routes'][(entity, action)] = {
+				'latency': route.latency,
+				'calls': route.calls,
+				'errors': route.errors,
+			}
+		self.routes_lock.release()
+		return statistics
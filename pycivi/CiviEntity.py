@@ -31,6 +31,24 @@ __email__       = "endres[at]systopia.de"
 import entity_type
 import logging
 
+
+def _differs(current_value, new_value):
+	"""
+	compares an attribute value as delivered by the API (mostly strings)
+	with a new value, that might be typed (e.g. from a JSON or SQL record source)
+	"""
+	if current_value==new_value:
+		return False
+	if isinstance(new_value, bool):
+		new_value = int(new_value)
+	if isinstance(new_value, (int, long, float)) and isinstance(current_value, basestring):
+		try:
+			return float(current_value)!=new_value
+		except ValueError:
+			return True
+	return True
+
+
 class CiviEntity:
 	def __init__(self, entity_type, entity_id, civicrm, attributes=dict()):
 		self.entity_type = entity_type
@@ -53,19 +71,25 @@ class CiviEntity:
 	def set(self, attribute_key, new_value):
 		self.attributes[attribute_key] = new_value
 
+	def _storeRequest(self, changed_attributes):
+		"""
+		the API call storing the changes
+		"""
+		request = dict(changed_attributes)
+		request['action'] = 'create'
+		request['entity'] = self.entity_type
+		request['id'] = self.attributes['id']
+		return request
+
 	def _storeChanges(self, changed_attributes):
 		if changed_attributes:
-			request = dict(changed_attributes)
-			request['action'] = 'create'
-			request['entity'] = self.entity_type
-			request['id'] = self.attributes['id']
-			self.civicrm.performAPICall(request)
+			self.civicrm.performAPICall(self._storeRequest(changed_attributes))
 
 	# update all provided attributes.
 	def update(self, attributes, store=False):
 		changed = dict()
 		for key in attributes.keys():
-			if (self.attributes.get(key, None)!=attributes[key]):
+			if _differs(self.attributes.get(key, None), attributes[key]):
 				self.attributes[key] = attributes[key]
 				changed[key] = self.attributes[key]
 		if store:
@@ -89,7 +113,7 @@ class CiviEntity:
 		changed = dict()
 		for key in attributes.keys():
 			if self.attributes.has_key(key):
-				if (self.attributes[key]!=attributes[key]):
+				if _differs(self.attributes[key], attributes[key]):
 					self.attributes[key] = attributes[key]
 					changed[key] = self.attributes[key]
 		if store:
@@ -111,14 +135,14 @@ class CiviEntity:
 		# find the fields that have changed
 		changes = dict()
 		for key in self.attributes:
-			if not current_state.has_key(key) or self.attributes[key]!=current_state[key]:
+			if not current_state.has_key(key) or _differs(current_state[key], self.attributes[key]):
 				changes[key] = self.attributes[key]
 
 		if changes:
 			self._storeChanges(changes)
-			civi.log("Stored changes to '%s'" % unicode(str(self), 'utf8'), logging.INFO)
+			civi.log("Stored changes to '%s'", logging.INFO, args=(self,))
 		else:
-			civi.log("No changes have been made, not storing '%s'" % unicode(str(self), 'utf8'), logging.INFO)
+			civi.log("No changes have been made, not storing '%s'", logging.INFO, args=(self,))
 
 
 	def delete(self, final=True, civi=None):
@@ -324,10 +348,8 @@ class CiviEmailEntity(CiviEntity):
 	# update all provided attributes.
 	# FIX for Civicrm-4.3.7:
 	# We need to provide all attributes of the entity for an update
-	def _storeChanges(self, changed_attributes):
-		if changed_attributes:
-			# we have to submit the entity_id
-			if not 'email' in changed_attributes:
-				changed_attributes['email'] = self.get('email')
-			return CiviEntity._storeChanges(self, changed_attributes)
-		return dict()
+	def _storeRequest(self, changed_attributes):
+		request = CiviEntity._storeRequest(self, changed_attributes)
+		if not 'email' in request:
+			request['email'] = self.get('email')
+		return request
@@ -0,0 +1,105 @@
+<?php
+/*
+ * This is a python API wrapper for CiviCRM (https://civicrm.org/)
+ * Copyright (C) 2013 Systopia  (endres@systopia.de)
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/**
+ * pycivi DRUSH worker
+ *
+ * Run with 'drush php-script drush_worker.php'. Bootstraps CiviCRM once, then
+ * serves API calls: one JSON request per line on stdin, one JSON reply per line
+ * on stdout, prefixed with 'PYCIVI:' to tell it apart from other output.
+ *
+ * Requests are {"entity": ..., "action": ..., "params": {...}}, or {"ping": 1}
+ * for a health check.
+ *
+ * Batch mode: 'drush php-script drush_worker.php batch <calls.jsonl> [<results.jsonl>|-] [<transaction_size>]'
+ * executes all requests in the calls file and writes one result per line, in
+ * the same order, to the results file (or stdout, prefixed like above).
+ * With a transaction_size > 0, every transaction_size calls are committed
+ * in one database transaction.
+ */
+
+civicrm_initialize();
+
+function pycivi_reply($data, $output = NULL) {
+  if ($output) {
+    fwrite($output, json_encode($data) . "\n");
+  }
+  else {
+    fwrite(STDOUT, 'PYCIVI:' . json_encode($data) . "\n");
+    fflush(STDOUT);
+  }
+}
+
+function pycivi_execute($request) {
+  if (!is_array($request)) {
+    return array('is_error' => 1, 'error_message' => 'Invalid request');
+  }
+
+  if (!empty($request['ping'])) {
+    return array('is_error' => 0, 'pong' => 1, 'memory' => memory_get_usage());
+  }
+
+  $params = isset($request['params']) ? $request['params'] : array();
+  if (!isset($params['version'])) {
+    $params['version'] = 3;
+  }
+  try {
+    return civicrm_api($request['entity'], $request['action'], $params);
+  }
+  catch (Exception $e) {
+    return array('is_error' => 1, 'error_message' => $e->getMessage());
+  }
+}
+
+$mode = drush_shift();
+if ($mode == 'batch') {
+  $input = fopen(drush_shift(), 'r');
+  $output_file = drush_shift();
+  $output = ($output_file && $output_file != '-') ? fopen($output_file, 'w') : NULL;
+  $transaction_size = (int) drush_shift();
+
+  $transaction = NULL;
+  $pending = 0;
+  while (($line = fgets($input)) !== FALSE) {
+    if (trim($line) == '') {
+      continue;
+    }
+    if ($transaction_size > 0 && !$transaction) {
+      $transaction = new CRM_Core_Transaction();
+    }
+    pycivi_reply(pycivi_execute(json_decode($line, TRUE)), $output);
+    $pending++;
+    if ($transaction && $pending >= $transaction_size) {
+      $transaction->commit();
+      $transaction = NULL;
+      $pending = 0;
+    }
+  }
+  if ($transaction) {
+    $transaction->commit();
+  }
+  if ($output) {
+    fclose($output);
+  }
+}
+else {
+  while (($line = fgets(STDIN)) !== FALSE) {
+    pycivi_reply(pycivi_execute(json_decode($line, TRUE)));
+  }
+}
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Simulated server behaviour for the stand-in server and the replay backend:
+latency distributions, 5xx bursts, 414 responses, slow writes and connection resets.
+
+	faults = FaultProfile(latency={'distribution': 'lognormal', 'median': 0.01, 'sigma': 1.0},
+	                      burst_rate=0.01, burst_length=20, reset_rate=0.001)
+	server = StandInServer(api=StandInAPI(), faults=faults)
+	civicrm = CiviCRM_REPLAY('recording.jsonl.gz', options={'faults': faults})
+
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+import math
+import random
+import threading
+
+
+WRITE_ACTIONS = ['create', 'delete', 'replace']
+
+
+def sample_latency(spec, generator=random):
+	"""
+	draw a latency (in seconds) from a distribution spec:
+	  {'distribution': 'constant', 'value': s}
+	  {'distribution': 'uniform', 'low': s, 'high': s}
+	  {'distribution': 'normal', 'mean': s, 'stddev': s}
+	  {'distribution': 'lognormal', 'median': s, 'sigma': x}       (long tail)
+	  {'distribution': 'pareto', 'scale': s, 'alpha': x}           (heavy tail, alpha <= 2)
+	  {'distribution': 'mixture', 'components': [{'weight': w, ...spec...}, ...]}
+	a plain number is a constant latency
+	"""
+	if not spec:
+		return 0.0
+	if isinstance(spec, (int, long, float)):
+		return float(spec)
+
+	distribution = spec.get('distribution', 'constant')
+	if distribution=='constant':
+		latency = spec.get('value', 0.0)
+	elif distribution=='uniform':
+		latency = generator.uniform(spec.get('low', 0.0), spec['high'])
+	elif distribution=='normal':
+		latency = generator.normalvariate(spec['mean'], spec.get('stddev', 0.0))
+	elif distribution=='lognormal':
+		latency = generator.lognormvariate(math.log(spec['median']), spec.get('sigma', 1.0))
+	elif distribution=='pareto':
+		latency = spec['scale'] * generator.paretovariate(spec.get('alpha', 1.5))
+	elif distribution=='mixture':
+		components = spec['components']
+		choice = generator.random() * sum([component.get('weight', 1.0) for component in components])
+		for component in components:
+			choice -= component.get('weight', 1.0)
+			if choice <= 0:
+				break
+		latency = sample_latency(component, generator)
+	else:
+		raise ValueError("Unknown latency distribution '%s'" % distribution)
+
+	return max(0.0, min(latency, spec.get('max', latency)))
+
+
+class FaultDecision:
+	"""
+	what should happen to one request:
+	  delay: seconds to wait before answering
+	  status: HTTP status to answer with instead of the API result (or None)
+	  reset: drop the connection without an answer
+	"""
+	def __init__(self, delay=0.0, status=None, reset=False):
+		self.delay = delay
+		self.status = status
+		self.reset = reset
+
+
+class FaultProfile:
+	"""
+	A configurable model of server misbehaviour.
+
+	latency            distribution of the latency of every call (see sample_latency)
+	write_latency      additional latency of create/delete calls
+	error_rate         probability of a single error_status response
+	burst_rate         probability that a burst of burst_length error_status responses starts
+	error_status       the HTTP status of these errors (default 503)
+	max_url_length     GET requests with longer URLs get a 414
+	reset_rate         probability that the connection is dropped
+	seed               seed for reproducible runs
+	"""
+
+	def __init__(self, latency=None, write_latency=None, error_rate=0.0, burst_rate=0.0, burst_length=10,
+			error_status=503, max_url_length=None, reset_rate=0.0, seed=None):
+		self.latency = latency
+		self.write_latency = write_latency
+		self.error_rate = error_rate
+		self.burst_rate = burst_rate
+		self.burst_length = burst_length
+		self.error_status = error_status
+		self.max_url_length = max_url_length
+		self.reset_rate = reset_rate
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.burst_remaining = 0
+		self.decisions = 0
+		self.errors = 0
+		self.resets = 0
+
+
+	def decide(self, action=None, url_length=None):
+		"""
+		roll the dice for one request
+		"""
+		self.lock.acquire()
+		try:
+			self.decisions += 1
+			delay = sample_latency(self.latency, self.random)
+			if action in WRITE_ACTIONS:
+				delay += sample_latency(self.write_latency, self.random)
+
+			if self.max_url_length and url_length and url_length > self.max_url_length:
+				self.errors += 1
+				return FaultDecision(delay, 414)
+
+			if self.reset_rate and self.random.random() < self.reset_rate:
+				self.resets += 1
+				return FaultDecision(delay, reset=True)
+
+			if not self.burst_remaining and self.burst_rate and self.random.random() < self.burst_rate:
+				self.burst_remaining = self.burst_length
+			if self.burst_remaining:
+				self.burst_remaining -= 1
+				self.errors += 1
+				return FaultDecision(delay, self.error_status)
+
+			if self.error_rate and self.random.random() < self.error_rate:
+				self.errors += 1
+				return FaultDecision(delay, self.error_status)
+
+			return FaultDecision(delay)
+		finally:
+			self.lock.release()
+
+
+	def statistics(self):
+		return {'requests': self.decisions, 'errors': self.errors, 'resets': self.resets}
@@ -29,7 +29,7 @@ __maintainer__  = "Björn Endres"
 __email__       = "endres[at]systopia.de"
 
 
-import CiviCRM, entity_type
+import CiviCRM, entity_type, tracing, profiling
 import csv
 import codecs
 import threading
@@ -38,8 +38,20 @@ import time
 import traceback
 import datetime
 import sha
+import operator
+import itertools
+import os
+import multiprocessing
+import Queue
+import sys
+import zlib
+import bz2
+import subprocess
+import json
+import sqlite3
 
 from CiviCRM import CiviAPIException
+from CiviEntity import _differs
 
 
 class UTF8Recoder:
@@ -73,41 +85,755 @@ class UnicodeReader:
         return self
 
 
+COMPRESSION_MAGIC = [
+	('gzip', '\x1f\x8b'),
+	('bz2',  'BZh'),
+	('xz',   '\xfd7zXZ\x00'),
+	]
+
+COMPRESSION_EXTENSIONS = {
+	'.gz':   'gzip',
+	'.gzip': 'gzip',
+	'.bz2':  'bz2',
+	'.xz':   'xz',
+	}
+
+
+def _get_decompressor_factory(compression):
+	if compression=='gzip':
+		return lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+	elif compression=='bz2':
+		return bz2.BZ2Decompressor
+	elif compression=='xz':
+		try:
+			import lzma
+		except ImportError:
+			try:
+				from backports import lzma
+			except ImportError:
+				return None
+		return lzma.LZMADecompressor
+	else:
+		raise Exception("Unknown compression '%s'" % compression)
+
+
+def _detect_compression(path):
+	for extension, compression in COMPRESSION_EXTENSIONS.items():
+		if path.lower().endswith(extension):
+			return compression
+	stream = open(path, 'rb')
+	head = stream.read(6)
+	stream.close()
+	for compression, magic in COMPRESSION_MAGIC:
+		if head.startswith(magic):
+			return compression
+	return None
+
+
+class _DecompressingStream:
+	"""
+	Read-only file-like object streaming (and decompressing) the data of another stream
+	in large blocks. Concatenated compressed streams (e.g. pigz/pbzip2 output) are supported.
+	If no decompressor_factory is given, the data is passed through as it is.
+	"""
+	def __init__(self, stream, decompressor_factory=None, buffer_size=1048576, prefix=''):
+		self.stream = stream
+		self.decompressor_factory = decompressor_factory
+		self.decompressor = decompressor_factory() if decompressor_factory else None
+		self.buffer_size = buffer_size
+		self.buffer = ''
+		self.position = 0
+		self.eof = False
+		if prefix:
+			self._feed(prefix)
+
+	def _decompress(self, data):
+		if getattr(self.decompressor, 'eof', False):
+			# the last stream ended exactly at a block boundary, the next one starts here
+			self.decompressor = self.decompressor_factory()
+		try:
+			return self.decompressor.decompress(data)
+		except EOFError:
+			# same, for decompressors without the eof attribute (python 2's BZ2Decompressor)
+			self.decompressor = self.decompressor_factory()
+			return self.decompressor.decompress(data)
+
+	def _feed(self, data):
+		if self.decompressor:
+			decompressed = self._decompress(data)
+			unused = getattr(self.decompressor, 'unused_data', '')
+			while unused:
+				# the next stream starts here
+				self.decompressor = self.decompressor_factory()
+				decompressed += self._decompress(unused)
+				unused = getattr(self.decompressor, 'unused_data', '')
+			data = decompressed
+		self.buffer = self.buffer[self.position:] + data
+		self.position = 0
+
+	def _fill(self):
+		data = self.stream.read(self.buffer_size)
+		if data:
+			self._feed(data)
+		else:
+			self.buffer = self.buffer[self.position:]
+			self.position = 0
+			self.eof = True
+
+	def read(self, size=-1):
+		while not self.eof and (size < 0 or len(self.buffer) - self.position < size):
+			self._fill()
+		if size < 0:
+			size = len(self.buffer) - self.position
+		data = self.buffer[self.position:self.position+size]
+		self.position += len(data)
+		return data
+
+	def readline(self):
+		line_break = self.buffer.find('\n', self.position)
+		while line_break < 0 and not self.eof:
+			search_from = len(self.buffer) - self.position
+			self._fill()
+			line_break = self.buffer.find('\n', search_from)
+		if line_break < 0:
+			line_break = len(self.buffer) - 1
+		line = self.buffer[self.position:line_break+1]
+		self.position = line_break + 1
+		return line
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		line = self.readline()
+		if not line:
+			raise StopIteration
+		return line
+
+	def close(self):
+		self.stream.close()
+
+
+def open_input(source, compression='auto', buffer_size=1048576):
+	"""
+	Opens the given input for reading, as a binary file-like object.
+
+	source can be a file path, '-' for stdin, or any file-like object (pipes, sockets, ...).
+	compression can be 'gzip', 'bz2', 'xz', None or 'auto', which detects the
+	compression by the file extension or the first bytes of the data.
+	Compressed data is decompressed on the fly, nothing is written to disk.
+	"""
+	if source=='-':
+		source = sys.stdin
+
+	if hasattr(source, 'read'):
+		stream = source
+		prefix = ''
+		if compression=='auto':
+			prefix = stream.read(6)
+			compression = None
+			for candidate, magic in COMPRESSION_MAGIC:
+				if prefix.startswith(magic):
+					compression = candidate
+		path = None
+	else:
+		path = source
+		if compression=='auto':
+			compression = _detect_compression(path)
+		if not compression:
+			return open(path, 'rb', buffer_size)
+		stream = open(path, 'rb', buffer_size)
+		prefix = ''
+
+	if not compression:
+		return _DecompressingStream(stream, None, buffer_size, prefix)
+
+	decompressor_factory = _get_decompressor_factory(compression)
+	if decompressor_factory:
+		return _DecompressingStream(stream, decompressor_factory, buffer_size, prefix)
+
+	# no python module for this one (e.g. lzma on python 2), pipe through the command line tool
+	if path:
+		stream.close()
+		process = subprocess.Popen([compression, '-dc', path], stdout=subprocess.PIPE, bufsize=buffer_size)
+		return process.stdout
+	else:
+		process = subprocess.Popen([compression, '-dc'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=buffer_size)
+		def pump():
+			data = prefix
+			while data:
+				process.stdin.write(data)
+				data = stream.read(buffer_size)
+			process.stdin.close()
+		pump_thread = threading.Thread(target=pump, name='%s-pump' % compression)
+		pump_thread.daemon = True
+		pump_thread.start()
+		return process.stdout
+
+
+_MISSING = object()
+
+class RecordSchema(object):
+	"""
+	The field names shared by all CompactRecords of a source
+	"""
+	__slots__ = ('fields', 'index')
+
+	def __init__(self, fields):
+		self.fields = tuple(fields)
+		self.index = dict((field, i) for i, field in enumerate(self.fields))
+
+
+class CompactRecord(object):
+	"""
+	A memory saving record: the field names live in a shared RecordSchema,
+	the record itself only holds a tuple of cells. Supports the dict interface
+	used by the importers; fields added later are kept in a small extra dict.
+	"""
+	__slots__ = ('schema', 'cells', 'extra')
+
+	def __init__(self, schema, cells):
+		self.schema = schema
+		self.cells = cells
+		self.extra = None
+
+	def __getitem__(self, key):
+		i = self.schema.index.get(key)
+		if i!=None:
+			value = self.cells[i]
+			if value is not _MISSING:
+				return value
+		elif self.extra and key in self.extra:
+			return self.extra[key]
+		raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		i = self.schema.index.get(key)
+		if i!=None:
+			if type(self.cells) is tuple:
+				self.cells = list(self.cells)
+			self.cells[i] = value
+		else:
+			if self.extra==None:
+				self.extra = dict()
+			self.extra[key] = value
+
+	def __delitem__(self, key):
+		self[key]
+		i = self.schema.index.get(key)
+		if i!=None:
+			self[key] = _MISSING
+		else:
+			del self.extra[key]
+
+	def __contains__(self, key):
+		i = self.schema.index.get(key)
+		if i!=None:
+			return self.cells[i] is not _MISSING
+		return bool(self.extra) and key in self.extra
+
+	has_key = __contains__
+
+	def get(self, key, default=None):
+		i = self.schema.index.get(key)
+		if i!=None:
+			value = self.cells[i]
+			if value is not _MISSING:
+				return value
+		elif self.extra and key in self.extra:
+			return self.extra[key]
+		return default
+
+	def pop(self, key, default=_MISSING):
+		if key in self:
+			value = self[key]
+			del self[key]
+			return value
+		elif default is _MISSING:
+			raise KeyError(key)
+		return default
+
+	def iteritems(self):
+		for field, value in itertools.izip(self.schema.fields, self.cells):
+			if value is not _MISSING:
+				yield field, value
+		if self.extra:
+			for item in self.extra.iteritems():
+				yield item
+
+	def iterkeys(self):
+		for field, value in self.iteritems():
+			yield field
+
+	def itervalues(self):
+		for field, value in self.iteritems():
+			yield value
+
+	def items(self):
+		return list(self.iteritems())
+
+	def keys(self):
+		return list(self.iterkeys())
+
+	def values(self):
+		return list(self.itervalues())
+
+	def update(self, other=(), **kwargs):
+		if hasattr(other, 'keys'):
+			other = [(key, other[key]) for key in other.keys()]
+		for key, value in itertools.chain(other, kwargs.iteritems()):
+			self[key] = value
+
+	def setdefault(self, key, default=None):
+		if key not in self:
+			self[key] = default
+		return self[key]
+
+	def copy(self):
+		duplicate = CompactRecord(self.schema, self.cells[:] if type(self.cells) is list else self.cells)
+		if self.extra:
+			duplicate.extra = dict(self.extra)
+		return duplicate
+
+	def __iter__(self):
+		return self.iterkeys()
+
+	def __len__(self):
+		return len([value for value in self.cells if value is not _MISSING]) + len(self.extra or ())
+
+	def __eq__(self, other):
+		return dict(self.iteritems())==dict(other.iteritems() if hasattr(other, 'iteritems') else other)
+
+	def __ne__(self, other):
+		return not self==other
+
+	def __repr__(self):
+		return repr(dict(self.iteritems()))
+
+	__str__ = __repr__
+
+
+class _ColumnPlan:
+	"""
+	Precompiled plan to turn a row of cells into a record:
+	the kept column indexes, their target field names and the transformation tables.
+	If an encoding is given, the cells are expected to be encoded strings.
+	If compact is set, the plan builds CompactRecords sharing one RecordSchema.
+	"""
+	def __init__(self, header, mapping=dict(), transformations=dict(), encoding='utf-8', compact=False):
+		self.header = header
+		self.width = len(header)
+		self.indexes = list()
+		self.fields = list()
+		for i in range(self.width):
+			field = header[i]
+			if field in mapping:
+				field = mapping[field]
+			if field!=None:
+				if compact and field in self.fields:
+					# only the last column writing a field counts
+					del self.indexes[self.fields.index(field)]
+					self.fields.remove(field)
+				self.indexes.append(i)
+				self.fields.append(field)
+
+		# only the last column writing a field counts, as with plain dict assignment
+		self.transforms = list()
+		for field in set(self.fields):
+			if field in transformations:
+				self.transforms.append((field, transformations[field]))
+
+		self.encoding = encoding
+		self.schema = None
+		if compact:
+			self.schema = RecordSchema(self.fields)
+			self.transforms = [(self.schema.index[field], table) for field, table in self.transforms]
+
+		if self.indexes==range(self.width):
+			self.getter = None
+		elif not self.indexes:
+			# all columns dropped: empty records
+			self.getter = lambda row: ()
+		elif len(self.indexes)==1:
+			index = self.indexes[0]
+			self.getter = lambda row: (row[index],)
+		else:
+			self.getter = operator.itemgetter(*self.indexes)
+
+	def build(self, row):
+		"""
+		build a record from the given (still encoded) row
+		"""
+		if self.schema:
+			return self._buildCompact(row)
+		if len(row)==self.width:
+			if self.getter:
+				row = self.getter(row)
+			if self.encoding and row:
+				# decode all cells in one go, the csv module doesn't allow NUL bytes in cells anyway
+				row = unicode('\0'.join(row), self.encoding).split(u'\0')
+			record = dict(itertools.izip(self.fields, row))
+		else:
+			# ragged row: only use the cells present
+			record = dict()
+			for i, index in enumerate(self.indexes):
+				if index < len(row):
+					if self.encoding:
+						record[self.fields[i]] = unicode(row[index], self.encoding)
+					else:
+						record[self.fields[i]] = row[index]
+
+		for field, table in self.transforms:
+			if field in record:
+				record[field] = _transform(table, record[field])
+		return record
+
+	def _buildCompact(self, row):
+		if len(row)==self.width:
+			if self.getter:
+				row = self.getter(row)
+			if self.encoding and row:
+				row = unicode('\0'.join(row), self.encoding).split(u'\0')
+		else:
+			# ragged row: mark the cells not present as missing
+			cells = list()
+			for index in self.indexes:
+				if index < len(row):
+					if self.encoding:
+						cells.append(unicode(row[index], self.encoding))
+					else:
+						cells.append(row[index])
+				else:
+					cells.append(_MISSING)
+			row = cells
+
+		if self.transforms:
+			row = list(row)
+			for i, table in self.transforms:
+				if row[i] is not _MISSING:
+					row[i] = _transform(table, row[i])
+		return CompactRecord(self.schema, tuple(row))
+
+
+def _transform(table, data):
+	try:
+		return table.get(data, data)
+	except TypeError:
+		# not hashable (e.g. a list from a JSON source)
+		return data
+
+
 class CSVRecordSource:
-	def __init__(self, csv_file, mapping=dict(), transformations=dict(), delimiter=','):
-		inputStream = open(csv_file, 'rb')
-		self.reader = UnicodeReader(inputStream, 'excel', 'utf8', delimiter=delimiter, quotechar='"')
+	"""
+	Reads records from a CSV file.
+
+	csv_file can be a path, '-' for stdin or a file-like object, optionally
+	compressed (see open_input).
+
+	The header is compiled into a column plan when iteration starts, so that
+	the rows can be turned into records without per-cell mapping lookups.
+	ASCII compatible encodings are parsed directly, only the kept cells get decoded.
+
+	If compact is set, the records are CompactRecords instead of dicts.
+	"""
+	def __init__(self, csv_file, mapping=dict(), transformations=dict(), delimiter=',', encoding='utf8', compression='auto', compact=False):
+		inputStream = open_input(csv_file, compression)
+		if codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32')):
+			# csv can't parse these directly, recode to UTF-8 first
+			inputStream = UTF8Recoder(inputStream, encoding)
+			encoding = 'utf-8'
+		self.reader = csv.reader(inputStream, 'excel', delimiter=delimiter, quotechar='"')
+		self.encoding = encoding
+		self.compact = compact
 		self.mapping = mapping
 		self.transformations = transformations
 		self.row_iterator = None
 		self.header = None
+		self.plan = None
 
 
 	def __iter__(self):
 		# I know this is a dirty hack... sorry about that
 		self.row_iterator = self.reader.__iter__()
-		self.header = self.row_iterator.next()
+		self.header = [unicode(field, self.encoding) for field in self.row_iterator.next()]
+		self.plan = _ColumnPlan(self.header, self.mapping, self.transformations, self.encoding, self.compact)
 		return self
 
 	def next(self):
 		if self.row_iterator:
-			row = self.row_iterator.next()
+			return self.plan.build(self.row_iterator.next())
+
+
+class JSONLRecordSource:
+	"""
+	Reads records from a JSON lines file: one JSON object per line.
+
+	jsonl_file can be a path, '-' for stdin or a file-like object, optionally
+	compressed (see open_input). The values keep their JSON types.
+	mapping and transformations work like with CSVRecordSource.
+	If compact is set, the records are CompactRecords, sharing one
+	RecordSchema per distinct set of keys.
+	"""
+	def __init__(self, jsonl_file, mapping=dict(), transformations=dict(), compression='auto', compact=False):
+		self.stream = open_input(jsonl_file, compression)
+		self.mapping = mapping
+		self.transformations = transformations
+		self.compact = compact
+		self.fields = dict()
+		self.schemas = dict()
+		self.line_iterator = None
+
+	def __iter__(self):
+		self.line_iterator = self.stream.__iter__()
+		return self
+
+	def next(self):
+		if self.line_iterator:
+			line = self.line_iterator.next()
+			while not line.strip():
+				line = self.line_iterator.next()
+			data = json.loads(line)
+			if self.compact:
+				return self._buildCompact(data)
+			if not self.mapping and not self.transformations:
+				return data
 
-			# build record
 			record = dict()
-			for i in range(len(row)):
-				field = self.header[i]
-				data = row[i]
-				if field in self.mapping:
-					field = self.mapping[field]
+			for key, value in data.iteritems():
+				if key in self.fields:
+					field = self.fields[key]
+				else:
+					field = self.mapping.get(key, key)
+					self.fields[key] = field
 				if field!=None:
-					# see if there is a translation
 					if field in self.transformations:
-						#print "Replace %s with %s." % (data, self.transformations[field].get(data, data))
-						data = self.transformations[field].get(data, data)
-					record[field] = data
+						value = _transform(self.transformations[field], value)
+					record[field] = value
 			return record
 
+	def _buildCompact(self, data):
+		keys = tuple(data.keys())
+		plan = self.schemas.get(keys)
+		if plan==None:
+			plan = _ColumnPlan(keys, self.mapping, self.transformations, None, True)
+			self.schemas[keys] = plan
+		return plan.build(data.values())
+
+
+class SQLRecordSource:
+	"""
+	Reads records from the result of an SQL query on a SQLite database.
+
+	database can be a path or an open sqlite3 connection. The rows are streamed
+	from the cursor in batches of batch_size, and keep their SQL types.
+	mapping and transformations work on the result columns like with CSVRecordSource.
+	If compact is set, the records are CompactRecords instead of dicts.
+	"""
+	def __init__(self, database, query, query_parameters=(), mapping=dict(), transformations=dict(), batch_size=1000, compact=False):
+		if isinstance(database, basestring):
+			database = sqlite3.connect(database)
+		self.connection = database
+		self.query = query
+		self.query_parameters = query_parameters
+		self.mapping = mapping
+		self.transformations = transformations
+		self.batch_size = batch_size
+		self.compact = compact
+		self.cursor = None
+		self.batch = list()
+		self.header = None
+		self.plan = None
+
+	def __iter__(self):
+		self.cursor = self.connection.cursor()
+		self.cursor.arraysize = self.batch_size
+		self.cursor.execute(self.query, self.query_parameters)
+		self.header = [column[0] for column in self.cursor.description]
+		self.plan = _ColumnPlan(self.header, self.mapping, self.transformations, None, self.compact)
+		self.batch = list()
+		return self
+
+	def next(self):
+		if self.cursor:
+			if not self.batch:
+				self.batch = self.cursor.fetchmany()
+				if not self.batch:
+					self.cursor.close()
+					self.cursor = None
+					raise StopIteration
+				self.batch.reverse()
+			return self.plan.build(self.batch.pop())
+
+
+def find_csv_partitions(csv_file, partitions, quotechar='"', chunk_size=1048576):
+	"""
+	Splits a CSV file into (up to) the given number of byte ranges [start, end),
+	each starting and ending on a record boundary. The header is not part of any range.
+
+	Boundaries are only placed on line breaks outside of quoted cells, which
+	takes one sequential pass over the file counting the quote characters.
+	The ranges can be processed independently, see CSVPartitionSource.
+	This only works on uncompressed files.
+	"""
+	if _detect_compression(csv_file):
+		raise Exception("Cannot partition compressed file '%s'." % csv_file)
+	size = os.path.getsize(csv_file)
+	boundaries = list()
+	targets = [0]
+	stream = open(csv_file, 'rb')
+	chunk_start = 0
+	parity = 0
+	try:
+		while targets:
+			chunk = stream.read(chunk_size)
+			if not chunk:
+				break
+			offset = 0
+			while targets and targets[0] < chunk_start + len(chunk):
+				local = max(targets[0] - chunk_start, offset)
+				parity ^= chunk.count(quotechar, offset, local) & 1
+				offset = local
+				line_break = chunk.find('\n', offset)
+				if line_break < 0:
+					break
+				parity ^= chunk.count(quotechar, offset, line_break) & 1
+				offset = line_break + 1
+				if not parity:
+					# this is a record boundary
+					boundary = chunk_start + offset
+					targets.pop(0)
+					if not boundaries:
+						# that was the header, now we can place the targets
+						targets = [boundary + (size-boundary) * i / partitions for i in range(1, partitions)]
+					boundaries.append(boundary)
+					while targets and targets[0] < boundary:
+						targets.pop(0)
+			parity ^= chunk.count(quotechar, offset) & 1
+			chunk_start += len(chunk)
+	finally:
+		stream.close()
+
+	if not boundaries:
+		# no (complete) header line
+		return []
+	boundaries.append(size)
+	return [(boundaries[i], boundaries[i+1]) for i in range(len(boundaries)-1) if boundaries[i] < boundaries[i+1]]
+
+
+class _ByteRangeReader:
+	"""
+	Iterator over the lines within the byte range [start, end) of a stream
+	"""
+	def __init__(self, stream, start, end):
+		stream.seek(start)
+		self.stream = stream
+		self.position = start
+		self.end = end
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		if self.position >= self.end:
+			raise StopIteration
+		line = self.stream.readline()
+		if not line:
+			raise StopIteration
+		self.position += len(line)
+		return line
+
+
+class CSVPartitionSource(CSVRecordSource):
+	"""
+	Reads the records within the byte range [start, end) of a CSV file,
+	as delivered by find_csv_partitions. The header is taken from the top of the file.
+
+	If a progress_callback is given, it will be called with the result of progress()
+	at most every progress_interval seconds, and once more by finish(), which is
+	to be called when the partition's records have been imported.
+	"""
+	def __init__(self, csv_file, start, end, mapping=dict(), transformations=dict(), delimiter=',', encoding='utf8',
+				partition=0, progress_callback=None, progress_interval=10.0, compact=False):
+		if codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32')):
+			raise Exception("Partitioned CSV parsing needs an ASCII compatible encoding, '%s' is not." % encoding)
+
+		# read the header
+		header_stream = open(csv_file, 'rb')
+		header_reader = csv.reader(_ByteRangeReader(header_stream, 0, end), 'excel', delimiter=delimiter, quotechar='"')
+		header = header_reader.next()
+		header_stream.close()
+
+		self.range_reader = _ByteRangeReader(open(csv_file, 'rb'), start, end)
+		self.reader = csv.reader(self.range_reader, 'excel', delimiter=delimiter, quotechar='"')
+		if start == 0:
+			# the header is in our range, skip it
+			self.reader.next()
+		self.header_cells = header
+		self.encoding = encoding
+		self.compact = compact
+		self.mapping = mapping
+		self.transformations = transformations
+		self.row_iterator = None
+		self.header = None
+		self.plan = None
+
+		self.partition = partition
+		self.start = start
+		self.end = end
+		self.records = 0
+		self.finished = False		# all rows read
+		self.done = False			# all records imported, see finish()
+		self.progress_callback = progress_callback
+		self.progress_interval = progress_interval
+		self.progress_reported = time.time()
+
+	def __iter__(self):
+		self.row_iterator = self.reader.__iter__()
+		self.header = [unicode(field, self.encoding) for field in self.header_cells]
+		self.plan = _ColumnPlan(self.header, self.mapping, self.transformations, self.encoding, self.compact)
+		return self
+
+	def next(self):
+		if self.row_iterator:
+			try:
+				row = self.row_iterator.next()
+			except StopIteration:
+				self.finished = True
+				raise
+
+			self.records += 1
+			if self.progress_callback and not self.records % 1000 and time.time()-self.progress_reported > self.progress_interval:
+				self.progress_reported = time.time()
+				self.progress_callback(self.progress())
+			return self.plan.build(row)
+
+	def progress(self):
+		"""
+		report the progress of this partition
+		"""
+		position = min(self.range_reader.position, self.end)
+		if self.end > self.start:
+			fraction = float(position - self.start) / (self.end - self.start)
+		else:
+			fraction = 1.0
+		return {'partition': self.partition,
+				'start':     self.start,
+				'end':       self.end,
+				'position':  position,
+				'records':   self.records,
+				'fraction':  fraction,
+				'done':      self.done,
+				}
+
+	def finish(self):
+		"""
+		mark the partition as done (its records are imported) and report that, once
+		"""
+		if not self.done:
+			self.done = True
+			if self.progress_callback:
+				self.progress_callback(self.progress())
+
 
 def _get_or_create_from_params(name, parameters, create_entry=dict()):
 	entry = parameters.get(name, None)
@@ -129,6 +855,88 @@ def _prepare_parameters(parameters):
 		parameters['lock'] = threading.Condition()
 
 
+def _chunks(record_source, chunk_size):
+	"""
+	groups the records into lists of (up to) chunk_size records
+	"""
+	chunk = list()
+	for record in record_source:
+		chunk.append(record)
+		if len(chunk) >= chunk_size:
+			yield chunk
+			chunk = list()
+	if chunk:
+		yield chunk
+
+
+def _resolve_chunk_contacts(civicrm, chunk):
+	"""
+	sets record['contact_id'] for all records of the chunk,
+	the external identifiers are resolved with one call (see CiviCRM.getContactIDs)
+	"""
+	def batched(record):
+		return record.has_key('external_identifier') and not (record.has_key('id') or record.has_key('contact_id') or record.has_key('is_deleted'))
+
+	contact_ids = civicrm.getContactIDs([record['external_identifier'] for record in chunk if batched(record)])
+	for record in chunk:
+		contact_id = None
+		if batched(record):
+			contact_id = contact_ids.get(unicode(record['external_identifier']), None)
+		if contact_id==None:
+			# not batched or ambiguous, getContactID will deal with it
+			contact_id = civicrm.getContactID(record)
+		record['contact_id'] = contact_id
+
+
+class _ChunkWrites:
+	"""
+	collects the creates and updates of a chunk, they are sent together with performAPICalls
+	"""
+	def __init__(self, civicrm, command, entity_type):
+		self.civicrm = civicrm
+		self.command = command
+		self.entity_type = entity_type
+		self.writes = list()
+		self.contact_ids = set()
+
+	def add(self, request, contact_id, message, timestamp, args=None):
+		"""
+		queue the call, the message is logged (formatted with args) once it's done
+		"""
+		self.writes.append((request, contact_id, message, timestamp, args))
+		self.contact_ids.add(str(contact_id))
+
+	def pending(self, contact_id):
+		"""
+		True if a write for the contact is queued
+		"""
+		return str(contact_id) in self.contact_ids
+
+	def send(self):
+		"""
+		send the queued calls, returns the IDs of the entities written
+		"""
+		writes = self.writes
+		self.writes = list()
+		self.contact_ids = set()
+		if not writes:
+			return []
+		written = list()
+		results = self.civicrm.performAPICalls([request for request, contact_id, message, timestamp, args in writes])
+		for (request, contact_id, message, timestamp, args), result in zip(writes, results):
+			if not result or result.get('is_error', 0):
+				self.civicrm.log(u"Could not write %s for contact [%s]: %s",
+					logging.ERROR, 'importer', self.command, self.entity_type, request.get('id', None), contact_id, time.time()-timestamp,
+					args=(self.entity_type, contact_id, (result or dict()).get('error_message', 'no reply')))
+			else:
+				entity_id = request.get('id', result.get('id', None))
+				written.append(entity_id)
+				self.civicrm.log(message,
+					logging.INFO, 'importer', self.command, self.entity_type, entity_id, contact_id, time.time()-timestamp, args=args)
+		return written
+
+
+@profiling.profiled
 def import_contributions(civicrm, record_source, parameters=dict()):
 	"""
 	Imports import_contributions
@@ -143,7 +951,7 @@ def import_contributions(civicrm, record_source, parameters=dict()):
 	entity_type = parameters.get('entity_type', 'Contribution')
 	update_mode = parameters.get('update_mode', 'update')
 	campaign_identifier = parameters.get('campaign_identifier', 'title')
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_contributions'):
 		update = dict(record)
 		# lookup contact_id
 		if update.has_key('contact_external_identifier'):
@@ -157,8 +965,8 @@ def import_contributions(civicrm, record_source, parameters=dict()):
 				civicrm.log(u"Contact not found! Will be attributed to fallback contact %s" % str(parameters['fallback_contact']),
 					logging.INFO, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
 			else:
-				civicrm.log(u"Contact not found! No valid contact reference specified in (%s)" % unicode(str(record), 'utf8'),
-					logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
+				civicrm.log(u"Contact not found! No valid contact reference specified in (%s)",
+					logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp, args=(record,))
 				continue
 
 		# lookup payment type
@@ -167,8 +975,8 @@ def import_contributions(civicrm, record_source, parameters=dict()):
 				update['payment_instrument_id'] = civicrm.getOptionValue(civicrm.getOptionGroupID('payment_instrument'), update['payment_instrument'])
 			del update['payment_instrument']
 		if not update.has_key('payment_instrument_id') or not update['payment_instrument_id']:
-			civicrm.log(u"Payment type ID not found! No valid payment type specified in (%s)" % unicode(str(record), 'utf8'),
-				logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
+			civicrm.log(u"Payment type ID not found! No valid payment type specified in (%s)",
+				logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp, args=(record,))
 			continue
 
 		# lookup campaign
@@ -176,8 +984,8 @@ def import_contributions(civicrm, record_source, parameters=dict()):
 			if update['contribution_campaign']:
 				update['contribution_campaign_id'] = civicrm.getCampaignID(update['contribution_campaign'], attribute_key=campaign_identifier)
 				if not update['contribution_campaign_id']:
-					civicrm.log(u"Campaign ID not found! No valid campaign specified in (%s)" % unicode(str(record), 'utf8'),
-						logging.WARN, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
+					civicrm.log(u"Campaign ID not found! No valid campaign specified in (%s)",
+						logging.WARN, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp, args=(record,))
 			del update['contribution_campaign']
 
 		# lookup contribution status
@@ -186,15 +994,16 @@ def import_contributions(civicrm, record_source, parameters=dict()):
 				update['contribution_status_id'] = civicrm.getOptionValue(civicrm.getOptionGroupID('contribution_status'), update['contribution_status'])
 			del update['contribution_status']
 		if not update.has_key('contribution_status_id') or not update['contribution_status_id']:
-			civicrm.log(u"Contribution status ID not found! No valid contribution status specified in (%s)" % unicode(str(record), 'utf8'),
-				logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
+			civicrm.log(u"Contribution status ID not found! No valid contribution status specified in (%s)",
+				logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp, args=(record,))
 			continue
 
 		entity = civicrm.createOrUpdate(entity_type, update, update_mode, ['id', 'trxn_id'])
-		civicrm.log(u"Wrote contribution '%s'" % unicode(str(entity), 'utf8'),
-			logging.INFO, 'importer', 'import_contributions', 'Contribution', entity.get('id'), None, time.time()-timestamp)
+		civicrm.log(u"Wrote contribution '%s'",
+			logging.INFO, 'importer', 'import_contributions', 'Contribution', entity.get('id'), None, time.time()-timestamp, args=(entity,))
 
 
+@profiling.profiled
 def import_rcontributions(civicrm, record_source, parameters=dict()):
 	"""
 	Imports recurring contributions
@@ -211,7 +1020,7 @@ def import_rcontributions(civicrm, record_source, parameters=dict()):
 	campaign_identifier = parameters.get('campaign_identifier', 'title')
 	identification = parameters.get('identification', ['id'])
 
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_rcontributions'):
 		update = dict(record)
 		# lookup contact_id
 		if update.has_key('contact_external_identifier'):
@@ -225,8 +1034,8 @@ def import_rcontributions(civicrm, record_source, parameters=dict()):
 				civicrm.log(u"Contact not found! Will be attributed to fallback contact %s" % str(parameters['fallback_contact']),
 					logging.INFO, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
 			else:
-				civicrm.log(u"Contact not found! No valid contact reference specified in (%s)" % unicode(str(record), 'utf8'),
-					logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
+				civicrm.log(u"Contact not found! No valid contact reference specified in (%s)",
+					logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp, args=(record,))
 				continue
 
 		# lookup payment type
@@ -235,8 +1044,8 @@ def import_rcontributions(civicrm, record_source, parameters=dict()):
 				update['payment_instrument_id'] = civicrm.getOptionValue(civicrm.getOptionGroupID('payment_instrument'), update['payment_instrument'])
 			del update['payment_instrument']
 		if not update.has_key('payment_instrument_id') or not update['payment_instrument_id']:
-			civicrm.log(u"Payment type ID not found! No valid payment type specified in (%s)" % unicode(str(record), 'utf8'),
-				logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
+			civicrm.log(u"Payment type ID not found! No valid payment type specified in (%s)",
+				logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp, args=(record,))
 			continue
 
 		# lookup campaign
@@ -244,8 +1053,8 @@ def import_rcontributions(civicrm, record_source, parameters=dict()):
 			if update['contribution_campaign']:
 				update['contribution_campaign_id'] = civicrm.getCampaignID(update['contribution_campaign'], attribute_key=campaign_identifier)
 				if not update['contribution_campaign_id']:
-					civicrm.log(u"Campaign ID not found! No valid campaign specified in (%s)" % unicode(str(record), 'utf8'),
-						logging.WARN, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
+					civicrm.log(u"Campaign ID not found! No valid campaign specified in (%s)",
+						logging.WARN, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp, args=(record,))
 			del update['contribution_campaign']
 
 		# lookup contribution status
@@ -254,15 +1063,16 @@ def import_rcontributions(civicrm, record_source, parameters=dict()):
 				update['contribution_status_id'] = civicrm.getOptionValue(civicrm.getOptionGroupID('contribution_status'), update['contribution_status'])
 			del update['contribution_status']
 		if not update.has_key('contribution_status_id') or not update['contribution_status_id']:
-			civicrm.log(u"Contribution status ID not found! No valid contribution status specified in (%s)" % unicode(str(record), 'utf8'),
-				logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp)
+			civicrm.log(u"Contribution status ID not found! No valid contribution status specified in (%s)",
+				logging.ERROR, 'importer', 'import_contributions', 'Contribution', None, None, time.time()-timestamp, args=(record,))
 			continue
 
 		entity = civicrm.createOrUpdate(entity_type, update, update_mode, identification)
-		civicrm.log(u"Wrote recurring contribution '%s'" % unicode(str(entity), 'utf8'),
-			logging.INFO, 'importer', 'import_rcontributions', 'ContributionRecur', entity.get('id'), None, time.time()-timestamp)
+		civicrm.log(u"Wrote recurring contribution '%s'",
+			logging.INFO, 'importer', 'import_rcontributions', 'ContributionRecur', entity.get('id'), None, time.time()-timestamp, args=(entity,))
 
 
+@profiling.profiled
 def import_campaigns(civicrm, record_source, parameters=dict()):
 	"""
 	Imports campaigns
@@ -274,7 +1084,7 @@ def import_campaigns(civicrm, record_source, parameters=dict()):
 	timestamp = time.time()
 	entity_type = parameters.get('entity_type', 'Campaign')
 	update_mode = parameters.get('update_mode', 'update')
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_campaigns'):
 
 		update = dict(record)
 		# lookup campaign type
@@ -283,8 +1093,8 @@ def import_campaigns(civicrm, record_source, parameters=dict()):
 				update['campaign_type_id'] = civicrm.getOptionValue(civicrm.getOptionGroupID('campaign_type'), update['campaign_type'])
 			del update['campaign_type']
 		if not update.has_key('campaign_type_id') or not update['campaign_type_id']:
-			civicrm.log(u"Campaign type ID not identified! No valid campaign type specified in (%s)" % unicode(str(record), 'utf8'),
-				logging.ERROR, 'importer', 'import_campaigns', 'Campaign', None, None, time.time()-timestamp)
+			civicrm.log(u"Campaign type ID not identified! No valid campaign type specified in (%s)",
+				logging.ERROR, 'importer', 'import_campaigns', 'Campaign', None, None, time.time()-timestamp, args=(record,))
 			continue
 
 		# lookup campaign status
@@ -293,19 +1103,20 @@ def import_campaigns(civicrm, record_source, parameters=dict()):
 				update['status_id'] = civicrm.getOptionValue(civicrm.getOptionGroupID('campaign_status'), update['status'])
 			del update['status']
 		if not update.has_key('campaign_type_id') or not update['campaign_type_id']:
-			civicrm.log(u"Campaign status ID not identified! No valid campaign status specified in (%s)" % unicode(str(record), 'utf8'),
-				logging.ERROR, 'importer', 'import_campaigns', 'Campaign', None, None, time.time()-timestamp)
+			civicrm.log(u"Campaign status ID not identified! No valid campaign status specified in (%s)",
+				logging.ERROR, 'importer', 'import_campaigns', 'Campaign', None, None, time.time()-timestamp, args=(record,))
 			continue
 
 		if parameters.has_key('id'):
 			entity = civicrm.createOrUpdate(entity_type, update, update_mode, [parameters['id']])
 		else:
 			entity = civicrm.createOrUpdate(entity_type, update, update_mode)
-		civicrm.log(u"Wrote campaign '%s'" % unicode(str(entity), 'utf8'),
-			logging.INFO, 'importer', 'import_campaign', 'Campaign', entity.get('id'), None, time.time()-timestamp)
+		civicrm.log(u"Wrote campaign '%s'",
+			logging.INFO, 'importer', 'import_campaign', 'Campaign', entity.get('id'), None, time.time()-timestamp, args=(entity,))
 
 
 
+@profiling.profiled
 def import_notes(civicrm, record_source, parameters=dict()):
 	"""
 	Imports notes
@@ -328,7 +1139,7 @@ def import_notes(civicrm, record_source, parameters=dict()):
 		'mode' = 'replace_subject'  - will replace a note with the same subject
 	"""
 	_prepare_parameters(parameters)
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_notes'):
 		timestamp = time.time()
 		if 'lookup_type' in record and 'lookup_identifier_key' in record and 'lookup_identifier_value' in record:
 			# will lookup the related entity
@@ -377,6 +1188,7 @@ def import_notes(civicrm, record_source, parameters=dict()):
 				logging.ERROR, 'importer', 'import_notes', 'Note', None, record['entity_id'], time.time()-timestamp)
 
 
+@profiling.profiled
 def import_contact_address(civicrm, record_source, parameters=dict()):
 	"""
 	Makes sure, that the contact has the given address
@@ -390,10 +1202,21 @@ def import_contact_address(civicrm, record_source, parameters=dict()):
 	parameters['location_type'] 		sets the type (default "Main") if no information provided by record
 	parameters['update_mode'] 			either set to "update", "fill" or "replace" - or "add" to create a new entry
 	parameters['no_update']			 if True we do not touch existing addresses at all
+	parameters['chunk_size']			if set, the addresses are read for that many records at once,
+										compared locally and only the changes are sent, together
+	parameters['geocode']				with chunk_size: 'defer' skips the geocoding while importing (fast import),
+										the IDs of the written addresses are added to parameters['geocode_queue']
+										for a later CiviCRM.geocodeAddresses run
 	"""
 	_prepare_parameters(parameters)
 	no_update = parameters.get('no_update', False)
-	for record in record_source:
+	chunk_size = parameters.get('chunk_size', 0)
+	if chunk_size:
+		for chunk in tracing.traced_records(civicrm, _chunks(record_source, chunk_size), 'import_contact_address'):
+			_import_contact_address_chunk(civicrm, chunk, parameters)
+		return
+
+	for record in tracing.traced_records(civicrm, record_source, 'import_contact_address'):
 		timestamp = time.time()
 		record['contact_id'] = civicrm.getContactID(record)
 		if not record['contact_id']:
@@ -420,8 +1243,8 @@ def import_contact_address(civicrm, record_source, parameters=dict()):
 					logging.ERROR, 'importer', 'import_contact_address', 'Address', None, record['contact_id'], time.time()-timestamp)
 			else:
 				if address:
-					civicrm.log(u"Wrote contact address for '%s'" % unicode(str(address), 'utf8'),
-						logging.INFO, 'importer', 'import_contact_address', 'Address', address.get('id'), None, time.time()-timestamp)
+					civicrm.log(u"Wrote contact address for '%s'",
+						logging.INFO, 'importer', 'import_contact_address', 'Address', address.get('id'), None, time.time()-timestamp, args=(address,))
 				else:
 					civicrm.log(u"Contact-address already exists and was not updated for contact [%s]" % str(record['contact_id']),
 						logging.INFO, 'importer', 'import_contact_address', 'Address', None, None, time.time()-timestamp)
@@ -430,8 +1253,8 @@ def import_contact_address(civicrm, record_source, parameters=dict()):
 			if mode in ['update', 'fill', 'replace']:
 				try:
 					address = civicrm.createOrUpdate('Address', record, update_type=mode, primary_attributes=['contact_id', 'location_type_id'])
-					civicrm.log(u"Wrote contact address for '%s'" % unicode(str(address), 'utf8'),
-						logging.INFO, 'importer', 'import_contact_address', 'Address', address.get('id'), None, time.time()-timestamp)
+					civicrm.log(u"Wrote contact address for '%s'",
+						logging.INFO, 'importer', 'import_contact_address', 'Address', address.get('id'), None, time.time()-timestamp, args=(address,))
 				except:
 					civicrm.logException("Exception while importing address for [%s]. Data was %s, exception: " % (record['contact_id'], str(record)),
 						logging.ERROR, 'importer', 'import_contact_address', 'Address', None, record['contact_id'], time.time()-timestamp)
@@ -445,6 +1268,118 @@ def import_contact_address(civicrm, record_source, parameters=dict()):
 				#	logging.INFO, 'importer', 'import_contact_address', 'Address', entity.get('id'), None, time.time()-timestamp)
 
 
+def _normalised(value):
+	"""
+	an attribute value for comparison: unicode, surrounding and repeated whitespace removed
+	"""
+	if value==None:
+		return u''
+	if isinstance(value, bool):
+		value = int(value)
+	if isinstance(value, str):
+		value = value.decode('utf8', 'replace')
+	return u' '.join(unicode(value).split())
+
+
+def _address_changes(address, record, mode):
+	"""
+	the attributes of the record that would change the address,
+	for the update modes of CiviEntity (update, fill, replace)
+	"""
+	changed = dict()
+	for key, value in record.items():
+		if key in ('id', 'contact_id', 'external_identifier', 'location_type', 'location_type_id'):
+			continue
+		current = address.get(key, None)
+		if mode=='fill':
+			if _normalised(current)==u'':
+				changed[key] = value
+		elif mode=='replace' and not address.attributes.has_key(key):
+			continue
+		elif _normalised(current)!=_normalised(value) and _differs(current, value):
+			changed[key] = value
+	return changed
+
+
+def _import_contact_address_chunk(civicrm, chunk, parameters):
+	"""
+	import_contact_address for a chunk of records: the addresses of the chunk's contacts
+	(with the location types in question) are read with one call, compared
+	with the records, and the changes are sent together
+	"""
+	timestamp = time.time()
+	no_update = parameters.get('no_update', False)
+	mode = parameters.get('update_mode', 'update')
+	defer_geocoding = parameters.get('geocode', None)=='defer'
+	if not mode in ['update', 'fill', 'replace']:
+		civicrm.log("Update mode '%s' not implemented!",
+			logging.ERROR, 'importer', 'import_contact_address', 'Address', None, None, time.time()-timestamp, args=(mode,))
+		return
+
+	_resolve_chunk_contacts(civicrm, chunk)
+	records = list()
+	for record in chunk:
+		if not record['contact_id']:
+			civicrm.log(u"Could not write contact address, contact not found for '%s'",
+				logging.WARN, 'importer', 'import_contact_address', 'Address', None, None, time.time()-timestamp, args=(record,))
+			continue
+		if (not record.has_key('location_type_id')):
+			location_type = record.get('location_type', parameters.get('location_type', 'Main'))
+			location_type_dict = _get_or_create_from_params('location_type_dict', parameters)
+
+			if location_type_dict.has_key(location_type):
+				record['location_type_id'] = location_type_dict[location_type]
+			else:
+				record['location_type_id'] = civicrm.getLocationTypeID(location_type)
+				location_type_dict[location_type] = record['location_type_id']
+		records.append(record)
+
+	location_type_ids = list(set([str(record['location_type_id']) for record in records]))
+	query = {'location_type_id': {'IN': location_type_ids}}
+	existing = civicrm.getContactEntities('Address', [record['contact_id'] for record in records], query)
+	writes = _ChunkWrites(civicrm, 'import_contact_address', 'Address')
+	written = list()
+	for record in records:
+		contact_id = str(record['contact_id'])
+		if writes.pending(contact_id):
+			# the contact's addresses are about to change, write them and read them again
+			written += writes.send()
+			existing.update(civicrm.getContactEntities('Address', [contact_id], query))
+		addresses = [address for address in existing.get(contact_id, [])
+			if str(address.get('location_type_id'))==str(record['location_type_id'])]
+		if len(addresses) > 1:
+			civicrm.log("Exception while importing address for [%s]. Data was %s: more than one address of this location type",
+				logging.ERROR, 'importer', 'import_contact_address', 'Address', None, contact_id, time.time()-timestamp, args=(contact_id, record))
+			continue
+
+		if addresses:
+			if no_update:
+				civicrm.log(u"Contact-address already exists and was not updated for contact [%s]",
+					logging.INFO, 'importer', 'import_contact_address', 'Address', addresses[0].get('id'), None, time.time()-timestamp, args=(contact_id,))
+				continue
+			changed = _address_changes(addresses[0], record, mode)
+			if not changed:
+				civicrm.log(u"Contact address unchanged for contact [%s]",
+					logging.INFO, 'importer', 'import_contact_address', 'Address', addresses[0].get('id'), contact_id, time.time()-timestamp, args=(contact_id,))
+				continue
+			addresses[0].attributes.update(changed)
+			request = addresses[0]._storeRequest(changed)
+		else:
+			request = dict(record)
+			request.pop('id', None)		# that's the contact's
+			request['entity'] = 'Address'
+			request['action'] = 'create'
+		if defer_geocoding:
+			request['skip_geocode'] = 1
+		writes.add(request, contact_id, u"Wrote contact address for contact [%s]", timestamp, args=(contact_id,))
+
+	written += writes.send()
+	if defer_geocoding and written:
+		geocode_queue = _get_or_create_from_params('geocode_queue', parameters, list())
+		geocode_queue.extend(written)
+
+
+@profiling.profiled
 def import_contact_base(civicrm, record_source, parameters=dict()):
 	"""
 	Imports very basic contact data, using the records' 'external_identifier' or 'id'
@@ -456,12 +1391,13 @@ def import_contact_base(civicrm, record_source, parameters=dict()):
 	timestamp = time.time()
 	entity_type = parameters.get('entity_type', 'Contact')
 	update_mode = parameters.get('update_mode', 'update')
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_contact_base'):
 		entity = civicrm.createOrUpdate(entity_type, record, update_mode)
-		civicrm.log(u"Wrote base contact '%s'" % unicode(str(entity), 'utf8'),
-			logging.INFO, 'importer', 'import_contact_base', 'Contact', entity.get('id'), None, time.time()-timestamp)
+		civicrm.log(u"Wrote base contact '%s'",
+			logging.INFO, 'importer', 'import_contact_base', 'Contact', entity.get('id'), None, time.time()-timestamp, args=(entity,))
 
 
+@profiling.profiled
 def import_contact_with_dupe_check(civicrm, record_source, parameters=dict()):
 	"""
 	Imports very basic contact data, using the records' 'external_identifier' or 'id'
@@ -474,7 +1410,7 @@ def import_contact_with_dupe_check(civicrm, record_source, parameters=dict()):
 	update_mode = parameters.get('update_mode', 'fill')
 	timestamp = time.time()
 	entity_type = parameters.get('entity_type', 'Contact')
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_contact_with_dupe_check'):
 		query = dict()
 		query['action'] = 'create'
 		query['entity'] = entity_type
@@ -487,8 +1423,8 @@ def import_contact_with_dupe_check(civicrm, record_source, parameters=dict()):
 			if len(result['ids']) == 1:
 				record['id'] = result['ids'][0]
 				entity = civicrm.createOrUpdate(entity_type, record, update_mode, ['id'])
-				civicrm.log(u"Duplicate found and updated: '%s'" % unicode(str(entity), 'utf8'),
-					logging.INFO, 'importer', 'import_contact_with_dupe_check', 'Contact', entity.get('id'), None, time.time()-timestamp)
+				civicrm.log(u"Duplicate found and updated: '%s'",
+					logging.INFO, 'importer', 'import_contact_with_dupe_check', 'Contact', entity.get('id'), None, time.time()-timestamp, args=(entity,))
 			else:
 				civicrm.log(u"More than one duplicates found: {}".format(result['ids']),
 					logging.INFO, 'importer', 'import_contact_with_dupe_check', 'Contact', None, None, time.time()-timestamp)
@@ -497,8 +1433,8 @@ def import_contact_with_dupe_check(civicrm, record_source, parameters=dict()):
 		# we also update this contact...
 		elif result['is_error'] == 1 and result['error_message'] == 'DB Error: already exists':
 			entity = civicrm.createOrUpdate(entity_type, record, update_mode)
-			civicrm.log(u"Contact identified and updated: '%s'" % unicode(str(entity), 'utf8'),
-				logging.INFO, 'importer', 'import_contact_with_dupe_check', 'Contact', entity.get('id'), None, time.time()-timestamp)
+			civicrm.log(u"Contact identified and updated: '%s'",
+				logging.INFO, 'importer', 'import_contact_with_dupe_check', 'Contact', entity.get('id'), None, time.time()-timestamp, args=(entity,))
 
 		# an unkown error occured
 		elif result['is_error'] == 1:
@@ -511,6 +1447,7 @@ def import_contact_with_dupe_check(civicrm, record_source, parameters=dict()):
 				logging.INFO, 'importer', 'import_contact_base', 'Contact', result['id'], None, time.time()-timestamp)
 
 
+@profiling.profiled
 def import_contact_website(civicrm, record_source, parameters=dict()):
 	"""
 	Imports contact web sites.
@@ -521,11 +1458,19 @@ def import_contact_website(civicrm, record_source, parameters=dict()):
 
 	parameters:
 	 multiple:	'allow' - allows multiple web sites
+	 chunk_size: if set, the contacts and their web sites are looked up for that many
+	             records at once, and the changes are sent together
 
 	"""
 	_prepare_parameters(parameters)
 	multiple = parameters.get('multiple', False)
-	for record in record_source:
+	chunk_size = parameters.get('chunk_size', 0)
+	if chunk_size:
+		for chunk in tracing.traced_records(civicrm, _chunks(record_source, chunk_size), 'import_contact_website'):
+			_import_contact_website_chunk(civicrm, chunk, parameters)
+		return
+
+	for record in tracing.traced_records(civicrm, record_source, 'import_contact_website'):
 		timestamp = time.time()
 		record['contact_id'] = civicrm.getContactID(record)
 		if not record['contact_id']:
@@ -533,16 +1478,7 @@ def import_contact_website(civicrm, record_source, parameters=dict()):
 				logging.WARN, 'importer', 'import_contact_website', 'Website', None, None, time.time()-timestamp)
 			continue
 
-		# get the website type id
-		if (not record.has_key('website_type_id')):
-			if record.has_key('website_type'):
-				if record['website_type']:
-					record['website_type_id'] = civicrm.getOptionValue(civicrm.getOptionGroupID('website_type'), record['website_type'])
-				del record['website_type']
-
-		if (not record.has_key('website_type_id')):
-			civicrm.log(u"Could not write contact website, website type '%s' could not be resolved" % record.get('website_type', ''),
-				logging.WARN, 'importer', 'import_contact_website', 'Website', None, None, time.time()-timestamp)
+		if not _resolve_website_type(civicrm, record, timestamp):
 			continue
 
 
@@ -574,9 +1510,10 @@ def import_contact_website(civicrm, record_source, parameters=dict()):
 				site = None
 
 			if site:
-				del record['website_type']
-				del record['url']
-				del record['external_identifier']
+				# website_type is gone already if it was resolved above
+				record.pop('website_type', None)
+				record.pop('url', None)
+				record.pop('external_identifier', None)
 				changed = site.update(record, store=True)
 				if changed:
 					if len(sites) > 1:
@@ -594,7 +1531,83 @@ def import_contact_website(civicrm, record_source, parameters=dict()):
 					logging.INFO, 'importer', 'import_contact_website', 'Website', site.get('id'), site.get('contact_id'), time.time()-timestamp)
 
 
+def _resolve_website_type(civicrm, record, timestamp):
+	"""
+	sets record['website_type_id'], returns False if that's not possible
+	"""
+	if (not record.has_key('website_type_id')):
+		if record.has_key('website_type'):
+			if record['website_type']:
+				record['website_type_id'] = civicrm.getOptionValue(civicrm.getOptionGroupID('website_type'), record['website_type'])
+			del record['website_type']
+
+	if (not record.has_key('website_type_id')):
+		civicrm.log(u"Could not write contact website, website type '%s' could not be resolved" % record.get('website_type', ''),
+			logging.WARN, 'importer', 'import_contact_website', 'Website', None, None, time.time()-timestamp)
+		return False
+	return True
+
+
+def _import_contact_website_chunk(civicrm, chunk, parameters):
+	"""
+	import_contact_website for a chunk of records: all web sites of the chunk's
+	contacts are read with one call, the changes are sent together
+	"""
+	timestamp = time.time()
+	multiple = parameters.get('multiple', False)
+	_resolve_chunk_contacts(civicrm, chunk)
+	records = list()
+	for record in chunk:
+		if not record['contact_id']:
+			civicrm.log(u"Could not write contact website, contact not found for '%s'",
+				logging.WARN, 'importer', 'import_contact_website', 'Website', None, None, time.time()-timestamp, args=(record,))
+		elif _resolve_website_type(civicrm, record, timestamp):
+			records.append(record)
+
+	existing = civicrm.getContactEntities('Website', [record['contact_id'] for record in records])
+	writes = _ChunkWrites(civicrm, 'import_contact_website', 'Website')
+	for record in records:
+		contact_id = str(record['contact_id'])
+		if writes.pending(contact_id):
+			# the contact's web sites are about to change, write them and read them again
+			writes.send()
+			existing.update(civicrm.getContactEntities('Website', [contact_id]))
+		sites = [site for site in existing.get(contact_id, []) if str(site.get('website_type_id'))==str(record['website_type_id'])]
+		create = dict(record)
+		create.pop('id', None)		# that's the contact's
+		create['entity'] = 'Website'
+		create['action'] = 'create'
+
+		if multiple=='allow':
+			for site in sites:
+				if record['url'].lower() == site.get('url').lower():
+					civicrm.log("No new websites for contact [%s]",
+						logging.INFO, 'importer', 'import_contact_website', 'Website', site.get('id'), contact_id, time.time()-timestamp, args=(contact_id,))
+					break
+			else:
+				writes.add(create, contact_id, "Added new website for contact [%s]", timestamp, args=(contact_id,))
+
+		elif sites:
+			site = sites[0]
+			attributes = dict(record)
+			for key in ('id', 'website_type', 'url', 'external_identifier'):
+				attributes.pop(key, None)
+			changed = site.update(attributes)
+			if changed:
+				if len(sites) > 1:
+					civicrm.log("More than one website set, modified first...",
+						logging.WARN, 'importer', 'import_contact_website', 'Website', site.get('id'), contact_id, time.time()-timestamp)
+				writes.add(site._storeRequest(changed), contact_id, "Updated website: %s", timestamp, args=(site,))
+			else:
+				civicrm.log("Nothing changed for website: %s",
+					logging.INFO, 'importer', 'import_contact_website', 'Website', site.get('id'), contact_id, time.time()-timestamp, args=(site,))
+
+		else:
+			writes.add(create, contact_id, "Added new website for contact [%s]", timestamp, args=(contact_id,))
+	writes.send()
+
 
+@profiling.profiled
 def import_contact_phone(civicrm, record_source, parameters=dict()):
 	"""
 	Imports contact phone numbers.
@@ -606,12 +1619,20 @@ def import_contact_phone(civicrm, record_source, parameters=dict()):
 	parameters:
 	 multiple:	'allow' - allows multiple phone numbers per type
 	 no_update: if True, existing phone-numbers won't be overwritten; default is False
+	 chunk_size: if set, the contacts and their phone numbers are looked up for that many
+	             records at once, and the changes are sent together
 
 	"""
 	_prepare_parameters(parameters)
 	no_update = parameters.get('no_update', False)
 	multiple = parameters.get('multiple', False)
-	for record in record_source:
+	chunk_size = parameters.get('chunk_size', 0)
+	if chunk_size:
+		for chunk in tracing.traced_records(civicrm, _chunks(record_source, chunk_size), 'import_contact_phone'):
+			_import_contact_phone_chunk(civicrm, chunk, parameters)
+		return
+
+	for record in tracing.traced_records(civicrm, record_source, 'import_contact_phone'):
 		timestamp = time.time()
 		record['contact_id'] = civicrm.getContactID(record)
 		if not record['contact_id']:
@@ -619,34 +1640,8 @@ def import_contact_phone(civicrm, record_source, parameters=dict()):
 				logging.WARN, 'importer', 'import_contact_phone', 'Phone', None, None, time.time()-timestamp)
 			continue
 
-		# get the location type id
-		if (not record.has_key('location_type_id')):
-			location_type = record.get('location_type', parameters.get('location_type', 'Main'))
-			location_type_dict = _get_or_create_from_params('location_type_dict', parameters)
-
-			if location_type_dict.has_key(location_type):
-				record['location_type_id'] = location_type_dict[location_type]
-			else:
-				record['location_type_id'] = civicrm.getLocationTypeID(location_type)
-				location_type_dict[location_type] = record['location_type_id']
-			if not record['location_type_id']:
-				civicrm.log(u"Could not write contact phone number, location type %s could not be resolved" % location_type,
-					logging.WARN, 'importer', 'import_contact_phone', 'Phone', None, None, time.time()-timestamp)
-				continue
-
-		# get phone-type-id
-		if not record.has_key('phone_type_id'):
-			phone_type = record.get('phone_type', parameters.get('phone_type', 'Phone'))
-
-			option_group_id = civicrm.getOptionGroupID('phone_type')
-			phone_type_id = civicrm.getOptionValue(option_group_id, phone_type)
-
-			if not phone_type_id:
-				civicrm.log(u"Could not write contact phone number, phone type %s could not be resolved" % phone_type,
-					logging.WARN, 'importer', 'import_contact_phone', 'Phone', None, None, time.time()-timestamp)
-				continue
-			else:
-				record['phone_type_id'] = phone_type_id
+		if not _resolve_phone_types(civicrm, record, parameters, timestamp):
+			continue
 
 		if multiple=='allow':
 			# allow multiple phone numbers of the same type
@@ -700,6 +1695,111 @@ def import_contact_phone(civicrm, record_source, parameters=dict()):
 					logging.INFO, 'importer', 'import_contact_phone', 'Phone', phone_number.get('id'), phone_number.get('contact_id'), time.time()-timestamp)
 
 
+def _resolve_phone_types(civicrm, record, parameters, timestamp):
+	"""
+	sets record['location_type_id'] and record['phone_type_id'], returns False if that's not possible
+	"""
+	# get the location type id
+	if (not record.has_key('location_type_id')):
+		location_type = record.get('location_type', parameters.get('location_type', 'Main'))
+		location_type_dict = _get_or_create_from_params('location_type_dict', parameters)
+
+		if location_type_dict.has_key(location_type):
+			record['location_type_id'] = location_type_dict[location_type]
+		else:
+			record['location_type_id'] = civicrm.getLocationTypeID(location_type)
+			location_type_dict[location_type] = record['location_type_id']
+		if not record['location_type_id']:
+			civicrm.log(u"Could not write contact phone number, location type %s could not be resolved" % location_type,
+				logging.WARN, 'importer', 'import_contact_phone', 'Phone', None, None, time.time()-timestamp)
+			return False
+
+	# get phone-type-id
+	if not record.has_key('phone_type_id'):
+		phone_type = record.get('phone_type', parameters.get('phone_type', 'Phone'))
+
+		option_group_id = civicrm.getOptionGroupID('phone_type')
+		phone_type_id = civicrm.getOptionValue(option_group_id, phone_type)
+
+		if not phone_type_id:
+			civicrm.log(u"Could not write contact phone number, phone type %s could not be resolved" % phone_type,
+				logging.WARN, 'importer', 'import_contact_phone', 'Phone', None, None, time.time()-timestamp)
+			return False
+		else:
+			record['phone_type_id'] = phone_type_id
+	return True
+
+
+def _import_contact_phone_chunk(civicrm, chunk, parameters):
+	"""
+	import_contact_phone for a chunk of records: all phone numbers of the chunk's
+	contacts are read with one call, the changes are sent together
+	"""
+	timestamp = time.time()
+	no_update = parameters.get('no_update', False)
+	multiple = parameters.get('multiple', False)
+	_resolve_chunk_contacts(civicrm, chunk)
+	records = list()
+	for record in chunk:
+		if not record['contact_id']:
+			civicrm.log(u"Could not write contact phone, contact not found for '%s'",
+				logging.WARN, 'importer', 'import_contact_phone', 'Phone', None, None, time.time()-timestamp, args=(record,))
+		elif _resolve_phone_types(civicrm, record, parameters, timestamp):
+			records.append(record)
+
+	existing = civicrm.getContactEntities('Phone', [record['contact_id'] for record in records])
+	writes = _ChunkWrites(civicrm, 'import_contact_phone', 'Phone')
+	for record in records:
+		contact_id = str(record['contact_id'])
+		if writes.pending(contact_id):
+			# the contact's phone numbers are about to change, write them and read them again
+			writes.send()
+			existing.update(civicrm.getContactEntities('Phone', [contact_id]))
+		phone_numbers = [phone_number for phone_number in existing.get(contact_id, [])
+			if str(phone_number.get('location_type_id'))==str(record['location_type_id'])]
+		create = dict(record)
+		create.pop('id', None)		# that's the contact's
+		create['entity'] = 'Phone'
+		create['action'] = 'create'
+
+		if multiple=='allow':
+			for phone_number in phone_numbers:
+				if record['phone'].lower() == phone_number.get('phone').lower():
+					civicrm.log("No new phone numbers for contact [%s]",
+						logging.INFO, 'importer', 'import_contact_phone', 'Phone', phone_number.get('id'), contact_id, time.time()-timestamp, args=(contact_id,))
+					break
+			else:
+				writes.add(create, contact_id, "Added new phone_number for contact [%s]", timestamp, args=(contact_id,))
+			continue
+
+		phone_numbers = [phone_number for phone_number in phone_numbers
+			if str(phone_number.get('phone_type_id'))==str(record['phone_type_id'])]
+		if len(phone_numbers) > 1:
+			civicrm.log("Contact %s has more then one [%s/%s] phone number. Delivering first!",
+				logging.ERROR, 'pycivi', 'get', 'Phone', contact_id, None, time.time()-timestamp, args=(contact_id, record.get('phone_type', 'n/a'), record.get('location_type', 'n/a')))
+		phone_number = phone_numbers and phone_numbers[0] or None
+
+		if not no_update and phone_number:
+			attributes = dict(record)
+			for key in ('id', 'location_type', 'location_type_id', 'external_identifier'):
+				attributes.pop(key, None)
+			changed = phone_number.update(attributes)
+			if changed:
+				writes.add(phone_number._storeRequest(changed), contact_id, "Updated phone number: %s", timestamp, args=(phone_number,))
+			else:
+				civicrm.log("Nothing changed for phone number: %s",
+					logging.INFO, 'importer', 'import_contact_phone', 'Phone', phone_number.get('id'), contact_id, time.time()-timestamp, args=(phone_number,))
+
+		elif no_update and phone_number:
+			civicrm.log("Phone_number exists and was not updated: %s",
+				logging.INFO, 'importer', 'import_contact_phone', 'Phone', phone_number.get('id'), contact_id, time.time()-timestamp, args=(phone_number,))
+
+		else:
+			writes.add(create, contact_id, "Added new phone_number for contact [%s]", timestamp, args=(contact_id,))
+	writes.send()
+
+
+@profiling.profiled
 def import_contact_prefix(civicrm, record_source, parameters=dict()):
 	"""
 	Imports contact prefixes
@@ -709,7 +1809,7 @@ def import_contact_prefix(civicrm, record_source, parameters=dict()):
 	if parameters['no_update'] is True we do not overwrite existing prefixes
 	"""
 	no_update = parameters.get('no_update', False)
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_contact_prefix'):
 		timestamp = time.time()
 		contact_id = civicrm.getContactID(record)
 		if not contact_id:
@@ -738,17 +1838,18 @@ def import_contact_prefix(civicrm, record_source, parameters=dict()):
 			else:
 				changed = contact.update(record, True)
 			if changed:
-				civicrm.log(u"Updated Prefix for '%s'" % unicode(str(contact), 'utf8'),
-				  logging.INFO, 'importer', 'import_contact_prefix', 'Contact', contact.get('id'), None, time.time()-timestamp)
+				civicrm.log(u"Updated Prefix for '%s'",
+				  logging.INFO, 'importer', 'import_contact_prefix', 'Contact', contact.get('id'), None, time.time()-timestamp, args=(contact,))
 			elif no_update:
-				civicrm.log(u"Prefix for '%s' already exists and was not updated." % unicode(str(contact), 'utf8'),
-				  logging.INFO, 'importer', 'import_contact_prefix', 'Contact', contact.get('id'), None, time.time()-timestamp)
+				civicrm.log(u"Prefix for '%s' already exists and was not updated.",
+				  logging.INFO, 'importer', 'import_contact_prefix', 'Contact', contact.get('id'), None, time.time()-timestamp, args=(contact,))
 			else:
-				civicrm.log(u"Prefix for '%s' was up to date." % unicode(str(contact), 'utf8'),
-				  logging.INFO, 'importer', 'import_contact_prefix', 'Contact', contact.get('id'), None, time.time()-timestamp)
+				civicrm.log(u"Prefix for '%s' was up to date.",
+				  logging.INFO, 'importer', 'import_contact_prefix', 'Contact', contact.get('id'), None, time.time()-timestamp, args=(contact,))
 
 
 
+@profiling.profiled
 def import_contact_greeting(civicrm, record_source, parameters=dict()):
 	"""
 	Imports contact greeting settings
@@ -758,12 +1859,12 @@ def import_contact_greeting(civicrm, record_source, parameters=dict()):
 	and identification ('id', 'external_identifier', 'contact_id')
 	"""
 	_prepare_parameters(parameters)
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_contact_greeting'):
 		timestamp = time.time()
 		contact = civicrm.getEntity(entity_type.CONTACT, record)
 		if not contact:
-			civicrm.log(u"Could not write contact greeting, contact not found for '%s'" % unicode(str(contact), 'utf8'),
-				logging.WARN, 'importer', 'import_contact_greeting', 'Contact', None, None, time.time()-timestamp)
+			civicrm.log(u"Could not write contact greeting, contact not found for '%s'",
+				logging.WARN, 'importer', 'import_contact_greeting', 'Contact', None, None, time.time()-timestamp, args=(contact,))
 			continue
 
 		update = dict()
@@ -782,13 +1883,14 @@ def import_contact_greeting(civicrm, record_source, parameters=dict()):
 
 		changed = contact.update(update, True)
 		if changed:
-			civicrm.log(u"Updated greeting settings for contact: %s" % unicode(str(contact), 'utf8'),
-				logging.INFO, 'importer', 'import_contact_greeting', 'Contact', contact.get('id'), None, time.time()-timestamp)
+			civicrm.log(u"Updated greeting settings for contact: %s",
+				logging.INFO, 'importer', 'import_contact_greeting', 'Contact', contact.get('id'), None, time.time()-timestamp, args=(contact,))
 		else:
-			civicrm.log(u"Greeting settings not changed for contact: %s" % unicode(str(contact), 'utf8'),
-				logging.INFO, 'importer', 'import_contact_greeting', 'Contact', contact.get('id'), None, time.time()-timestamp)
+			civicrm.log(u"Greeting settings not changed for contact: %s",
+				logging.INFO, 'importer', 'import_contact_greeting', 'Contact', contact.get('id'), None, time.time()-timestamp, args=(contact,))
 
 
+@profiling.profiled
 def import_contact_email(civicrm, record_source, parameters=dict()):
 	"""
 	Imports contact email address
@@ -800,11 +1902,19 @@ def import_contact_email(civicrm, record_source, parameters=dict()):
 	parameters:
 	 multiple:	'allow' - allows multiple emails per type
 	 no_update: if True, existing email-addresses won't be overwritten; default is False
+	 chunk_size: if set, the contacts and their emails are looked up for that many
+	             records at once, and the changes are sent together
 	"""
 	_prepare_parameters(parameters)
 	no_update = parameters.get('no_update', False)
 	multiple = parameters.get('multiple', False)
-	for record in record_source:
+	chunk_size = parameters.get('chunk_size', 0)
+	if chunk_size:
+		for chunk in tracing.traced_records(civicrm, _chunks(record_source, chunk_size), 'import_contact_email'):
+			_import_contact_email_chunk(civicrm, chunk, parameters)
+		return
+
+	for record in tracing.traced_records(civicrm, record_source, 'import_contact_email'):
 		timestamp = time.time()
 		record['contact_id'] = civicrm.getContactID(record)
 		if not record['contact_id']:
@@ -812,20 +1922,8 @@ def import_contact_email(civicrm, record_source, parameters=dict()):
 				logging.WARN, 'importer', 'import_contact_email', 'Email', None, None, time.time()-timestamp)
 			continue
 
-		# get the location type id
-		if (not record.has_key('location_type_id')):
-			location_type = record.get('location_type', parameters.get('location_type', 'Main'))
-			location_type_dict = _get_or_create_from_params('location_type_dict', parameters)
-
-			if location_type_dict.has_key(location_type):
-				record['location_type_id'] = location_type_dict[location_type]
-			else:
-				record['location_type_id'] = civicrm.getLocationTypeID(location_type)
-				location_type_dict[location_type] = record['location_type_id']
-			if not record['location_type_id']:
-				civicrm.log(u"Could not write contact email, location type %s could not be resolved" % location_type,
-					logging.WARN, 'importer', 'import_contact_email', 'Email', None, None, time.time()-timestamp)
-				continue
+		if not _resolve_email_location_type(civicrm, record, parameters, timestamp):
+			continue
 
 		if multiple=='allow':
 			# allow multiple emails of the same type
@@ -874,6 +1972,92 @@ def import_contact_email(civicrm, record_source, parameters=dict()):
 					logging.INFO, 'importer', 'import_contact_email', 'Email', email.get('id'), record['contact_id'], time.time()-timestamp)
 
 
+def _resolve_email_location_type(civicrm, record, parameters, timestamp):
+	"""
+	sets record['location_type_id'], returns False if that's not possible
+	"""
+	if (not record.has_key('location_type_id')):
+		location_type = record.get('location_type', parameters.get('location_type', 'Main'))
+		location_type_dict = _get_or_create_from_params('location_type_dict', parameters)
+
+		if location_type_dict.has_key(location_type):
+			record['location_type_id'] = location_type_dict[location_type]
+		else:
+			record['location_type_id'] = civicrm.getLocationTypeID(location_type)
+			location_type_dict[location_type] = record['location_type_id']
+		if not record['location_type_id']:
+			civicrm.log(u"Could not write contact email, location type %s could not be resolved" % location_type,
+				logging.WARN, 'importer', 'import_contact_email', 'Email', None, None, time.time()-timestamp)
+			return False
+	return True
+
+
+def _import_contact_email_chunk(civicrm, chunk, parameters):
+	"""
+	import_contact_email for a chunk of records: all emails of the chunk's
+	contacts are read with one call, the changes are sent together
+	"""
+	timestamp = time.time()
+	no_update = parameters.get('no_update', False)
+	multiple = parameters.get('multiple', False)
+	_resolve_chunk_contacts(civicrm, chunk)
+	records = list()
+	for record in chunk:
+		if not record['contact_id']:
+			civicrm.log(u"Could not write contact email, contact not found for '%s'",
+				logging.WARN, 'importer', 'import_contact_email', 'Email', None, None, time.time()-timestamp, args=(record,))
+		elif _resolve_email_location_type(civicrm, record, parameters, timestamp):
+			records.append(record)
+
+	existing = civicrm.getContactEntities('Email', [record['contact_id'] for record in records])
+	writes = _ChunkWrites(civicrm, 'import_contact_email', 'Email')
+	for record in records:
+		contact_id = str(record['contact_id'])
+		if writes.pending(contact_id):
+			# the contact's emails are about to change, write them and read them again
+			writes.send()
+			existing.update(civicrm.getContactEntities('Email', [contact_id]))
+		emails = [email for email in existing.get(contact_id, [])
+			if str(email.get('location_type_id'))==str(record['location_type_id'])]
+		create = {'entity': 'Email', 'action': 'create', 'contact_id': record['contact_id'],
+			'location_type_id': record['location_type_id'], 'email': record['email']}
+
+		if multiple=='allow':
+			for email in emails:
+				if record['email'].lower() == email.get('email').lower():
+					civicrm.log("No new emails for contact [%s]",
+						logging.INFO, 'importer', 'import_contact_email', 'Email', email.get('id'), contact_id, time.time()-timestamp, args=(contact_id,))
+					break
+			else:
+				writes.add(create, contact_id, "Added new email for contact [%s]", timestamp, args=(contact_id,))
+			continue
+
+		if len(emails) > 1:
+			civicrm.log("Contact %s has more then one %s email address. Delivering first!",
+				logging.WARN, 'pycivi', 'get', 'Email', contact_id, None, time.time()-timestamp, args=(contact_id, record.get('location_type', 'n/a')))
+		email = emails and emails[0] or None
+
+		if not no_update and email:
+			attributes = dict(record)
+			for key in ('id', 'location_type', 'location_type_id', 'external_identifier'):
+				attributes.pop(key, None)
+			changed = email.update(attributes)
+			if changed:
+				writes.add(email._storeRequest(changed), contact_id, "Updated email address: %s", timestamp, args=(email,))
+			else:
+				civicrm.log("Nothing changed for email: %s",
+					logging.INFO, 'importer', 'import_contact_email', 'Email', email.get('id'), contact_id, time.time()-timestamp, args=(email,))
+
+		elif no_update and email:
+			civicrm.log("Email exists and was not updated: %s",
+				logging.INFO, 'importer', 'import_contact_email', 'Email', email.get('id'), contact_id, time.time()-timestamp, args=(email,))
+
+		else:
+			writes.add(create, contact_id, "Created email address for contact [%s]", timestamp, args=(contact_id,))
+	writes.send()
+
+
+@profiling.profiled
 def import_membership(civicrm, record_source, parameters=dict()):
 	"""
 	Imports memberships
@@ -885,15 +2069,26 @@ def import_membership(civicrm, record_source, parameters=dict()):
               u'start_date',
               u'end_date',
 	and identification ('id', 'external_identifier', 'contact_id')
+
+	Parameters:
+	parameters['multiple']				allow multiple memberships (of different types) per contact
+	parameters['chunk_size']			if set, the memberships are read for that many records at once,
+										compared locally and only the changes are sent, together
 	"""
 	_prepare_parameters(parameters)
+	chunk_size = parameters.get('chunk_size', 0)
+	if chunk_size:
+		for chunk in tracing.traced_records(civicrm, _chunks(record_source, chunk_size), 'import_membership'):
+			_import_membership_chunk(civicrm, chunk, parameters)
+		return
+
 	membership_primary_attributes=[u'contact_id']
 	if parameters.has_key('multiple') and parameters['multiple']:
 		# multiple means, that we allow multiple membership types per contact
 		membership_primary_attributes.append(u'membership_type_id')
 		membership_primary_attributes.append(u'membership_type')
 
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_membership'):
 		timestamp = time.time()
 		record['contact_id'] = civicrm.getContactID(record)
 		if not record['contact_id']:
@@ -921,12 +2116,173 @@ def import_membership(civicrm, record_source, parameters=dict()):
 				logging.ERROR, 'importer', 'import_membership', 'Membership', None, record['contact_id'], time.time()-timestamp)
 
 
+def _resolve_membership_ids(civicrm, record, timestamp):
+	"""
+	replaces the record's 'status' and 'membership_type' names with their IDs,
+	returns False if that's not possible
+	"""
+	record['is_override'] = 1 	# write status as-is
+	if record.has_key('status'):
+		status_id = civicrm.getMembershipStatusID(record['status'])
+		if not status_id:
+			civicrm.log(u"Membership status '%s' does not exist!" % record['status'],
+				logging.WARN, 'importer', 'import_membership', 'Membership', None, None, time.time()-timestamp)
+			return False
+		record['status_id'] = status_id
+		del record['status']
+
+	if record.has_key('membership_type'):
+		if not record.has_key('membership_type_id'):
+			type_id = civicrm.getMembershipTypeID(record['membership_type'])
+			if not type_id:
+				civicrm.log(u"Membership type '%s' does not exist!" % record['membership_type'],
+					logging.WARN, 'importer', 'import_membership', 'Membership', None, None, time.time()-timestamp)
+				return False
+			record['membership_type_id'] = type_id
+		del record['membership_type']
+	return True
+
+
+def _import_membership_chunk(civicrm, chunk, parameters):
+	"""
+	import_membership for a chunk of records: the memberships of the chunk's
+	contacts are read with one call, compared with the records, and
+	the changes are sent together
+	"""
+	timestamp = time.time()
+	multiple = parameters.get('multiple', False)
+	_resolve_chunk_contacts(civicrm, chunk)
+	records = list()
+	for record in chunk:
+		if not record['contact_id']:
+			civicrm.log(u"Could not write membership, contact not found for '%s'",
+				logging.WARN, 'importer', 'import_membership', 'Membership', None, None, time.time()-timestamp, args=(record,))
+		elif _resolve_membership_ids(civicrm, record, timestamp):
+			records.append(record)
+
+	existing = civicrm.getContactEntities('Membership', [record['contact_id'] for record in records])
+	writes = _ChunkWrites(civicrm, 'import_membership', 'Membership')
+	for record in records:
+		contact_id = str(record['contact_id'])
+		if writes.pending(contact_id):
+			# the contact's memberships are about to change, write them and read them again
+			writes.send()
+			existing.update(civicrm.getContactEntities('Membership', [contact_id]))
+		memberships = existing.get(contact_id, [])
+		if multiple and record.has_key('membership_type_id'):
+			memberships = [membership for membership in memberships
+				if str(membership.get('membership_type_id'))==str(record['membership_type_id'])]
+		if len(memberships) > 1:
+			civicrm.log("Failed to create membership for contact: %s (more than one membership found)",
+				logging.ERROR, 'importer', 'import_membership', 'Membership', None, contact_id, time.time()-timestamp, args=(contact_id,))
+			continue
+
+		if memberships:
+			membership = memberships[0]
+			changed = dict()
+			for key, value in record.items():
+				if key in ('id', 'contact_id', 'external_identifier'):
+					continue
+				current = membership.get(key, None)
+				if _normalised(current)!=_normalised(value) and _differs(current, value):
+					changed[key] = value
+			if not changed:
+				civicrm.log("Membership unchanged for contact [%s]",
+					logging.INFO, 'importer', 'import_membership', 'Membership', membership.get('id'), contact_id, time.time()-timestamp, args=(contact_id,))
+				continue
+			membership.attributes.update(changed)
+			writes.add(membership._storeRequest(changed), contact_id, "Updated membership for contact [%s]", timestamp, args=(contact_id,))
+		else:
+			request = dict(record)
+			request.pop('id', None)		# that's the contact's
+			request.pop('external_identifier', None)
+			request['entity'] = 'Membership'
+			request['action'] = 'create'
+			writes.add(request, contact_id, "Created membership for contact [%s]", timestamp, args=(contact_id,))
+	writes.send()
+
+
+def _flag_columns(record, key_fields):
+	"""
+	the tag/group columns of the record
+	"""
+	return [name for name in record.keys() if not (name in key_fields or name=='contact_id')]
+
+
+def _desired_state(value):
+	return unicode(value).lower() in ['true', '1', 'x', 'yes', 'y', 'ja', 'j']
+
+
+def _resolve_flag_ids(civicrm, names, parameters, key, lookup):
+	"""
+	the IDs of the tag/group names (parameters[key]), the unknown ones are
+	looked up (or created) with lookup(name). Only then the parameters lock is needed
+	"""
+	flag_ids = _get_or_create_from_params(key, parameters, dict())
+	unknown = [name for name in names if not name in flag_ids]
+	if unknown:
+		parameters_lock = parameters['lock']
+		parameters_lock.acquire()
+		try:
+			for name in unknown:
+				# test again, maybe another thread already looked it up...
+				if not name in flag_ids:
+					flag_ids[name] = lookup(name)
+					civicrm.log("%s '%s' has ID %s" % (key=='tag_ids' and 'Tag' or 'Group', name, flag_ids[name]),
+						logging.INFO, 'importer', key=='tag_ids' and 'import_entity_tags' or 'import_contact_groups', None, flag_ids[name], None, 0)
+		finally:
+			parameters_lock.notifyAll()
+			parameters_lock.release()
+	return flag_ids
+
+
+def _flag_changes(entities, current, flag_ids, key_fields):
+	"""
+	compares the tags/groups the records ask for with the current ones.
+
+	entities   list of (entity_id, record)
+	current    dict str(entity_id) => set of tag/group IDs
+
+	Returns {(tag/group ID, new state): [entity_id, ...]}, for an entity listed
+	in several records, the last record wins
+	"""
+	initial = dict()
+	final = dict()
+	for entity_id, record in entities:
+		for name in _flag_columns(record, key_fields):
+			key = (str(entity_id), str(flag_ids[name]))
+			if not key in initial:
+				initial[key] = key[1] in [str(flag_id) for flag_id in current.get(key[0], ())]
+			final[key] = _desired_state(record[name])
+
+	changes = dict()
+	for key, state in final.items():
+		if state!=initial[key]:
+			changes.setdefault((key[1], state), list()).append(key[0])
+	return changes
+
+
+@profiling.profiled
 def import_contact_groups(civicrm, record_source, parameters=dict()):
+	"""
+	Sets the group memberships of contacts: every column except the key_fields
+	is a group title, a true value ('x', 'yes', '1', ...) means member.
+
+	parameters:
+	 key_fields: the identifying columns, default ['id', 'external_identifier']
+	 chunk_size: if set, the memberships are read for that many records at once,
+	             and the changes are sent as one call per group
+	"""
 	_prepare_parameters(parameters)
 	entity_type = parameters.get('entity_type', 'Contact')
 	key_fields = parameters.get('key_fields', ['id', 'external_identifier'])
+	chunk_size = parameters.get('chunk_size', 0)
+	if chunk_size:
+		for chunk in tracing.traced_records(civicrm, _chunks(record_source, chunk_size), 'import_contact_groups'):
+			_import_contact_groups_chunk(civicrm, chunk, parameters)
+		return
 
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_contact_groups'):
 		contact_id = civicrm.getContactID(record)
 		if not contact_id:
 			civicrm.log("Contact not found: ID %s" % contact_id,
@@ -971,7 +2327,43 @@ def import_contact_groups(civicrm, record_source, parameters=dict()):
 				logging.INFO, 'importer', 'import_contact_groups', 'Contact', contact_id, None, 0)
 
 
+def _import_contact_groups_chunk(civicrm, chunk, parameters):
+	"""
+	import_contact_groups for a chunk of records: the memberships of all the chunk's
+	contacts are read with one call, the changes are written with one call per group and state
+	"""
+	timestamp = time.time()
+	key_fields = parameters.get('key_fields', ['id', 'external_identifier'])
+	_resolve_chunk_contacts(civicrm, chunk)
+	contacts = list()
+	names = set()
+	for record in chunk:
+		if not record['contact_id']:
+			civicrm.log("Contact not found: %s",
+				logging.WARN, 'importer', 'import_contact_groups', 'Contact', None, None, time.time()-timestamp, args=(record,))
+			continue
+		contacts.append((record['contact_id'], record))
+		names.update(_flag_columns(record, key_fields))
+
+	group_ids = _resolve_flag_ids(civicrm, names, parameters, 'group_ids', civicrm.getOrCreateGroupID)
+	current = civicrm.getContactsGroupIds([contact_id for contact_id, record in contacts])
+	changes = _flag_changes(contacts, current, group_ids, key_fields)
+
+	changed_contacts = set()
+	for (group_id, state), contact_ids in sorted(changes.items()):
+		civicrm.setGroupMemberships(contact_ids, group_id, state)
+		changed_contacts.update(contact_ids)
+	for contact_id in sorted(set([str(contact_id) for contact_id, record in contacts])):
+		if contact_id in changed_contacts:
+			civicrm.log("Modified groups for contact %s",
+				logging.INFO, 'importer', 'import_contact_groups', 'Contact', contact_id, None, time.time()-timestamp, args=(contact_id,))
+		else:
+			civicrm.log("Groups are up to date for contact %s",
+				logging.INFO, 'importer', 'import_contact_groups', 'Contact', contact_id, None, time.time()-timestamp, args=(contact_id,))
 
+
+
+@profiling.profiled
 def import_contact_tags(civicrm, record_source, parameters=dict()):
 	"""
 	Set set of tags for a contact
@@ -982,9 +2374,17 @@ def import_contact_tags(civicrm, record_source, parameters=dict()):
 	return import_entity_tags(civicrm, record_source, parameters)
 
 
+@profiling.profiled
 def import_entity_tags(civicrm, record_source, parameters=dict()):
 	"""
-	(Un)set a set of tags for entities
+	(Un)set a set of tags for entities: every column except the key_fields
+	is a tag name, a true value ('x', 'yes', '1', ...) means tagged.
+
+	parameters:
+	 entity_type, entity_table: the tagged entities, e.g. 'Contact' and 'civicrm_contact'
+	 key_fields: the identifying columns, default ['id', 'external_identifier']
+	 chunk_size: if set, the tags are read for that many records at once,
+	             and the changes are sent as one call per tag
 	"""
 	_prepare_parameters(parameters)
 
@@ -1001,9 +2401,13 @@ def import_entity_tags(civicrm, record_source, parameters=dict()):
 		return
 
 	key_fields = parameters.get('key_fields', ['id', 'external_identifier'])
+	chunk_size = parameters.get('chunk_size', 0)
+	if chunk_size:
+		for chunk in tracing.traced_records(civicrm, _chunks(record_source, chunk_size), 'import_entity_tags'):
+			_import_entity_tags_chunk(civicrm, chunk, parameters)
+		return
 
-
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_entity_tags'):
 		if entity_type=='Contact':
 			entity_id = civicrm.getContactID(record)
 			if not entity_id:
@@ -1062,6 +2466,50 @@ def import_entity_tags(civicrm, record_source, parameters=dict()):
 				logging.INFO, 'importer', 'import_entity_tags', 'EntityTag', entity_id, None, 0)
 
 
+def _import_entity_tags_chunk(civicrm, chunk, parameters):
+	"""
+	import_entity_tags for a chunk of records: the tags of all the chunk's
+	entities are read with one call, the changes are written with one call per tag and state
+	"""
+	timestamp = time.time()
+	entity_type = parameters['entity_type']
+	entity_table = parameters['entity_table']
+	key_fields = parameters.get('key_fields', ['id', 'external_identifier'])
+	if entity_type=='Contact':
+		_resolve_chunk_contacts(civicrm, chunk)
+
+	entities = list()
+	names = set()
+	for record in chunk:
+		if entity_type=='Contact':
+			entity_id = record['contact_id']
+		else:
+			entity_id = civicrm.getEntityID(record, entity_type, key_fields)
+		if not entity_id:
+			civicrm.log("%s not found: %s",
+				logging.WARN, 'importer', 'import_entity_tags', entity_type, None, None, time.time()-timestamp, args=(entity_type, record))
+			continue
+		entities.append((entity_id, record))
+		names.update(_flag_columns(record, key_fields))
+
+	tag_ids = _resolve_flag_ids(civicrm, names, parameters, 'tag_ids', civicrm.getOrCreateTagID)
+	current = civicrm.getEntitiesTagIds([entity_id for entity_id, record in entities], entity_table)
+	changes = _flag_changes(entities, current, tag_ids, key_fields)
+
+	changed_entities = set()
+	for (tag_id, state), entity_ids in sorted(changes.items()):
+		civicrm.tagEntities(entity_ids, entity_table, tag_id, state)
+		changed_entities.update(entity_ids)
+	for entity_id in sorted(set([str(entity_id) for entity_id, record in entities])):
+		if entity_id in changed_entities:
+			civicrm.log("Modified tags for %s [%s]",
+				logging.INFO, 'importer', 'import_entity_tags', 'EntityTag', entity_id, None, time.time()-timestamp, args=(entity_type, entity_id))
+		else:
+			civicrm.log("Tags are up to date for %s [%s]",
+				logging.INFO, 'importer', 'import_entity_tags', 'EntityTag', entity_id, None, time.time()-timestamp, args=(entity_type, entity_id))
+
+
+@profiling.profiled
 def import_delete_entity(civicrm, record_source, parameters=dict()):
 	"""
 	Will delete the given entity if identified
@@ -1078,7 +2526,7 @@ def import_delete_entity(civicrm, record_source, parameters=dict()):
 	identifiers = list(parameters.get('identifiers', ['id', 'external_identifier']))
 	silent = parameters.get('silent', False)
 
-	for record in record_source:
+	for record in tracing.traced_records(civicrm, record_source, 'import_delete_entity'):
 		# lookup contact_id
 		for external_identifier in ['contact_external_identifier', 'external_identifier']:
 			if record.has_key(external_identifier):
@@ -1124,13 +2572,38 @@ def import_delete_entity(civicrm, record_source, parameters=dict()):
 
 
 def parallelize(civicrm, import_function, workers, record_source, parameters=dict()):
+	"""
+	Runs import_function on the records with the given number of worker threads.
+
+	If parameters['chunk_size'] is set, the workers get whole chunks of records
+	(see e.g. import_contact_email).
+	If parameters['profile'] is set, the workers are profiled (see profiling.py)
+	parameters['throttle'] is the pause (in seconds) of the worker threads before each record, default 0.1
+	"""
 	_prepare_parameters(parameters)
+	session = profiling.start(parameters)
+	if not session:
+		return _parallelize(civicrm, import_function, workers, record_source, parameters, None)
+	try:
+		if workers==1:
+			return session.run(_parallelize, civicrm, import_function, workers, record_source, parameters, None)
+		return _parallelize(civicrm, import_function, workers, record_source, parameters, session)
+	finally:
+		session.close(civicrm)
+
+
+def _parallelize(civicrm, import_function, workers, record_source, parameters, session):
+	chunk_size = parameters.get('chunk_size', 0)
+	if chunk_size:
+		# from here on, a 'record' is a chunk of records
+		record_source = _chunks(record_source, chunk_size)
+
 	# if only on worker, just call directly
 	if workers==1:
 		for record in record_source:
 			try:
 				timestamp = time.time()
-				import_function(civicrm, [record], parameters)
+				import_function(civicrm, chunk_size and record or [record], parameters)
 			except:
 				civicrm.logException(u"Exception caught for '%s' on procedure '%s'. Exception was: " % (threading.currentThread().name, import_function.__name__),
 					logging.ERROR, 'importer', import_function.__name__, None, None, None, time.time()-timestamp)
@@ -1154,17 +2627,24 @@ def parallelize(civicrm, import_function, workers, record_source, parameters=dic
 
 	# then start the threads
 	class Worker(threading.Thread):
-		def __init__(self, function, civicrm, parameters, record_list, record_list_lock):
+		def __init__(self, function, civicrm, parameters, record_list, record_list_lock, session=None):
 			threading.Thread.__init__(self)
 			self.civicrm = civicrm
 			self.parameters = parameters
 			self.function = function
 			self.record_list = record_list
 			self.record_list_lock = record_list_lock
-			self.throttle = 0.1
+			self.session = session
+			self.throttle = parameters.get('throttle', 0.1)
 			self.start()
 
 		def run(self):
+			if self.session:
+				self.session.run(self.work)
+			else:
+				self.work()
+
+		def work(self):
 			active = True
 			while active:
 				if self.throttle > 0:
@@ -1187,7 +2667,7 @@ def parallelize(civicrm, import_function, workers, record_source, parameters=dic
 					# execute standard function
 					try:
 						timestamp = time.time()
-						self.function(self.civicrm, [record], self.parameters)
+						self.function(self.civicrm, chunk_size and record or [record], self.parameters)
 					except:
 						civicrm.logException(u"Exception caught for '%s' on procedure '%s'. Exception was: " % (threading.currentThread().name, import_function.__name__),
 							logging.ERROR, 'importer', import_function.__name__, None, None, None, time.time()-timestamp)
@@ -1196,8 +2676,10 @@ def parallelize(civicrm, import_function, workers, record_source, parameters=dic
 
 
 
+	profile_all = parameters.get('profile_workers', 'all')=='all'
 	for i in range(workers):
-		thread_list.append(Worker(import_function, civicrm, parameters, record_list, record_list_lock))
+		worker_session = (i==0 or profile_all) and session or None
+		thread_list.append(Worker(import_function, civicrm, parameters, record_list, record_list_lock, worker_session))
 
 	# finally, feed the queue
 	remaining_records = True
@@ -1216,3 +2698,86 @@ def parallelize(civicrm, import_function, workers, record_source, parameters=dic
 
 	civicrm.log(u"Parallelized procedure '%s' completed." % import_function.__name__,
 		logging.INFO, 'importer', 'parallelize', None, None, None, time.time()-timestamp)
+
+
+def _parallelize_partition(civicrm, import_function, workers, record_source, parameters):
+	"""
+	runs a single partition within a worker process
+	"""
+	try:
+		parallelize(civicrm, import_function, workers, record_source, parameters)
+		# parallelize has waited for the workers, so the records are imported
+		record_source.finish()
+	except:
+		civicrm.logException(u"Partition %d failed on procedure '%s'. Exception was: " % (record_source.partition, import_function.__name__),
+			logging.ERROR, 'importer', 'parallelize_partitions', None, None, None, 0)
+		record_source.progress_callback(dict(record_source.progress(), failed=True))
+
+
+def parallelize_partitions(civicrm, import_function, processes, csv_file, parameters=dict(), workers=1,
+						   mapping=dict(), transformations=dict(), delimiter=',', encoding='utf8', progress_interval=10.0):
+	"""
+	Splits the CSV file into one partition per process (see find_csv_partitions),
+	and has each process parse and import its partition independently.
+	Each process can again use multiple worker threads (see parallelize).
+
+	The worker processes are forked, so they work on a copy of the civicrm
+	object and the parameters. The progress of each partition is logged here.
+	"""
+	_prepare_parameters(parameters)
+	timestamp = time.time()
+	partitions = find_csv_partitions(csv_file, processes)
+	civicrm.log(u"Split '%s' into %d partitions." % (csv_file, len(partitions)),
+		logging.INFO, 'importer', 'parallelize_partitions', None, None, None, time.time()-timestamp)
+
+	progress_queue = multiprocessing.Queue()
+	process_list = list()
+	profile_prefixes = list()
+	for index, (start, end) in enumerate(partitions):
+		record_source = CSVPartitionSource(csv_file, start, end, mapping, transformations, delimiter, encoding,
+			index, progress_queue.put, progress_interval)
+		partition_parameters = parameters
+		if parameters.get('profile', None):
+			# each process writes its own profile, they're merged below
+			partition_parameters = dict(parameters, profile='%s.part%d' % (parameters['profile'], index))
+			profile_prefixes.append(partition_parameters['profile'])
+		process = multiprocessing.Process(target=_parallelize_partition, name='Partition-%d' % index,
+			args=(civicrm, import_function, workers, record_source, partition_parameters))
+		process.start()
+		process_list.append(process)
+
+	# report progress until all processes are gone
+	running = len(process_list)
+	reported = set()
+	while running:
+		try:
+			progress = progress_queue.get(True, progress_interval)
+		except Queue.Empty:
+			running = len([process for process in process_list if process.is_alive()])
+			continue
+		if progress['partition'] in reported:
+			continue
+		if progress.get('failed', False):
+			civicrm.log(u"Partition %d failed after %d records." % (progress['partition'], progress['records']),
+				logging.ERROR, 'importer', 'parallelize_partitions', None, progress['partition'], None, time.time()-timestamp)
+			reported.add(progress['partition'])
+			running -= 1
+		elif progress['done']:
+			civicrm.log(u"Partition %d completed: %d records." % (progress['partition'], progress['records']),
+				logging.INFO, 'importer', 'parallelize_partitions', None, progress['partition'], None, time.time()-timestamp)
+			reported.add(progress['partition'])
+			running -= 1
+		else:
+			civicrm.log(u"Partition %d: %.1f%% (%d records)" % (progress['partition'], progress['fraction'] * 100, progress['records']),
+				logging.INFO, 'importer', 'parallelize_partitions', None, progress['partition'], None, time.time()-timestamp)
+
+	for process in process_list:
+		process.join()
+
+	if profile_prefixes:
+		profiling.merge(profile_prefixes, parameters['profile'])
+		civicrm.log(u"Merged the profiles of %d partitions into '%s'" % (len(profile_prefixes), parameters['profile']),
+			logging.INFO, 'importer', 'parallelize_partitions', None, None, None, time.time()-timestamp)
+
+	civicrm.log(u"Partitioned procedure '%s' completed." % import_function.__name__,
+		logging.INFO, 'importer', 'parallelize_partitions', None, None, None, time.time()-timestamp)
@@ -0,0 +1,326 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Streaming analysis of pycivi log files
+(timestamp;level;module;entity_type;primary_id;secondary_id;execution_time;thread;message)
+
+Reports latency percentiles per module/command/entity, throughput over time,
+per-thread utilisation and the slowest records. Plain files are split among
+the worker processes, gzipped (rotated) files are read one per process.
+
+usage: python pycivi/log_analyser.py [options] import.log import.log.1.gz ...   (see --help)
+
+The log has no command column: for API calls, the action is taken from the
+logged URL (REST) or 'Entity.action' (DRUSH), other lines are grouped by their
+message with the numbers and quoted values taken out.
+
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+import os
+import re
+import gzip
+import json
+import heapq
+import time
+import calendar
+import optparse
+import multiprocessing
+
+
+BUCKETS = {'second': 19, 'minute': 16, 'hour': 13}
+
+_VARIABLE = re.compile(r"'[^']*'|\[[^\]]*\]|\([^)]*\)|\{.*\}|\d+")
+_REST_ACTION = re.compile(r"[?&]action=(\w+)")
+_DRUSH_ACTION = re.compile(r"API call completed - \w+\.(\w+)")
+
+
+def command_of(message):
+	"""
+	the 'command' of a log line: the API action, or the message template
+	"""
+	if message.startswith('API call completed'):
+		match = _REST_ACTION.search(message) or _DRUSH_ACTION.search(message)
+		if match:
+			return 'API call ' + match.group(1)
+		return 'API call (POST)'
+	return _VARIABLE.sub('*', message[:120]).strip()
+
+
+class LogStatistics:
+	"""
+	Mergeable statistics of (part of) a log
+	"""
+
+	def __init__(self, bucket='minute', slowest=20):
+		self.bucket_length = BUCKETS[bucket]
+		self.slowest_count = slowest
+		self.lines = 0
+		self.skipped = 0
+		self.latencies = dict()		# (module, command, entity) -> {ms: count}
+		self.throughput = dict()	# time bucket -> [lines, API calls]
+		self.threads = dict()		# thread -> [lines, API calls, API ms, first timestamp, last timestamp]
+		self.slowest = list()		# heap of (ms, timestamp, thread, module, entity, primary_id, message)
+		self.levels = dict()
+
+
+	def add(self, line):
+		fields = line.rstrip('\r\n').split(';', 8)
+		if len(fields) < 9 or fields[0]=='timestamp':
+			self.skipped += 1
+			return
+		timestamp, level, module, entity, primary_id, secondary_id, duration, thread, message = fields
+		try:
+			milliseconds = int(duration[:-2])
+		except ValueError:
+			self.skipped += 1
+			return
+		self.lines += 1
+		self.levels[level] = self.levels.get(level, 0) + 1
+
+		api_call = module=='API' and message.startswith('API call completed')
+		command = command_of(message)
+		key = (module, command, entity)
+		counts = self.latencies.get(key, None)
+		if counts==None:
+			counts = self.latencies[key] = dict()
+		counts[milliseconds] = counts.get(milliseconds, 0) + 1
+
+		bucket = self.throughput.get(timestamp[:self.bucket_length], None)
+		if bucket==None:
+			bucket = self.throughput[timestamp[:self.bucket_length]] = [0, 0]
+		bucket[0] += 1
+
+		state = self.threads.get(thread, None)
+		if state==None:
+			state = self.threads[thread] = [0, 0, 0, timestamp, timestamp]
+		state[0] += 1
+		if timestamp < state[3]:
+			state[3] = timestamp
+		if timestamp > state[4]:
+			state[4] = timestamp
+
+		if api_call:
+			bucket[1] += 1
+			state[1] += 1
+			state[2] += milliseconds
+		elif primary_id and primary_id!='None':
+			# a line about a record
+			entry = (milliseconds, timestamp, thread, module, entity, primary_id, message[:200])
+			if len(self.slowest) < self.slowest_count:
+				heapq.heappush(self.slowest, entry)
+			elif milliseconds > self.slowest[0][0]:
+				heapq.heapreplace(self.slowest, entry)
+
+
+	def merge(self, other):
+		self.lines += other.lines
+		self.skipped += other.skipped
+		for level, count in other.levels.items():
+			self.levels[level] = self.levels.get(level, 0) + count
+		for key, counts in other.latencies.items():
+			mine = self.latencies.setdefault(key, dict())
+			for milliseconds, count in counts.items():
+				mine[milliseconds] = mine.get(milliseconds, 0) + count
+		for key, (lines, calls) in other.throughput.items():
+			mine = self.throughput.setdefault(key, [0, 0])
+			mine[0] += lines
+			mine[1] += calls
+		for thread, state in other.threads.items():
+			mine = self.threads.get(thread, None)
+			if mine==None:
+				self.threads[thread] = list(state)
+			else:
+				mine[0] += state[0]
+				mine[1] += state[1]
+				mine[2] += state[2]
+				mine[3] = min(mine[3], state[3])
+				mine[4] = max(mine[4], state[4])
+		for entry in other.slowest:
+			if len(self.slowest) < self.slowest_count:
+				heapq.heappush(self.slowest, entry)
+			elif entry[0] > self.slowest[0][0]:
+				heapq.heapreplace(self.slowest, entry)
+
+
+	def report(self, top=30):
+		"""
+		returns the results as a JSON-serialisable dict
+		"""
+		latencies = list()
+		for (module, command, entity), counts in self.latencies.items():
+			values = sorted(counts.items())
+			total = sum([count for milliseconds, count in values])
+			latencies.append({
+				'module': module, 'command': command, 'entity': entity, 'count': total,
+				'total_ms': sum([milliseconds * count for milliseconds, count in values]),
+				'p50_ms': _percentile(values, total, 0.5),
+				'p95_ms': _percentile(values, total, 0.95),
+				'p99_ms': _percentile(values, total, 0.99),
+				'max_ms': values[-1][0],
+			})
+		latencies.sort(key=lambda row: -row['total_ms'])
+
+		threads = dict()
+		for thread, (lines, calls, api_ms, first, last) in self.threads.items():
+			active = _seconds(last) - _seconds(first)
+			threads[thread] = {'lines': lines, 'api_calls': calls, 'api_seconds': api_ms / 1000.0,
+				'active_seconds': active, 'api_utilisation': active and min(1.0, api_ms / 1000.0 / active) or None}
+
+		return {
+			'lines': self.lines,
+			'skipped': self.skipped,
+			'levels': self.levels,
+			'latencies': latencies[:top],
+			'throughput': [{'time': key, 'lines': lines, 'api_calls': calls} for key, (lines, calls) in sorted(self.throughput.items())],
+			'threads': threads,
+			'slowest': [dict(zip(['ms', 'timestamp', 'thread', 'module', 'entity', 'primary_id', 'message'], entry))
+				for entry in sorted(self.slowest, reverse=True)],
+		}
+
+
+def _percentile(values, total, fraction):
+	rank = fraction * total
+	seen = 0
+	for milliseconds, count in values:
+		seen += count
+		if seen >= rank:
+			return milliseconds
+	return values[-1][0]
+
+
+def _seconds(timestamp):
+	# '2013-10-19 00:35:28,090', the log's local time is fine for differences
+	return calendar.timegm(time.strptime(timestamp[:19], '%Y-%m-%d %H:%M:%S')) + int(timestamp[20:23] or 0) / 1000.0
+
+
+def _open(path):
+	if path.endswith('.gz'):
+		return gzip.open(path, 'rb')
+	return open(path, 'rb')
+
+
+def analyse_part(task):
+	"""
+	analyse the lines of a file (or of the byte range start-end of a plain file)
+	"""
+	path, start, end, bucket, slowest = task
+	statistics = LogStatistics(bucket, slowest)
+	stream = _open(path)
+	if start:
+		# skip to the first line starting in this part
+		stream.seek(start - 1)
+		stream.readline()
+	position = stream.tell()
+	for line in stream:
+		if end!=None and position >= end:
+			break
+		position += len(line)
+		statistics.add(line)
+	stream.close()
+	return statistics
+
+
+def split_tasks(paths, parts, bucket, slowest):
+	"""
+	plain files are split in byte ranges, gzip files can only be read as a whole
+	"""
+	tasks = list()
+	for path in paths:
+		size = os.path.getsize(path)
+		if path.endswith('.gz') or parts <= 1 or size < 16 * 1048576:
+			tasks.append((path, 0, None, bucket, slowest))
+		else:
+			step = size / parts + 1
+			for start in xrange(0, size, step):
+				tasks.append((path, start, min(start + step, size), bucket, slowest))
+	return tasks
+
+
+def analyse(paths, processes=None, bucket='minute', slowest=20):
+	"""
+	analyse the given log files, returns the merged LogStatistics
+	"""
+	processes = processes or multiprocessing.cpu_count()
+	tasks = split_tasks(paths, processes, bucket, slowest)
+	if processes > 1 and len(tasks) > 1:
+		pool = multiprocessing.Pool(min(processes, len(tasks)))
+		parts = pool.map(analyse_part, tasks, 1)
+		pool.close()
+		pool.join()
+	else:
+		parts = [analyse_part(task) for task in tasks]
+
+	statistics = LogStatistics(bucket, slowest)
+	for part in parts:
+		statistics.merge(part)
+	return statistics
+
+
+def print_report(report):
+	print "%d lines (%d skipped), levels: %s" % (report['lines'], report['skipped'],
+		', '.join(['%s %d' % item for item in sorted(report['levels'].items())]))
+	print
+	print "%-10s %-44s %-16s %8s %10s %7s %7s %7s %7s" % ('module', 'command', 'entity', 'count', 'total s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')
+	for row in report['latencies']:
+		print "%-10s %-44s %-16s %8d %10.1f %7d %7d %7d %7d" % (row['module'][:10], row['command'][:44], row['entity'][:16],
+			row['count'], row['total_ms'] / 1000.0, row['p50_ms'], row['p95_ms'], row['p99_ms'], row['max_ms'])
+	print
+	print "%-19s %10s %10s" % ('time', 'lines', 'API calls')
+	for row in report['throughput']:
+		print "%-19s %10d %10d" % (row['time'], row['lines'], row['api_calls'])
+	print
+	print "%-20s %10s %10s %10s %10s %8s" % ('thread', 'lines', 'API calls', 'API s', 'active s', 'API use')
+	for thread, row in sorted(report['threads'].items()):
+		utilisation = row['api_utilisation']!=None and '%7.1f%%' % (row['api_utilisation'] * 100) or '-'
+		print "%-20s %10d %10d %10.1f %10.1f %8s" % (thread[:20], row['lines'], row['api_calls'], row['api_seconds'], row['active_seconds'], utilisation)
+	print
+	print "slowest records:"
+	for row in report['slowest']:
+		print "%8dms %s %-12s %-12s %-10s %s" % (row['ms'], row['timestamp'], row['thread'][:12], row['entity'][:12], row['primary_id'][:10], row['message'][:100])
+
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage="usage: %prog [options] logfile [logfile...]")
+	parser.add_option('--processes', type='int', default=None, help="worker processes [number of CPUs]")
+	parser.add_option('--bucket', default='minute', help="throughput interval: second, minute or hour [%default]")
+	parser.add_option('--slowest', type='int', default=20, help="number of slowest records to list [%default]")
+	parser.add_option('--top', type='int', default=30, help="number of module/command/entity rows, by total time [%default]")
+	parser.add_option('--json', default=None, help="also write the report as JSON to this file")
+	(options, args) = parser.parse_args()
+	if not args:
+		parser.error("no log files given")
+	if not options.bucket in BUCKETS:
+		parser.error("unknown bucket '%s'" % options.bucket)
+
+	timestamp = time.time()
+	report = analyse(args, options.processes, options.bucket, options.slowest).report(options.top)
+	print_report(report)
+	print
+	print "analysed in %.1fs" % (time.time() - timestamp)
+	if options.json:
+		json.dump(report, open(options.json, 'w'), indent=1, sort_keys=True)
@@ -0,0 +1,299 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+The logging pipeline of the CiviCRM instances: the log records are queued,
+then formatted and written in batches by a background thread.
+
+A rotating, gzip compressing log file can be passed as logfile:
+
+	CiviCRM_REST(url, site_key, api_key,
+		logfile=log_handlers.BatchFileHandler('import.log', max_bytes=100*1024*1024, backup_count=10))
+
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+import os
+import sys
+import gzip
+import shutil
+import atexit
+import logging
+import threading
+import Queue
+
+
+LOG_HEADER = "timestamp;level;module;entity_type;primary_id;secondary_id;execution_time;thread;message\n"
+
+
+def _text(value):
+	if isinstance(value, unicode):
+		return value
+	if not isinstance(value, str):
+		value = str(value)
+	return value.decode('utf8', 'replace')
+
+
+class LazyMessage:
+	"""
+	A log message that is only formatted if (and when) it is written.
+	The arguments are converted like unicode(str(value), 'utf8')
+	"""
+	def __init__(self, message, args):
+		self.message = message
+		self.args = args
+
+	def __unicode__(self):
+		return self.message % tuple([_text(arg) for arg in self.args])
+
+	def __str__(self):
+		return unicode(self).encode('utf8')
+
+
+class BatchStreamHandler(logging.StreamHandler):
+	"""
+	StreamHandler that can write a batch of records with a single flush
+	"""
+	def emitBatch(self, records):
+		lines = list()
+		for record in records:
+			try:
+				lines.append(_text(self.format(record)))
+			except Exception:
+				self.handleError(record)
+		if lines:
+			self.stream.write((u'\n'.join(lines) + u'\n').encode('utf8'))
+			self.flush()
+
+
+class BatchFileHandler(logging.Handler):
+	"""
+	Appends the records to a log file, a batch at a time.
+
+	header         written to the top of every new file
+	max_bytes      if set, the file is rotated once it gets bigger
+	backup_count   rotated files kept: filename.1(.gz) is the newest
+	compress       gzip the rotated files
+	"""
+
+	def __init__(self, filename, header=LOG_HEADER, max_bytes=0, backup_count=5, compress=True):
+		logging.Handler.__init__(self)
+		self.baseFilename = os.path.abspath(filename)
+		self.header = header
+		self.max_bytes = max_bytes
+		self.backup_count = backup_count
+		self.compress = compress
+		self.stream = None
+		self._open()
+
+
+	def _open(self):
+		new_file = not os.path.exists(self.baseFilename) or not os.path.getsize(self.baseFilename)
+		self.stream = open(self.baseFilename, 'a')
+		if new_file and self.header:
+			self.stream.write(self.header)
+		self.size = self.stream.tell()
+
+
+	def _backupName(self, index):
+		return '%s.%d%s' % (self.baseFilename, index, self.compress and '.gz' or '')
+
+
+	def rotate(self):
+		self.stream.close()
+		for index in range(self.backup_count - 1, 0, -1):
+			if os.path.exists(self._backupName(index)):
+				os.rename(self._backupName(index), self._backupName(index + 1))
+		if self.backup_count:
+			if self.compress:
+				source = open(self.baseFilename, 'rb')
+				target = gzip.open(self._backupName(1), 'wb')
+				shutil.copyfileobj(source, target)
+				target.close()
+				source.close()
+				os.remove(self.baseFilename)
+			else:
+				os.rename(self.baseFilename, self._backupName(1))
+		else:
+			os.remove(self.baseFilename)
+		self._open()
+
+
+	def emitBatch(self, records):
+		lines = list()
+		for record in records:
+			try:
+				lines.append(_text(self.format(record)))
+			except Exception:
+				self.handleError(record)
+		if not lines:
+			return
+		data = (u'\n'.join(lines) + u'\n').encode('utf8')
+		if self.max_bytes and self.size > len(self.header or '') and self.size + len(data) > self.max_bytes:
+			self.rotate()
+		self.stream.write(data)
+		self.stream.flush()
+		self.size += len(data)
+
+
+	def emit(self, record):
+		self.emitBatch([record])
+
+
+	def close(self):
+		if self.stream:
+			self.stream.close()
+			self.stream = None
+		logging.Handler.close(self)
+
+
+class QueueWriter(logging.Handler):
+	"""
+	Handler queueing the records for a background thread, which formats
+	them and passes them on to its target handlers in batches.
+
+	If the queue is full (max_queue), records are dropped and counted
+	instead of blocking the caller.
+	"""
+
+	def __init__(self, max_queue=100000, batch_size=1000):
+		logging.Handler.__init__(self)
+		self.max_queue = max_queue
+		self.batch_size = batch_size
+		self.targets = list()
+		self.dropped = 0
+		self._startThread()
+		atexit.register(self.stop)
+
+
+	def _startThread(self):
+		self.pid = os.getpid()
+		self.queue = Queue.Queue(self.max_queue)
+		self.thread = threading.Thread(target=self._run, name='LogWriter')
+		self.thread.daemon = True
+		self.thread.start()
+
+
+	def addTarget(self, handler):
+		self.acquire()
+		self.targets = self.targets + [handler]
+		self.release()
+
+
+	def findTarget(self, condition):
+		for handler in self.targets:
+			if condition(handler):
+				return handler
+		return None
+
+
+	def targetLevel(self):
+		"""
+		the lowest level any of the targets writes
+		"""
+		if not self.targets:
+			return logging.WARN
+		return min([handler.level for handler in self.targets])
+
+
+	def emit(self, record):
+		if self.pid!=os.getpid():
+			# forked (e.g. by parallelize_partitions): the thread didn't come along
+			self.acquire()
+			if self.pid!=os.getpid():
+				self._startThread()
+			self.release()
+		try:
+			self.queue.put_nowait(record)
+		except Queue.Full:
+			self.dropped += 1
+
+
+	def flush(self):
+		"""
+		wait until the queued records are written
+		"""
+		if self.thread.isAlive():
+			self.queue.join()
+
+
+	def stop(self):
+		if self.thread.isAlive():
+			self.queue.put(None)
+			self.thread.join()
+		for handler in self.targets:
+			handler.close()
+
+
+	def _run(self):
+		while True:
+			batch = [self.queue.get()]
+			while batch[-1]!=None and len(batch) < self.batch_size:
+				try:
+					batch.append(self.queue.get_nowait())
+				except Queue.Empty:
+					break
+			stopping = batch[-1]==None
+			records = [record for record in batch if record!=None]
+
+			for handler in self.targets:
+				selected = [record for record in records if record.levelno >= handler.level]
+				if not selected:
+					continue
+				try:
+					if hasattr(handler, 'emitBatch'):
+						handler.acquire()
+						try:
+							handler.emitBatch(selected)
+						finally:
+							handler.release()
+					else:
+						for record in selected:
+							handler.handle(record)
+				except Exception:
+					# the log shouldn't take the import down with it
+					sys.stderr.write("pycivi: writing the log failed: %s\n" % sys.exc_info()[1])
+
+			for record in batch:
+				self.queue.task_done()
+			if stopping:
+				break
+
+
+def getQueueWriter(logger):
+	"""
+	the logger's QueueWriter, which is created and attached on first use
+	"""
+	logging._acquireLock()
+	try:
+		for handler in logger.handlers:
+			if isinstance(handler, QueueWriter):
+				return handler
+		writer = QueueWriter()
+		logger.addHandler(writer)
+		return writer
+	finally:
+		logging._releaseLock()
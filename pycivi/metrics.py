@@ -0,0 +1,283 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+API call and lookup cache metrics, shared by all CiviCRM instances:
+
+	from pycivi import metrics
+	metrics.registry.startSnapshots('import_metrics.json', 30)
+	... run the import ...
+	print metrics.registry.prometheus()
+
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+import os
+import json
+import time
+import bisect
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+	"""
+	Latency histogram with fixed upper bounds (in seconds)
+	"""
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	def quantile(self, q):
+		"""
+		estimate of the q-quantile: the upper bound of the bucket it falls into
+		"""
+		if not self.count:
+			return 0.0
+		rank = q * self.count
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if seen >= rank and count:
+				if index < len(self.buckets):
+					return self.buckets[index]
+				break
+		return float('inf')
+
+
+class CallMetrics:
+	"""
+	The numbers of one backend/entity/action combination
+	"""
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		self.calls = 0
+		self.errors = 0
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.latency = Histogram(buckets)
+
+
+class MetricsRegistry:
+	"""
+	Thread-safe collection of:
+	  call counts, error counts, bytes in/out and latency histograms
+	  per backend, entity and action, and hits/misses per lookup cache
+	"""
+
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		self.buckets = tuple(buckets)
+		self.lock = threading.Lock()
+		self.snapshot_writer = None
+		self.reset()
+
+
+	def reset(self):
+		self.lock.acquire()
+		self.started = time.time()
+		self.calls = dict()
+		self.caches = dict()
+		self.lock.release()
+
+
+	def observeCall(self, backend, entity, action, duration, error=False, bytes_in=0, bytes_out=0):
+		"""
+		count one completed (or failed) API call
+		"""
+		key = (backend, entity or '', action or '')
+		self.lock.acquire()
+		try:
+			metrics = self.calls.get(key, None)
+			if metrics==None:
+				metrics = self.calls[key] = CallMetrics(self.buckets)
+			metrics.calls += 1
+			if error:
+				metrics.errors += 1
+			metrics.bytes_in += bytes_in
+			metrics.bytes_out += bytes_out
+			metrics.latency.observe(duration)
+		finally:
+			self.lock.release()
+
+
+	def observeCache(self, cache, hit):
+		"""
+		count a lookup in the given cache (e.g. 'location_type2id')
+		"""
+		self.lock.acquire()
+		counts = self.caches.get(cache, None)
+		if counts==None:
+			counts = self.caches[cache] = [0, 0]
+		counts[not hit] += 1
+		self.lock.release()
+
+
+	def snapshot(self):
+		"""
+		returns the current numbers as a JSON-serialisable dict,
+		with the calls sorted by their total time
+		"""
+		self.lock.acquire()
+		try:
+			total_time = sum([metrics.latency.sum for metrics in self.calls.values()])
+			calls = list()
+			for (backend, entity, action), metrics in self.calls.items():
+				calls.append({
+					'backend':     backend,
+					'entity':      entity,
+					'action':      action,
+					'calls':       metrics.calls,
+					'errors':      metrics.errors,
+					'bytes_in':    metrics.bytes_in,
+					'bytes_out':   metrics.bytes_out,
+					'time':        metrics.latency.sum,
+					'time_share':  total_time and metrics.latency.sum / total_time or 0.0,
+					'latency_avg': metrics.latency.sum / metrics.calls,
+					'latency_p50': metrics.latency.quantile(0.5),
+					'latency_p95': metrics.latency.quantile(0.95),
+					'latency_p99': metrics.latency.quantile(0.99),
+					'buckets':     dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], metrics.latency.counts)),
+				})
+			caches = dict()
+			for cache, (hits, misses) in self.caches.items():
+				caches[cache] = {'hits': hits, 'misses': misses, 'hit_rate': float(hits) / (hits + misses)}
+		finally:
+			self.lock.release()
+
+		calls.sort(key=lambda call: -call['time'])
+		return {'timestamp': time.time(), 'uptime': time.time() - self.started, 'calls': calls, 'caches': caches}
+
+
+	def prometheus(self, prefix='pycivi'):
+		"""
+		returns the current numbers in the Prometheus text exposition format
+		"""
+		self.lock.acquire()
+		try:
+			lines = list()
+			for name, kind, help, value in [
+					('api_calls_total', 'counter', 'API calls', lambda metrics: metrics.calls),
+					('api_errors_total', 'counter', 'failed API calls', lambda metrics: metrics.errors),
+					('api_bytes_in_total', 'counter', 'bytes received', lambda metrics: metrics.bytes_in),
+					('api_bytes_out_total', 'counter', 'bytes sent', lambda metrics: metrics.bytes_out)]:
+				lines.append('# HELP %s_%s %s' % (prefix, name, help))
+				lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+				for key in sorted(self.calls):
+					lines.append('%s_%s{%s} %d' % (prefix, name, _labels(key), value(self.calls[key])))
+
+			name = prefix + '_api_call_duration_seconds'
+			lines.append('# HELP %s API call latency' % name)
+			lines.append('# TYPE %s histogram' % name)
+			for key in sorted(self.calls):
+				latency = self.calls[key].latency
+				labels = _labels(key)
+				cumulative = 0
+				for bound, count in zip(self.buckets, latency.counts):
+					cumulative += count
+					lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+				lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, latency.count))
+				lines.append('%s_sum{%s} %f' % (name, labels, latency.sum))
+				lines.append('%s_count{%s} %d' % (name, labels, latency.count))
+
+			for name, help, index in [('cache_hits_total', 'lookup cache hits', 0), ('cache_misses_total', 'lookup cache misses', 1)]:
+				lines.append('# HELP %s_%s %s' % (prefix, name, help))
+				lines.append('# TYPE %s_%s counter' % (prefix, name))
+				for cache in sorted(self.caches):
+					lines.append('%s_%s{cache="%s"} %d' % (prefix, name, _escape(cache), self.caches[cache][index]))
+		finally:
+			self.lock.release()
+		return '\n'.join(lines) + '\n'
+
+
+	def writeSnapshot(self, path):
+		"""
+		write the snapshot to the given file (replaced atomically)
+		"""
+		temp_path = path + '.tmp'
+		output = open(temp_path, 'w')
+		json.dump(self.snapshot(), output, indent=1, sort_keys=True)
+		output.close()
+		os.rename(temp_path, path)
+
+
+	def startSnapshots(self, path, interval=60):
+		"""
+		write the snapshot to the given file every interval seconds, until stopSnapshots()
+		"""
+		self.stopSnapshots()
+		self.snapshot_writer = SnapshotWriter(self, path, interval)
+		self.snapshot_writer.start()
+
+
+	def stopSnapshots(self):
+		"""
+		stop the periodic snapshots, and write a final one
+		"""
+		if self.snapshot_writer:
+			self.snapshot_writer.stop()
+			self.snapshot_writer = None
+
+
+class SnapshotWriter(threading.Thread):
+	"""
+	Writes the registry's JSON snapshot periodically
+	"""
+	def __init__(self, registry, path, interval):
+		threading.Thread.__init__(self, name='MetricsSnapshots')
+		self.daemon = True
+		self.registry = registry
+		self.path = path
+		self.interval = interval
+		self.stopped = threading.Event()
+
+	def run(self):
+		while not self.stopped.isSet():
+			self.stopped.wait(self.interval)
+			self.registry.writeSnapshot(self.path)
+
+	def stop(self):
+		self.stopped.set()
+		self.join()
+
+
+def _escape(value):
+	return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key):
+	return 'backend="%s",entity="%s",action="%s"' % tuple([_escape(value) for value in key])
+
+
+# the registry used by all CiviCRM instances, unless they're given another one
+registry = MetricsRegistry()
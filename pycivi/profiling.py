@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+CPU profiling of import runs, switched on with the import parameters:
+
+	parameters['profile']          output prefix, writes <prefix>.pstats and <prefix>.collapsed
+	parameters['profile_mode']     'cprofile' (default): cProfile and stack sampling,
+	                               'sampling': stack sampling only, much less overhead
+	parameters['profile_workers']  'all' (default) or 'one': only profile the first worker
+	parameters['profile_interval'] seconds between stack samples (default 0.005)
+
+<prefix>.collapsed holds the sampled stacks in the collapsed format of
+flamegraph.pl / speedscope. Its root frame separates the client's CPU time ('cpu')
+from the time spent waiting for the server, locks or sleeps ('wait').
+
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import linecache
+import threading
+
+
+# leaf frames in these modules are waiting, not working
+WAIT_MODULES = ['socket.py', 'ssl.py', 'threading.py', 'Queue.py', 'subprocess.py', 'select.py']
+# ...as are calls to these (C functions don't show up as frames)
+WAIT_CALLS = ['sleep(', '.wait(', '.recv(', '.acquire(', '.communicate(', '.join(', '.get(True', 'select(']
+
+_running = [0]
+_running_lock = threading.Lock()
+
+
+def running():
+	"""
+	True if a profiling session is active in this process
+	"""
+	return _running[0] > 0
+
+
+def _frame_label(code):
+	return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+def _is_waiting(frame):
+	if os.path.basename(frame.f_code.co_filename) in WAIT_MODULES:
+		return True
+	line = linecache.getline(frame.f_code.co_filename, frame.f_lineno)
+	for call in WAIT_CALLS:
+		if call in line:
+			return True
+	return False
+
+
+class StackSampler(threading.Thread):
+	"""
+	Samples the stacks of the registered threads every interval seconds
+	"""
+	def __init__(self, interval=0.005):
+		threading.Thread.__init__(self, name='StackSampler')
+		self.daemon = True
+		self.interval = interval
+		self.threads = set()
+		self.stacks = dict()		# collapsed stack -> samples
+		self.samples = {'cpu': 0, 'wait': 0}
+		self.stopped = threading.Event()
+
+	def run(self):
+		while not self.stopped.isSet():
+			frames = sys._current_frames()
+			for ident in list(self.threads):
+				frame = frames.get(ident, None)
+				if frame==None:
+					continue
+				category = _is_waiting(frame) and 'wait' or 'cpu'
+				labels = list()
+				while frame:
+					labels.append(_frame_label(frame.f_code))
+					frame = frame.f_back
+				labels.append(category)
+				stack = ';'.join(reversed(labels))
+				self.stacks[stack] = self.stacks.get(stack, 0) + 1
+				self.samples[category] += 1
+			del frames
+			self.stopped.wait(self.interval)
+
+	def stop(self):
+		self.stopped.set()
+		self.join()
+
+
+class ProfileSession:
+	"""
+	Profiles the functions passed to run() (in whatever thread they run),
+	close() writes the merged results
+	"""
+
+	def __init__(self, output, mode='cprofile', interval=0.005):
+		if not mode in ['cprofile', 'sampling']:
+			raise Exception("Unknown profile_mode '%s'" % mode)
+		self.output = output
+		self.mode = mode
+		self.profiles = list()
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.sampler = StackSampler(interval)
+		self.sampler.start()
+		_running_lock.acquire()
+		_running[0] += 1
+		_running_lock.release()
+
+
+	def run(self, function, *args, **kwargs):
+		"""
+		run the function in the current thread, profiled
+		"""
+		ident = threading.currentThread().ident
+		self.sampler.threads.add(ident)
+		try:
+			if self.mode=='cprofile':
+				profile = cProfile.Profile()
+				try:
+					return profile.runcall(function, *args, **kwargs)
+				finally:
+					self.lock.acquire()
+					self.profiles.append(profile)
+					self.lock.release()
+			else:
+				return function(*args, **kwargs)
+		finally:
+			self.sampler.threads.discard(ident)
+
+
+	def close(self, civicrm=None):
+		"""
+		stop sampling and write <output>.pstats (cprofile mode) and <output>.collapsed
+		"""
+		self.sampler.stop()
+		_running_lock.acquire()
+		_running[0] -= 1
+		_running_lock.release()
+
+		if self.profiles:
+			statistics = pstats.Stats(self.profiles[0])
+			for profile in self.profiles[1:]:
+				statistics.add(profile)
+			statistics.dump_stats(self.output + '.pstats')
+		write_collapsed(self.sampler.stacks, self.output + '.collapsed')
+
+		summary = self.summary()
+		if civicrm:
+			civicrm.log(u"Profile written to '%s': %d samples, %.1f%% client CPU, %.1f%% waiting" % (self.output,
+				summary['samples'], summary['cpu_share'] * 100, summary['wait_share'] * 100),
+				logging.INFO, 'importer', 'profile', None, None, None, time.time()-self.started)
+		return summary
+
+
+	def summary(self):
+		samples = self.sampler.samples['cpu'] + self.sampler.samples['wait']
+		return {
+			'samples':    samples,
+			'cpu_share':  samples and float(self.sampler.samples['cpu']) / samples or 0.0,
+			'wait_share': samples and float(self.sampler.samples['wait']) / samples or 0.0,
+		}
+
+
+def start(parameters):
+	"""
+	the ProfileSession requested by the import parameters, or None
+	"""
+	if not parameters.get('profile', None) or running():
+		return None
+	return ProfileSession(parameters['profile'], parameters.get('profile_mode', 'cprofile'),
+		parameters.get('profile_interval', 0.005))
+
+
+def profiled(import_function):
+	"""
+	decorator for the import_* functions: profiles the whole call if
+	parameters['profile'] is set (and no session is running yet)
+	"""
+	def profiled_import(civicrm, record_source, parameters=dict()):
+		session = start(parameters)
+		if not session:
+			return import_function(civicrm, record_source, parameters)
+		try:
+			return session.run(import_function, civicrm, record_source, parameters)
+		finally:
+			session.close(civicrm)
+	profiled_import.__name__ = import_function.__name__
+	profiled_import.__doc__ = import_function.__doc__
+	return profiled_import
+
+
+def write_collapsed(stacks, path):
+	output = open(path, 'w')
+	for stack, count in sorted(stacks.items()):
+		output.write('%s %d\n' % (stack, count))
+	output.close()
+
+
+def merge(prefixes, output):
+	"""
+	merge the results of several sessions (e.g. one per process) into <output>.*
+	"""
+	pstats_files = [prefix + '.pstats' for prefix in prefixes if os.path.exists(prefix + '.pstats')]
+	if pstats_files:
+		pstats.Stats(*pstats_files).dump_stats(output + '.pstats')
+
+	stacks = dict()
+	for prefix in prefixes:
+		if not os.path.exists(prefix + '.collapsed'):
+			continue
+		for line in open(prefix + '.collapsed'):
+			stack, count = line.rstrip('\n').rsplit(' ', 1)
+			stacks[stack] = stacks.get(stack, 0) + int(count)
+	write_collapsed(stacks, output + '.collapsed')
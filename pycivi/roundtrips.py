@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Round trip budget of the import functions: counts the API calls per record
+and flags the ones that could be batched or cached.
+
+	analyser = RoundTripAnalyser(civicrm)
+	importer.import_contact_email(analyser, records)
+	print analyser.report()
+
+	import_contact_email: 3.2 calls/record, 1.1 avoidable
+	  ...
+
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+import json
+import threading
+
+from CiviCRM import CiviCRM
+import tracing
+
+
+READ_ACTIONS = ['get', 'getsingle', 'getvalue', 'getcount', 'getquick']
+
+# entities holding configuration, identical lookups should be answered from a cache
+REFERENCE_ENTITIES = ['OptionGroup', 'OptionValue', 'LocationType', 'MembershipType', 'MembershipStatus',
+	'FinancialType', 'CustomField', 'CustomGroup', 'Campaign', 'Tag', 'Group']
+
+PATTERNS = {
+	'repeated_get':     "identical read repeated within the record",
+	'uncached_lookup':  "configuration lookup already done for an earlier record",
+	'get_then_create':  "read before a create of the same entity, could be prefetched for a chunk",
+}
+
+
+class RoundTripAnalyser(CiviCRM):
+	"""
+	Wraps another CiviCRM instance and attributes every API call to the
+	import function and record it was made for (see tracing.traced_records)
+	"""
+
+	def __init__(self, instance, logfile=None):
+		CiviCRM.__init__(self, logfile)
+		self.wrapped_instance = instance
+		# only used to find the record a call belongs to, no spans are kept
+		self.tracer = tracing.Tracer(max_spans=0)
+		self.records = dict()
+		self.record_counts = dict()		# chunks count as the records they hold
+		self.records_lock = threading.Lock()
+
+
+	def performAPICall(self, params=dict(), execParams=dict()):
+		self._count(params)
+		return self.wrapped_instance.performAPICall(params)
+
+
+	def performSimpleAPICall(self, params=dict(), execParams=dict()):
+		self._count(params)
+		return self.wrapped_instance.performSimpleAPICall(params)
+
+
+	def close(self):
+		if hasattr(self.wrapped_instance, 'close'):
+			self.wrapped_instance.close()
+
+
+	def _count(self, params):
+		root = self.tracer.root()
+		if root:
+			key = (root.name, root.trace_id)
+			if root.attributes and 'records' in root.attributes:
+				self.record_counts[key] = root.attributes['records']
+		else:
+			key = ('(no record)', None)
+		call = (params.get('entity', ''), params.get('action', ''), json.dumps(params, sort_keys=True, default=unicode))
+		self.records_lock.acquire()
+		if key in self.records:
+			self.records[key].append(call)
+		else:
+			self.records[key] = [call]
+		self.records_lock.release()
+
+
+	def analyse(self):
+		"""
+		returns {function: {'records': n, 'calls': n, 'avoidable': n,
+		                    'by_call': {(entity, action): n},
+		                    'patterns': {pattern: {(entity, action): n}}}}
+		"""
+		self.records_lock.acquire()
+		records = sorted(self.records.items(), key=lambda item: item[0][1])
+		record_counts = dict(self.record_counts)
+		self.records_lock.release()
+
+		functions = dict()
+		lookups_done = dict()
+		for (function, trace_id), calls in records:
+			if not function in functions:
+				functions[function] = {'records': 0, 'calls': 0, 'avoidable': 0, 'by_call': dict(),
+					'patterns': dict([(pattern, dict()) for pattern in PATTERNS])}
+				lookups_done[function] = set()
+			stats = functions[function]
+			stats['records'] += record_counts.get((function, trace_id), 1)
+			seen = set()
+			reads = dict()
+			for entity, action, signature in calls:
+				stats['calls'] += 1
+				stats['by_call'][(entity, action)] = stats['by_call'].get((entity, action), 0) + 1
+
+				pattern = None
+				if action in READ_ACTIONS:
+					if signature in seen:
+						pattern = 'repeated_get'
+					elif entity in REFERENCE_ENTITIES and signature in lookups_done[function]:
+						pattern = 'uncached_lookup'
+					seen.add(signature)
+					reads[entity] = action
+					if entity in REFERENCE_ENTITIES:
+						lookups_done[function].add(signature)
+				elif action=='create' and entity in reads and record_counts.get((function, trace_id), 1)==1:
+					# it's the read that could have been done for the whole chunk
+					# (unless this is a chunk already)
+					pattern = 'get_then_create'
+					action = reads.pop(entity)
+
+				if pattern:
+					stats['avoidable'] += 1
+					counts = stats['patterns'][pattern]
+					counts[(entity, action)] = counts.get((entity, action), 0) + 1
+		return functions
+
+
+	def report(self):
+		"""
+		returns the analysis as text
+		"""
+		lines = list()
+		for function, stats in sorted(self.analyse().items()):
+			records = float(stats['records'] or 1)
+			lines.append("%s: %.1f calls/record, %.1f avoidable (%d records, %d calls)" % (function,
+				stats['calls'] / records, stats['avoidable'] / records, stats['records'], stats['calls']))
+			for (entity, action), count in sorted(stats['by_call'].items(), key=lambda item: -item[1]):
+				lines.append("  %-32s %6.2f/record" % ('%s.%s' % (entity, action), count / records))
+			for pattern, counts in sorted(stats['patterns'].items()):
+				for (entity, action), count in sorted(counts.items(), key=lambda item: -item[1]):
+					lines.append("  ! %-30s %6.2f/record  %s" % ('%s.%s' % (entity, action), count / records, PATTERNS[pattern]))
+		return '\n'.join(lines)
@@ -0,0 +1,981 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+An in-memory stand-in for CiviCRM's extern/rest.php, covering the APIv3
+subset pycivi uses. Meant for benchmarks and tests without a live site:
+
+	server = StandInServer(('127.0.0.1', 0), StandInAPI(latency=0.005))
+	server.start()
+	civicrm = CiviCRM_REST.CiviCRM_REST(server.url, 'site_key', 'api_key')
+	...
+	server.stop()
+
+or from the command line:
+
+	python pycivi/standin_server.py --port 8888 --latency 0.01 --fixtures fixtures.json
+
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+import json
+import time
+import random
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import optparse
+import Queue
+import uuid
+import socket
+import struct
+
+
+# parameters that are not field filters
+RESERVED_PARAMETERS = set(['entity', 'action', 'version', 'sequential', 'json', 'key', 'api_key',
+	'debug', 'return', 'options', 'check_permissions', 'dupe_check', 'prettyprint'])
+
+# entities that refer to their parent with entity_id/entity_table rather than <parent>_id
+ENTITY_REFERENCES = set(['entitytag', 'note', 'customvalue', 'entityfile'])
+
+DEFAULT_LIMIT = 25
+
+
+def _normalize(value):
+	"""
+	CiviCRM returns all DB values as strings
+	"""
+	if value==None or type(value) in (dict, list):
+		return value
+	if type(value)==bool:
+		return value and u'1' or u'0'
+	if type(value)==str:
+		return unicode(value, 'utf8')
+	return unicode(value)
+
+
+def _number(value):
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return None
+
+
+def _sortKey(value):
+	"""
+	numbers before strings, numbers sorted by value
+	"""
+	number = _number(value)
+	if number==None:
+		return (1, value)
+	return (0, number)
+
+
+def _like(pattern):
+	"""
+	turn a SQL LIKE pattern into a matching function (case insensitive, like MySQL)
+	"""
+	parts = _normalize(pattern).lower().split(u'%')
+	def matches(value):
+		if value==None:
+			return False
+		value = value.lower()
+		if len(parts)==1:
+			return value==parts[0]
+		if not value.startswith(parts[0]) or not value.endswith(parts[-1]):
+			return False
+		position = len(parts[0])
+		end = len(value) - len(parts[-1])
+		for part in parts[1:-1]:
+			position = value.find(part, position, end)
+			if position < 0:
+				return False
+			position += len(part)
+		return position <= end
+	return matches
+
+
+def _items(operand):
+	"""
+	the items of an IN operand, given as list or comma separated string
+	"""
+	if not isinstance(operand, (list, tuple)):
+		operand = unicode(operand).split(',')
+	return operand
+
+
+def _compare(value, operator, operand):
+	if operator in ('IS NULL', 'IS NOT NULL'):
+		is_null = value==None or value==u''
+		return is_null==(operator=='IS NULL')
+	if operator in ('IN', 'NOT IN'):
+		found = value in set([_normalize(item) for item in _items(operand)])
+		return found==(operator=='IN')
+	if operator in ('LIKE', 'NOT LIKE'):
+		return _like(operand)(value)==(operator=='LIKE')
+	if operator=='BETWEEN':
+		return _compare(value, '>=', operand[0]) and _compare(value, '<=', operand[1])
+	if operator in ('=', '!=', '<>'):
+		equal = value==_normalize(operand)
+		if not equal and _number(value)!=None:
+			equal = _number(value)==_number(operand)
+		return equal==(operator=='=')
+
+	if value==None:
+		return False
+	left, right = _number(value), _number(operand)
+	if left==None or right==None:
+		left, right = value, _normalize(operand)
+	if operator=='>':
+		return left > right
+	elif operator=='>=':
+		return left >= right
+	elif operator=='<':
+		return left < right
+	elif operator=='<=':
+		return left <= right
+	raise StandInError("Unsupported operator '%s'" % operator)
+
+
+class StandInError(Exception):
+	def __init__(self, message, **details):
+		Exception.__init__(self, message)
+		self.details = details
+
+
+class _Table:
+	"""
+	records of one entity, with equality indexes built on demand
+	"""
+	def __init__(self):
+		self.records = dict()
+		self.next_id = 1
+		self.indexes = dict()
+
+	def insert(self, record):
+		record_id = self.next_id
+		self.next_id += 1
+		record['id'] = unicode(record_id)
+		self.records[record_id] = record
+		for field, index in self.indexes.items():
+			index.setdefault(record.get(field), set()).add(record_id)
+		return record
+
+	def update(self, record, values):
+		for field, index in self.indexes.items():
+			if field in values:
+				index.get(record.get(field), set()).discard(int(record['id']))
+				index.setdefault(values[field], set()).add(int(record['id']))
+		record.update(values)
+
+	def delete(self, record):
+		record_id = int(record['id'])
+		del self.records[record_id]
+		for field, index in self.indexes.items():
+			index.get(record.get(field), set()).discard(record_id)
+
+	def lookup(self, field, value):
+		"""
+		ids of the records with record[field]==value
+		"""
+		if field=='id':
+			try:
+				record_id = int(value)
+			except (TypeError, ValueError):
+				return set()
+			return record_id in self.records and set([record_id]) or set()
+		index = self.indexes.get(field, None)
+		if index==None:
+			index = self.indexes[field] = dict()
+			for record_id, record in self.records.iteritems():
+				index.setdefault(record.get(field), set()).add(record_id)
+		return index.get(value, set())
+
+
+class StandInAPI:
+	"""
+	In-memory implementation of the APIv3 subset used by pycivi:
+	  - get, getsingle, getcount, getquick, create (and update), delete
+	  - sequential, option.limit/offset/sort, options, return
+	  - filters: plain values and {'IN'|'NOT IN'|'LIKE'|'NOT LIKE'|'BETWEEN'|'='|'!='|'<'|'>'|...: operand}
+	  - dupe_check and unique external_identifiers for contacts
+	  - chained calls ('api.Entity.action')
+	  - EntityTag/GroupContact create/delete reporting added/removed
+	  - ApiBridge create/delete, with the bridges served by a StandInServer
+
+	Every call waits latency seconds (plus up to latency_jitter) before it's executed.
+	"""
+
+	def __init__(self, site_key=None, api_key=None, latency=0.0, latency_jitter=0.0, fixtures=None, seed=None):
+		self.site_key = site_key
+		self.api_key = api_key
+		self.latency = latency
+		self.latency_jitter = latency_jitter
+		self.random = random.Random(seed)
+		self.tables = dict()
+		self.lock = threading.RLock()
+		self.calls = 0
+		self.base_url = None
+		self.bridges = dict()
+		self.bridge_lifetime = 3600
+		if fixtures:
+			self.load(fixtures)
+
+
+	def load(self, fixtures):
+		"""
+		create the given entities, fixtures: {entity: [record, ...]}
+		"""
+		for entity, records in sorted(fixtures.items()):
+			for record in records:
+				params = dict(record)
+				params['entity'] = entity
+				params['action'] = 'create'
+				params['key'] = self.site_key
+				params['api_key'] = self.api_key
+				result = self.call(params, simulate_latency=False)
+				if result['is_error']:
+					raise StandInError(result['error_message'])
+
+
+	def call(self, params, simulate_latency=True, authenticated=False):
+		"""
+		execute an API call, params being the (decoded) request parameters
+		"""
+		if simulate_latency and (self.latency or self.latency_jitter):
+			time.sleep(self.latency + self.random.random() * self.latency_jitter)
+
+		params = dict(params)
+		if params.get('json', None) not in (None, 1, '1', 0, '0', ''):
+			# complex parameters packed into a json block
+			try:
+				params.update(json.loads(params['json']))
+			except ValueError:
+				return {'is_error': 1, 'error_message': "Invalid JSON in parameter 'json'"}
+		if not authenticated and ((self.site_key and params.get('key')!=self.site_key) or (self.api_key and params.get('api_key')!=self.api_key)):
+			return {'is_error': 1, 'error_message': "Failed to authenticate key"}
+		if not params.get('entity') or not params.get('action'):
+			return {'is_error': 1, 'error_message': "Mandatory key(s) missing from params array: entity, action"}
+
+		self.lock.acquire()
+		try:
+			self.calls += 1
+			return self._execute(params['entity'], params['action'].lower(), params)
+		except StandInError as error:
+			result = {'is_error': 1, 'error_message': str(error)}
+			result.update(error.details)
+			return result
+		finally:
+			self.lock.release()
+
+
+	def _table(self, entity):
+		entity = entity.lower()
+		table = self.tables.get(entity, None)
+		if table==None:
+			table = self.tables[entity] = _Table()
+		return table
+
+
+	def _execute(self, entity, action, params):
+		sequential = str(params.get('sequential', '0'))=='1'
+		if entity.lower()=='apibridge':
+			return self._apiBridge(action, params)
+		elif action=='get':
+			values = self._chain(entity, self._get(entity, params), params)
+			return self._result(values, sequential)
+		elif action=='getsingle':
+			values = self._chain(entity, self._get(entity, params), params)
+			if len(values)!=1:
+				raise StandInError("Expected one %s but found %d" % (entity, len(values)))
+			return values[0]
+		elif action=='getcount':
+			count = len(self._get(entity, params, paged=False))
+			return {'is_error': 0, 'version': 3, 'count': count, 'result': count}
+		elif action=='getquick':
+			return self._result(self._getquick(entity, params), sequential)
+		elif action=='create':
+			if entity.lower()=='entitytag':
+				return self._entityTag(params, True)
+			elif entity.lower()=='groupcontact':
+				return self._groupContact(params, True)
+			values = self._chain(entity, [self._create(entity, params)], params)
+			return self._result(values, sequential)
+		elif action=='delete':
+			if entity.lower()=='entitytag':
+				return self._entityTag(params, False)
+			elif entity.lower()=='groupcontact':
+				return self._groupContact(params, False)
+			return self._delete(entity, params)
+		else:
+			raise StandInError("API (%s, %s) does not exist" % (entity, action))
+
+
+	def _result(self, values, sequential):
+		result = {'is_error': 0, 'version': 3, 'count': len(values)}
+		if len(values)==1:
+			result['id'] = values[0].get('id')
+		if sequential:
+			result['values'] = values
+		else:
+			result['values'] = dict([(value.get('id'), value) for value in values])
+		return result
+
+
+	def _options(self, params):
+		options = params.get('options', dict())
+		if isinstance(options, basestring):
+			try:
+				options = json.loads(options)
+			except ValueError:
+				options = dict()
+		options = dict(options)
+		for key, value in params.items():
+			if key.startswith('option.'):
+				options[key[7:]] = value
+		return options
+
+
+	def _filters(self, entity, params):
+		filters = list()
+		for key, value in params.items():
+			if key in RESERVED_PARAMETERS or key.startswith('option.') or key.startswith('api.'):
+				continue
+			if entity.lower()=='contact' and key=='contact_id':
+				key = 'id'
+			elif entity.lower()=='entitytag' and key=='contact_id':
+				key = 'entity_id'
+				filters.append(('entity_table', '=', u'civicrm_contact'))
+			if isinstance(value, dict):
+				for operator, operand in value.items():
+					filters.append((key, operator.upper(), operand))
+			else:
+				filters.append((key, '=', value))
+		return filters
+
+
+	def _get(self, entity, params, paged=True):
+		table = self._table(entity)
+		filters = self._filters(entity, params)
+		if entity.lower()=='groupcontact' and not 'status' in params:
+			filters.append(('status', '=', u'Added'))
+
+		# narrow down with an index, if there is an equality filter
+		candidates = None
+		for field, operator, operand in filters:
+			if entity.lower()=='contact' and field=='email':
+				# lives in the Email table
+				continue
+			if operator=='=':
+				candidates = table.lookup(field, _normalize(operand))
+				break
+			elif operator=='IN':
+				candidates = set()
+				for item in _items(operand):
+					candidates |= table.lookup(field, _normalize(item))
+				break
+		if candidates==None:
+			candidates = table.records.keys()
+
+		records = list()
+		for record_id in sorted(candidates):
+			record = table.records[record_id]
+			for field, operator, operand in filters:
+				if not _compare(self._field(entity, record, field), operator, operand):
+					break
+			else:
+				records.append(record)
+
+		options = self._options(params)
+		if options.get('sort'):
+			for sort in reversed(unicode(options['sort']).split(',')):
+				sort = sort.strip().split()
+				descending = len(sort) > 1 and sort[1].upper()=='DESC'
+				records.sort(key=lambda record: _sortKey(self._field(entity, record, sort[0])), reverse=descending)
+		if paged:
+			offset = int(options.get('offset', 0) or 0)
+			limit = int(options.get('limit', DEFAULT_LIMIT) or 0)
+			if limit:
+				records = records[offset:offset+limit]
+			else:
+				records = records[offset:]
+
+		return [self._output(entity, record, params.get('return', None)) for record in records]
+
+
+	def _field(self, entity, record, field):
+		if entity.lower()=='contact' and field=='email' and not 'email' in record:
+			emails = self._table('Email').lookup('contact_id', record['id'])
+			for email_id in sorted(emails):
+				email = self._table('Email').records[email_id]
+				if email.get('is_primary')==u'1':
+					return email.get('email')
+			return None
+		return record.get(field)
+
+
+	def _output(self, entity, record, fields):
+		output = dict(record)
+		if entity.lower()=='contact':
+			output['contact_id'] = record['id']
+			output['email'] = self._field(entity, record, 'email')
+		if fields:
+			if isinstance(fields, basestring):
+				fields = fields.split(',')
+			fields = set([field.strip() for field in fields] + ['id'])
+			for field in output.keys():
+				if not field in fields:
+					del output[field]
+		return output
+
+
+	def _getquick(self, entity, params):
+		matches = _like(unicode(params.get('name', u'')) + u'%')
+		records = list()
+		for record_id in sorted(self._table(entity).records):
+			record = self._table(entity).records[record_id]
+			if matches(record.get('sort_name')) or matches(record.get('display_name')) \
+				or matches(self._field(entity, record, 'email')):
+				records.append(self._output(entity, record, None))
+				if len(records) >= 10:
+					break
+		return records
+
+
+	def _values(self, params):
+		values = dict()
+		for key, value in params.items():
+			if key in RESERVED_PARAMETERS or key=='id' or key.startswith('option.') or key.startswith('api.'):
+				continue
+			values[key] = _normalize(value)
+		return values
+
+
+	def _create(self, entity, params):
+		table = self._table(entity)
+		values = self._values(params)
+		is_contact = entity.lower()=='contact'
+
+		if params.get('id'):
+			ids = table.lookup('id', params['id'])
+			if not ids:
+				raise StandInError("%s %s not found" % (entity, params['id']))
+			record = table.records[list(ids)[0]]
+		else:
+			record = None
+
+		if is_contact:
+			if record==None and not values.get('contact_type'):
+				raise StandInError("Mandatory key(s) missing from params array: contact_type")
+			if values.get('external_identifier'):
+				for other_id in table.lookup('external_identifier', values['external_identifier']):
+					if record==None or other_id!=int(record['id']):
+						raise StandInError("DB Error: already exists")
+			if record==None and str(params.get('dupe_check', '0'))=='1':
+				duplicates = self._duplicates(values)
+				if duplicates:
+					raise StandInError("Found matching contacts: %s" % ','.join(duplicates),
+						error_code='duplicate', ids=duplicates)
+
+		email = None
+		if is_contact and 'email' in values:
+			email = values.pop('email')
+
+		if record==None:
+			if is_contact:
+				values.setdefault('is_deleted', u'0')
+			record = table.insert(values)
+		else:
+			table.update(record, values)
+
+		if is_contact:
+			self._contactNames(record)
+			if email:
+				self._primaryEmail(record['id'], email)
+		return self._output(entity, record, None)
+
+
+	def _contactNames(self, record):
+		if record.get('contact_type')==u'Organization':
+			name = record.get('organization_name') or u''
+			record['display_name'] = record['sort_name'] = name
+		elif record.get('contact_type')==u'Household':
+			name = record.get('household_name') or u''
+			record['display_name'] = record['sort_name'] = name
+		else:
+			first, last = record.get('first_name') or u'', record.get('last_name') or u''
+			record['display_name'] = (first + u' ' + last).strip()
+			record['sort_name'] = last and first and (last + u', ' + first) or (last or first)
+
+
+	def _primaryEmail(self, contact_id, address):
+		emails = self._table('Email')
+		for email_id in emails.lookup('contact_id', contact_id):
+			if emails.records[email_id].get('is_primary')==u'1':
+				emails.update(emails.records[email_id], {'email': address})
+				return
+		emails.insert({'contact_id': contact_id, 'email': address, 'is_primary': u'1', 'location_type_id': u'1'})
+
+
+	def _duplicates(self, values):
+		"""
+		very basic dedupe rules: same email, or same contact type and name
+		"""
+		table = self._table('Contact')
+		duplicates = set()
+		if values.get('email'):
+			emails = self._table('Email')
+			for email_id in emails.lookup('email', values['email']):
+				duplicates.add(emails.records[email_id]['contact_id'])
+		if values.get('contact_type')==u'Organization':
+			keys = ['organization_name']
+		elif values.get('contact_type')==u'Household':
+			keys = ['household_name']
+		else:
+			keys = ['first_name', 'last_name']
+		if [key for key in keys if values.get(key)]:
+			candidates = table.lookup(keys[0], values.get(keys[0]))
+			for record_id in candidates:
+				record = table.records[record_id]
+				if record.get('contact_type')==values.get('contact_type') \
+					and not [key for key in keys if record.get(key)!=values.get(key)]:
+					duplicates.add(record['id'])
+		return sorted(duplicates, key=int)
+
+
+	def _delete(self, entity, params):
+		table = self._table(entity)
+		if not params.get('id'):
+			raise StandInError("Mandatory key(s) missing from params array: id")
+		ids = table.lookup('id', params['id'])
+		if not ids:
+			raise StandInError("Could not delete %s %s" % (entity, params['id']))
+		table.delete(table.records[list(ids)[0]])
+		return {'is_error': 0, 'version': 3, 'count': 1, 'values': 1}
+
+
+	def _list(self, value):
+		if isinstance(value, (list, tuple)):
+			return [_normalize(item) for item in value]
+		return [_normalize(value)]
+
+
+	def _prefixed(self, params, *prefixes):
+		"""
+		the values of all parameters starting with one of the prefixes, that's how
+		EntityTag/GroupContact take several IDs ('contact_id.1', 'contact_id.2', ...)
+		"""
+		values = list()
+		for key in sorted(params):
+			for prefix in prefixes:
+				if key.startswith(prefix):
+					values += self._list(params[key])
+					break
+		return values or [None]
+
+
+	def _entityTag(self, params, add):
+		table = self._table('EntityTag')
+		entity_table = _normalize(params.get('entity_table', 'civicrm_contact'))
+		entity_ids = self._prefixed(params, 'entity_id', 'contact_id')
+		tag_ids = self._prefixed(params, 'tag_id')
+		if entity_ids==[None] or tag_ids==[None]:
+			raise StandInError("Mandatory key(s) missing from params array: entity_id, tag_id")
+
+		changed, unchanged = 0, 0
+		for entity_id in entity_ids:
+			current = dict()
+			for record_id in table.lookup('entity_id', entity_id):
+				record = table.records[record_id]
+				if record.get('entity_table')==entity_table:
+					current[record['tag_id']] = record
+			for tag_id in tag_ids:
+				if add and not tag_id in current:
+					current[tag_id] = table.insert({'entity_table': entity_table, 'entity_id': entity_id, 'tag_id': tag_id})
+					changed += 1
+				elif not add and tag_id in current:
+					table.delete(current.pop(tag_id))
+					changed += 1
+				else:
+					unchanged += 1
+
+		if add:
+			return {'is_error': 0, 'version': 3, 'added': changed, 'not_added': unchanged, 'total_count': changed+unchanged}
+		else:
+			return {'is_error': 0, 'version': 3, 'removed': changed, 'not_removed': unchanged, 'total_count': changed+unchanged}
+
+
+	def _groupContact(self, params, add):
+		table = self._table('GroupContact')
+		contact_ids = self._prefixed(params, 'contact_id')
+		group_ids = self._prefixed(params, 'group_id')
+		if contact_ids==[None] or group_ids==[None]:
+			raise StandInError("Mandatory key(s) missing from params array: contact_id, group_id")
+		status = _normalize(params.get('status', 'Added'))
+		if not add:
+			status = u'Removed'
+
+		changed, unchanged = 0, 0
+		for contact_id in contact_ids:
+			current = dict()
+			for record_id in table.lookup('contact_id', contact_id):
+				record = table.records[record_id]
+				current[record['group_id']] = record
+			for group_id in group_ids:
+				record = current.get(group_id, None)
+				if record==None:
+					if add:
+						table.insert({'contact_id': contact_id, 'group_id': group_id, 'status': status})
+						changed += 1
+					else:
+						unchanged += 1
+				elif record.get('status')!=status:
+					table.update(record, {'status': status})
+					changed += 1
+				else:
+					unchanged += 1
+
+		if add:
+			return {'is_error': 0, 'version': 3, 'added': changed, 'not_added': unchanged, 'total_count': changed+unchanged}
+		else:
+			return {'is_error': 0, 'version': 3, 'removed': changed, 'not_removed': unchanged, 'total_count': changed+unchanged}
+
+
+	def _chain(self, entity, values, params):
+		"""
+		execute the chained calls ('api.Entity.action') for each of the values
+		"""
+		chained = [key for key in params if key.startswith('api.')]
+		if not chained:
+			return values
+		for value in values:
+			for key in chained:
+				parts = key.split('.')
+				if len(parts)!=3:
+					raise StandInError("Invalid chained call '%s'" % key)
+				sub_entity, sub_action = parts[1], parts[2].lower()
+				sub_params = params[key]
+				if isinstance(sub_params, basestring):
+					try:
+						sub_params = json.loads(sub_params)
+					except ValueError:
+						sub_params = dict()
+				if not isinstance(sub_params, list):
+					sub_params = [sub_params]
+
+				results = list()
+				for sub_call in sub_params:
+					if not isinstance(sub_call, dict):
+						sub_call = dict()
+					sub_call = self._substitute(sub_call, value)
+					self._defaultReference(entity, sub_entity, sub_call, value)
+					sub_call['entity'] = sub_entity
+					sub_call['action'] = sub_action
+					sub_call['sequential'] = params.get('sequential', 0)
+					try:
+						results.append(self._execute(sub_entity, sub_action, sub_call))
+					except StandInError as error:
+						result = {'is_error': 1, 'error_message': str(error)}
+						result.update(error.details)
+						results.append(result)
+				if len(results)==1:
+					value[key] = results[0]
+				else:
+					value[key] = results
+		return values
+
+
+	def _substitute(self, params, parent):
+		substituted = dict()
+		for key, value in params.items():
+			if isinstance(value, basestring) and value.startswith('$value.'):
+				value = parent.get(value[7:])
+			substituted[key] = value
+		return substituted
+
+
+	def _defaultReference(self, entity, sub_entity, params, parent):
+		if sub_entity.lower()==entity.lower():
+			return
+		if sub_entity.lower() in ENTITY_REFERENCES:
+			if not 'entity_id' in params and not 'contact_id' in params:
+				params['entity_id'] = parent['id']
+				params.setdefault('entity_table', 'civicrm_' + entity.lower())
+		else:
+			reference = entity.lower() + '_id'
+			if not reference in params:
+				params[reference] = parent['id']
+
+
+	def _apiBridge(self, action, params):
+		if action=='create':
+			if not self.base_url:
+				raise StandInError("ApiBridges are only available through a StandInServer")
+			bridge = _Bridge(self, self.bridge_lifetime)
+			self.bridges[bridge.key] = bridge
+			url = '%s/bridge.php?bridge_key=%s' % (self.base_url, bridge.key)
+			values = {
+				'bridge_key': bridge.key,
+				'expires':    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(bridge.expires)),
+				'push_url':   url + '&action=push',
+				'fetch_url':  url + '&action=fetch',
+			}
+			return {'is_error': 0, 'version': 3, 'count': 1, 'values': values}
+		elif action=='delete':
+			bridge = self.bridges.pop(params.get('bridge_key'), None)
+			if not bridge:
+				raise StandInError("Bridge not found")
+			bridge.close()
+			return {'is_error': 0, 'version': 3, 'count': 1, 'values': 1}
+		raise StandInError("API (ApiBridge, %s) does not exist" % action)
+
+
+	def getBridge(self, bridge_key):
+		"""
+		the bridge with the given key, or None if it doesn't exist (anymore)
+		"""
+		self.lock.acquire()
+		try:
+			bridge = self.bridges.get(bridge_key, None)
+			if bridge and bridge.expires < time.time():
+				del self.bridges[bridge_key]
+				bridge.close()
+				bridge = None
+			return bridge
+		finally:
+			self.lock.release()
+
+
+
+class _Bridge:
+	"""
+	an ApiBridge: pushed calls are executed in order by a background thread,
+	the results are kept until they're fetched. Fetching a single call waits
+	for its result, bulk fetches report unfinished calls as pending.
+	"""
+	def __init__(self, api, lifetime):
+		self.api = api
+		self.key = uuid.uuid4().hex
+		self.expires = time.time() + lifetime
+		self.calls = Queue.Queue()
+		self.results = dict()
+		self.done = threading.Condition()
+		self.thread = threading.Thread(target=self._run, name='StandInBridge')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def push(self, call_id, params):
+		self.done.acquire()
+		self.results[call_id] = {'status': 'pending'}
+		self.done.release()
+		self.calls.put((call_id, params))
+
+	def fetch(self, call_id, timeout=0):
+		self.done.acquire()
+		try:
+			deadline = time.time() + timeout
+			while self.results.get(call_id, {}).get('status', None)=='pending' and time.time() < deadline:
+				self.done.wait(deadline - time.time())
+			result = self.results.get(call_id, None)
+			if result==None:
+				return {'status': 'pending'}
+			if result.get('status', None)!='pending':
+				del self.results[call_id]
+			return result
+		finally:
+			self.done.release()
+
+	def close(self):
+		self.calls.put(None)
+
+	def _run(self):
+		while True:
+			call = self.calls.get()
+			if call==None:
+				return
+			call_id, params = call
+			result = self.api.call(params, authenticated=True)
+			self.done.acquire()
+			self.results[call_id] = result
+			self.done.notifyAll()
+			self.done.release()
+
+
+
+class StandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""
+	answers API calls to .../extern/rest.php (GET and POST)
+	"""
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		url = urlparse.urlparse(self.path)
+		if url.path.endswith('bridge.php'):
+			self._bridge(url.query)
+		else:
+			self._answer(url.path, url.query)
+
+	def do_POST(self):
+		length = int(self.headers.getheader('content-length', 0))
+		body = self.rfile.read(length)
+		url = urlparse.urlparse(self.path)
+		if url.path.endswith('bridge.php'):
+			self._bridge(url.query, body)
+			return
+		if url.query:
+			body = url.query + '&' + body
+		self._answer(url.path, body)
+
+	def _bridge(self, query, body=None):
+		params = dict([(key, values[-1]) for key, values in urlparse.parse_qs(query).items()])
+		bridge = self.server.api.getBridge(params.get('bridge_key'))
+		if not bridge:
+			self._send(404, {'is_error': 1, 'error_message': "Bridge not found"})
+		elif params.get('action')=='push' and body!=None:
+			bridge.push(params.get('call_id'), json.loads(body))
+			self._send(200, {'is_error': 0})
+		elif params.get('action')=='fetch' and params.get('call_ids'):
+			results = dict()
+			for call_id in params['call_ids'].split(','):
+				results[call_id] = bridge.fetch(call_id)
+			self._send(200, results)
+		elif params.get('action')=='fetch':
+			self._send(200, bridge.fetch(params.get('call_id'), timeout=60))
+		else:
+			self._send(400, {'is_error': 1, 'error_message': "Invalid bridge request"})
+
+	def _answer(self, path, query):
+		if not path.endswith('rest.php'):
+			self._send(404, {'is_error': 1, 'error_message': "Not found"})
+			return
+		params = dict()
+		for key, values in urlparse.parse_qs(query, keep_blank_values=True).items():
+			params[key] = unicode(values[-1], 'utf8')
+
+		if self.server.faults:
+			url_length = None
+			if self.command=='GET':
+				url_length = len(self.path)
+			decision = self.server.faults.decide(params.get('action'), url_length)
+			if decision.delay:
+				time.sleep(decision.delay)
+			if decision.reset:
+				self._reset()
+				return
+			if decision.status:
+				self._send(decision.status, {'is_error': 1, 'error_message': "Simulated HTTP error %d" % decision.status})
+				return
+		self._send(200, self.server.api.call(params))
+
+	def _reset(self):
+		"""
+		drop the connection without an answer (RST instead of FIN)
+		"""
+		self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+		self.close_connection = 1
+		self.connection.close()
+
+	def finish(self):
+		try:
+			BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+		except socket.error:
+			# the connection was reset
+			pass
+
+	def _send(self, code, data):
+		body = json.dumps(data)
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	"""
+	threaded HTTP server for a StandInAPI, use the url property with CiviCRM_REST.
+	faults can be a faults.FaultProfile, simulating latencies, HTTP errors and resets.
+	"""
+	daemon_threads = True
+	allow_reuse_address = True
+	request_queue_size = 128
+
+	def __init__(self, address=('127.0.0.1', 0), api=None, faults=None):
+		BaseHTTPServer.HTTPServer.__init__(self, address, StandInRequestHandler)
+		self.faults = faults
+		self.api = api or StandInAPI()
+		self.api.base_url = self.url
+		self.thread = None
+
+	@property
+	def url(self):
+		return 'http://%s:%d' % self.server_address[:2]
+
+	@property
+	def rest_url(self):
+		return self.url + '/sites/all/modules/civicrm/extern/rest.php'
+
+	def start(self):
+		self.thread = threading.Thread(target=self.serve_forever, name='StandInServer')
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+		if self.thread:
+			self.thread.join()
+			self.thread = None
+
+
+
+if __name__ == '__main__':
+	parser = optparse.OptionParser(usage="usage: %prog [options]")
+	parser.add_option('--host', default='127.0.0.1')
+	parser.add_option('--port', type='int', default=8888)
+	parser.add_option('--latency', type='float', default=0.0, help="seconds per call")
+	parser.add_option('--jitter', type='float', default=0.0, help="additional random seconds per call")
+	parser.add_option('--site-key', default=None)
+	parser.add_option('--api-key', default=None)
+	parser.add_option('--fixtures', default=None, help="JSON file {entity: [record, ...]}")
+	parser.add_option('--seed', type='int', default=None)
+	(options, args) = parser.parse_args()
+
+	fixtures = None
+	if options.fixtures:
+		fixtures = json.load(open(options.fixtures))
+	api = StandInAPI(options.site_key, options.api_key, options.latency, options.jitter, fixtures, options.seed)
+	server = StandInServer((options.host, options.port), api)
+	print "Serving CiviCRM stand-in on %s" % server.url
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,292 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Span tracing of the importers: every record, every CiviCRM lookup/write method
+and every API call becomes a timed span, nested in the one it was called from.
+
+	civicrm.tracer = tracing.Tracer(sample_rate=0.1)
+	importer.import_contact_phone(civicrm, records)
+	civicrm.tracer.writeChromeTrace('phone.trace.json')   # open in chrome://tracing
+
+This is a python API wrapper for CiviCRM (https://civicrm.org/)
+Copyright (C) 2013 Systopia  (endres@systopia.de)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+__author__      = "Björn Endres"
+__copyright__   = "Copyright 2013, Systopia"
+__license__     = "GPLv3"
+__maintainer__  = "Björn Endres"
+__email__       = "endres[at]systopia.de"
+
+import os
+import json
+import time
+import random
+import threading
+import itertools
+
+
+class Span:
+	"""
+	A timed operation: ids link it to its trace (the record) and its parent span
+	"""
+	def __init__(self, name, trace_id, span_id, parent_id, attributes):
+		self.name = name
+		self.trace_id = trace_id
+		self.span_id = span_id
+		self.parent_id = parent_id
+		self.attributes = attributes
+		self.thread = threading.currentThread()
+		self.start = time.time()
+		self.duration = None
+		self.error = None
+
+	def toDict(self):
+		data = {
+			'name':      self.name,
+			'trace_id':  self.trace_id,
+			'span_id':   self.span_id,
+			'parent_id': self.parent_id,
+			'thread':    self.thread.name,
+			'start':     self.start,
+			'duration':  self.duration,
+		}
+		if self.attributes:
+			data['attributes'] = self.attributes
+		if self.error:
+			data['error'] = self.error
+		return data
+
+
+# placeholder for the spans of records that weren't sampled
+_UNSAMPLED = Span('unsampled', None, None, None, None)
+
+
+class Tracer:
+	"""
+	Collects the spans of the sampled records.
+
+	sample_rate   fraction of the records (root spans) to trace
+	output        if given, finished spans are written to this JSONL file
+	              right away instead of being kept in memory
+	max_spans     spans kept in memory at most, the rest are counted as dropped
+	"""
+
+	def __init__(self, sample_rate=1.0, output=None, max_spans=1000000, seed=None):
+		self.sample_rate = sample_rate
+		self.max_spans = max_spans
+		self.random = random.Random(seed)
+		self.ids = itertools.count(1)
+		self.local = threading.local()
+		self.lock = threading.Lock()
+		self.spans = list()
+		self.dropped = 0
+		self.output = output and open(output, 'a')
+
+
+	def _stack(self):
+		stack = getattr(self.local, 'stack', None)
+		if stack==None:
+			stack = self.local.stack = list()
+		return stack
+
+
+	def start(self, name, attributes=None):
+		"""
+		open a span as child of the thread's current span.
+		Without a current span, this starts a new trace (if sampled)
+		"""
+		stack = self._stack()
+		if stack:
+			parent = stack[-1]
+			if parent is _UNSAMPLED:
+				span = _UNSAMPLED
+			else:
+				span = Span(name, parent.trace_id, self.ids.next(), parent.span_id, attributes)
+		elif self.sample_rate >= 1.0 or self.random.random() < self.sample_rate:
+			span_id = self.ids.next()
+			span = Span(name, span_id, span_id, None, attributes)
+		else:
+			span = _UNSAMPLED
+		stack.append(span)
+		return span
+
+
+	def finish(self, span, error=None):
+		"""
+		close the span (and any child left open)
+		"""
+		stack = self._stack()
+		if not span in stack:
+			return
+		while stack:
+			closed = stack.pop()
+			if closed is not _UNSAMPLED:
+				closed.duration = time.time() - closed.start
+				if closed is span and error:
+					closed.error = error
+				self._store(closed)
+			if closed is span:
+				break
+
+
+	def record(self, name, duration, attributes=None, error=None):
+		"""
+		add a span that has already happened (ending now) to the current span,
+		e.g. an API call timed by the backend
+		"""
+		stack = self._stack()
+		if not stack or stack[-1] is _UNSAMPLED:
+			return
+		parent = stack[-1]
+		span = Span(name, parent.trace_id, self.ids.next(), parent.span_id, attributes)
+		span.duration = duration
+		span.start -= duration
+		span.error = error
+		self._store(span)
+
+
+	def root(self):
+		"""
+		the thread's outermost open span (usually the record), or None
+		"""
+		stack = self._stack()
+		if stack and stack[0] is not _UNSAMPLED:
+			return stack[0]
+		return None
+
+
+	def sampled(self):
+		"""
+		True if the thread is inside a traced span
+		"""
+		stack = self._stack()
+		return bool(stack) and stack[-1] is not _UNSAMPLED
+
+
+	def _store(self, span):
+		self.lock.acquire()
+		try:
+			if self.output:
+				self.output.write(json.dumps(span.toDict(), default=unicode) + '\n')
+			elif len(self.spans) < self.max_spans:
+				self.spans.append(span)
+			else:
+				self.dropped += 1
+		finally:
+			self.lock.release()
+
+
+	def close(self):
+		self.lock.acquire()
+		if self.output:
+			self.output.close()
+			self.output = None
+		self.lock.release()
+
+
+	def writeJSONL(self, path):
+		"""
+		write the collected spans to a JSONL file, one span per line
+		"""
+		output = open(path, 'w')
+		for span in list(self.spans):
+			output.write(json.dumps(span.toDict(), default=unicode) + '\n')
+		output.close()
+
+
+	def writeChromeTrace(self, path):
+		"""
+		write the collected spans in the Chrome trace event format
+		(chrome://tracing, Perfetto, speedscope)
+		"""
+		pid = os.getpid()
+		events = list()
+		threads = dict()
+		for span in list(self.spans):
+			threads[span.thread.ident] = span.thread.name
+			args = dict(span.attributes or {})
+			args['trace_id'] = span.trace_id
+			args['span_id'] = span.span_id
+			if span.parent_id:
+				args['parent_id'] = span.parent_id
+			if span.error:
+				args['error'] = span.error
+			events.append({'name': span.name, 'cat': 'pycivi', 'ph': 'X', 'pid': pid, 'tid': span.thread.ident,
+				'ts': int(span.start * 1000000), 'dur': int(span.duration * 1000000), 'args': args})
+		for ident, name in threads.items():
+			events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': ident, 'args': {'name': name}})
+		output = open(path, 'w')
+		json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, output, default=unicode)
+		output.close()
+
+
+def traced(method):
+	"""
+	decorator for CiviCRM methods: runs the method in a span if the instance has a tracer
+	"""
+	def traced_method(self, *args, **kwargs):
+		tracer = self.tracer
+		if not tracer:
+			return method(self, *args, **kwargs)
+		span = tracer.start(method.__name__)
+		if args and span is not _UNSAMPLED:
+			span.attributes = {'args': unicode(args)[:200]}
+		try:
+			result = method(self, *args, **kwargs)
+		except Exception as error:
+			tracer.finish(span, unicode(error))
+			raise
+		tracer.finish(span)
+		return result
+	traced_method.__name__ = method.__name__
+	traced_method.__doc__ = method.__doc__
+	return traced_method
+
+
+def traced_records(civicrm, record_source, name):
+	"""
+	iterates over the records (or chunks of records), each one in its own span.
+	The record's span ends when the next one is requested
+	"""
+	if not civicrm.tracer:
+		return record_source
+	return _traced_records(civicrm.tracer, record_source, name)
+
+
+def _traced_records(tracer, record_source, name):
+	span = None
+	try:
+		for record in record_source:
+			if span:
+				tracer.finish(span)
+			attributes = dict()
+			if isinstance(record, list):
+				# a chunk of records
+				attributes['records'] = len(record)
+			else:
+				for key in ('id', 'external_identifier', 'contact_id'):
+					if key in record:
+						attributes[key] = record[key]
+			span = tracer.start(name, attributes)
+			yield record
+	finally:
+		if span:
+			tracer.finish(span)